@@ -50,6 +50,8 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    # profiles title list, search and update requests with ?profile when IMDB_INFO_LOCAL_PROFILE_VIEWS is True
+    'imdb_info_local.profiling.ProfilingMiddleware',
 ]
 
 ROOT_URLCONF = 'config.urls'
@@ -159,3 +161,46 @@ IMDB_INFO_LOCAL_VIDEO_DIRS = {
         '/Volumes/dr-wd-2/movies',
     ]
 }
+
+# where search and title pages are fetched from - point at a local fake IMDb for benchmarks,
+# see imdb_info_local/benchmarks/fake_imdb.py
+IMDB_INFO_LOCAL_BASE_URL = 'https://www.imdb.com'
+
+# HTTP client used for all requests to IMDb
+# max connections kept alive per host - should be at least the number of scraper workers
+IMDB_INFO_LOCAL_HTTP_POOL_SIZE = 10
+# (connect, read) timeouts in seconds
+IMDB_INFO_LOCAL_HTTP_TIMEOUT = (5, 30)
+# global rate of requests to IMDb shared by all scraper workers - 0 for no limit
+IMDB_INFO_LOCAL_REQUESTS_PER_SECOND = 3
+# retries with backoff, circuit breaker and adaptive concurrency for requests to IMDb - overrides
+# any of DEFAULT_POLICY in imdb_info_local/http_policy.py, e.g. {'max_retries': 3, 'max_in_flight': 8}
+IMDB_INFO_LOCAL_HTTP_POLICY = {}
+
+# On-disk cache of IMDb responses - None to disable
+IMDB_INFO_LOCAL_CACHE_DIR = str(BASE_DIR / 'cache')
+# seconds each kind of response is fresh for - stale responses are only used with run_scraper --cache-only
+IMDB_INFO_LOCAL_CACHE_TTL = {
+    'search': 24 * 60 * 60,
+    'title': 7 * 24 * 60 * 60,
+    'image': 30 * 24 * 60 * 60,
+}
+# least recently used responses are evicted above this size
+IMDB_INFO_LOCAL_CACHE_MAX_BYTES = 500 * 1024 * 1024
+
+# manifests of the video directories kept by run_scraper --incremental
+IMDB_INFO_LOCAL_MANIFEST_DIR = str(BASE_DIR / 'manifests')
+
+# extractor for title and search pages - 'json' (page's embedded json), 'lxml' (needs lxml), 'strainer' or 'soup'
+# - see imdb_info_local/extractors.py
+IMDB_INFO_LOCAL_HTML_EXTRACTOR = 'json'
+
+# stream title pages, closing the connection once the rating, plot and poster are found,
+# reading at most IMDB_INFO_LOCAL_STREAM_MAX_BYTES - used when no extractor is passed explicitly
+IMDB_INFO_LOCAL_STREAM_TITLE_PAGES = False
+IMDB_INFO_LOCAL_STREAM_MAX_BYTES = 2 * 1024 * 1024
+
+# let ?profile on the title list, search and update views write a profile of the request to
+# IMDB_INFO_LOCAL_PROFILE_DIR - see imdb_info_local/profiling.py
+IMDB_INFO_LOCAL_PROFILE_VIEWS = False
+IMDB_INFO_LOCAL_PROFILE_DIR = str(BASE_DIR / 'profiles')
@@ -0,0 +1 @@
+"""Benchmarks for the scraper, run with the run_benchmarks management command."""
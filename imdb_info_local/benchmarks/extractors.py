@@ -0,0 +1,71 @@
+"""Benchmark of the title page extractors on the title page fixtures in tests/data.
+
+For each extractor and page reports parse time over `repeat` runs, and peak memory
+of one parse.  Memory is measured in a forked child process, as growth of its
+peak rss - this includes lxml's C allocations which tracemalloc can't see - and
+as the tracemalloc peak of python allocations.
+"""
+import multiprocessing
+import resource
+import statistics
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+
+from imdb_info_local.extractors import EXTRACTORS, available_extractors
+
+DATA_DIR = Path(__file__).resolve().parent.parent / 'tests' / 'data'
+TITLE_PAGES = ['archer-title-page.html']
+
+
+def _max_rss_kb() -> float:
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # bytes on macOS, kilobytes on linux
+    return max_rss / 1024 if sys.platform == 'darwin' else max_rss
+
+
+def _measure_memory(extractor: str, content: bytes, conn):
+    baseline = _max_rss_kb()
+    tracemalloc.start()
+    EXTRACTORS[extractor](content)
+    _, python_peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    conn.send((_max_rss_kb() - baseline, python_peak / 1024))
+    conn.close()
+
+
+def peak_memory_kb(extractor: str, content: bytes) -> (float, float):
+    """:return (peak rss growth, python allocations peak) in KB for one parse"""
+    context = multiprocessing.get_context('fork')
+    parent_conn, child_conn = context.Pipe()
+    process = context.Process(target=_measure_memory, args=(extractor, content, child_conn))
+    process.start()
+    result = parent_conn.recv()
+    process.join()
+    return result
+
+
+def run(repeat: int = 20) -> [dict]:
+    results = []
+    for page in TITLE_PAGES:
+        content = (DATA_DIR / page).read_bytes()
+        for name in available_extractors():
+            extractor = EXTRACTORS[name]
+            timings = []
+            for _ in range(repeat):
+                start = time.perf_counter()
+                extractor(content)
+                timings.append(time.perf_counter() - start)
+            rss_kb, python_kb = peak_memory_kb(name, content)
+            results.append({
+                'benchmark': f'extractor.{name}',
+                'page': page,
+                'page_kb': round(len(content) / 1024, 1),
+                'repeat': repeat,
+                'median_ms': round(statistics.median(timings) * 1000, 2),
+                'min_ms': round(min(timings) * 1000, 2),
+                'peak_rss_kb': round(rss_kb),
+                'peak_python_kb': round(python_kb),
+            })
+    return results
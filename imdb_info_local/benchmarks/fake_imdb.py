@@ -0,0 +1,177 @@
+"""Local stand-in for IMDb, so scraper throughput can be measured without touching imdb.com.
+
+Pages are built from the fixtures in tests/data:
+
+/find?q=<query> - the Archer search page, with its top result swapped for a title id
+    derived from the query, so every title searched for gets its own title page
+/title/<id>/ - the Archer title page, with Archer's id swapped for <id>
+/images/<id>/... - the Archer poster.  Each url gets different bytes so that, as on IMDb,
+    every title stores its own image rather than sharing one in the content addressed image store.
+
+Image urls in the pages point back at the server, under the page's title id.  Point the scraper at it with the
+setting IMDB_INFO_LOCAL_BASE_URL = server.base_url.
+
+Responses can be slowed down (latency, jitter), fail at random (error_rate), or be
+throttled with 429s and a Retry-After once requests_per_second is exceeded - to see how
+the engines, workers and http policy behave against a slow or struggling IMDb.
+Responses carry an ETag, so conditional GETs are answered with 304s.
+"""
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import hashlib
+import logging
+import math
+from pathlib import Path
+import random
+import re
+import threading
+import time
+from urllib.parse import urlsplit, parse_qs
+
+from imdb_info_local.http_client import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+DATA_DIR = Path(__file__).resolve().parent.parent / 'tests' / 'data'
+SEARCH_TEMPLATE = 'imdb-search-archer-alt-html-format.html'
+TITLE_TEMPLATE = 'archer-title-page.html'
+IMAGE_TEMPLATE = 'archer.jpg'
+# Archer's title id and the image url prefix in the templates
+TEMPLATE_TITLE_ID = b'tt1486217'
+TEMPLATE_IMAGES_URL = b'https://m.media-amazon.com/images/'
+
+TITLE_PATH = re.compile(r'^/title/(tt\d+)/?$')
+
+
+def fake_title_id(query: str) -> str:
+    """:return title id the fake server gives the top search result for query"""
+    digest = hashlib.sha1(query.lower().encode()).hexdigest()
+    return f'tt{int(digest, 16) % 10 ** 8:08d}'
+
+
+class _FakeIMDbHTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # room for the connections of a few hundred async requests in flight
+    request_queue_size = 512
+
+
+class _Handler(BaseHTTPRequestHandler):
+    # keep-alive, as IMDb does, so the scraper's connection pooling is exercised
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        status, headers, body = self.server.fake_imdb.respond(self.path, self.headers)
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger.debug(f'{self.address_string()} {format % args}')
+
+
+class FakeIMDbServer:
+    """HTTP server standing in for IMDb, run in a background thread.
+
+    with FakeIMDbServer(latency=0.05) as server:
+        with override_settings(IMDB_INFO_LOCAL_BASE_URL=server.base_url):
+            ...
+
+    :param port - 0 for any free port
+    :param latency - seconds each response is delayed, plus up to `jitter` seconds
+    :param error_rate - fraction of requests answered with error_status
+    :param requests_per_second - rate above which requests get a 429, 0 for no limit
+    :param seed - seed for the jitter and injected errors, for repeatable runs
+    """
+    def __init__(self, host: str = '127.0.0.1', port: int = 0, latency: float = 0.0, jitter: float = 0.0,
+                 error_rate: float = 0.0, error_status: int = 503, requests_per_second: float = 0,
+                 seed: int = None):
+        self.host = host
+        self.port = port
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.rate_limiter = TokenBucket(requests_per_second) if requests_per_second else None
+        self.random = random.Random(seed)
+        self.stats = Counter()
+        self.stats_lock = threading.Lock()
+        self.httpd = None
+        self.thread = None
+        self.search_page = self.title_page = self.image = b''
+
+    @property
+    def base_url(self) -> str:
+        return f'http://{self.host}:{self.port}'
+
+    def start(self) -> 'FakeIMDbServer':
+        self.httpd = _FakeIMDbHTTPServer((self.host, self.port), _Handler)
+        self.httpd.fake_imdb = self
+        self.port = self.httpd.server_address[1]
+        self._load_templates()
+        self.thread = threading.Thread(target=self.httpd.serve_forever, name='fake-imdb', daemon=True)
+        self.thread.start()
+        logger.info(f'fake IMDb serving on {self.base_url}')
+        return self
+
+    def stop(self):
+        if self.httpd:
+            self.httpd.shutdown()
+            self.httpd.server_close()
+            self.thread.join()
+            self.httpd = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+    def _load_templates(self):
+        # the title id is swapped in with the rest of the page's ids
+        images_url = self.base_url.encode() + b'/images/' + TEMPLATE_TITLE_ID + b'/'
+        self.search_page = (DATA_DIR / SEARCH_TEMPLATE).read_bytes().replace(TEMPLATE_IMAGES_URL, images_url)
+        self.title_page = (DATA_DIR / TITLE_TEMPLATE).read_bytes().replace(TEMPLATE_IMAGES_URL, images_url)
+        self.image = (DATA_DIR / IMAGE_TEMPLATE).read_bytes()
+
+    def _count(self, name: str):
+        with self.stats_lock:
+            self.stats[name] += 1
+
+    def respond(self, path: str, headers) -> (int, dict, bytes):
+        """:return (status, headers, body) of the response to a GET of path"""
+        self._count('requests')
+        delay = self.latency + (self.random.uniform(0, self.jitter) if self.jitter else 0)
+        if delay:
+            time.sleep(delay)
+        if self.rate_limiter:
+            wait = self.rate_limiter.try_acquire()
+            if wait:
+                self._count('throttled')
+                return 429, {'Retry-After': str(math.ceil(wait))}, b''
+        if self.error_rate and self.random.random() < self.error_rate:
+            self._count('errors')
+            return self.error_status, {}, b''
+
+        url = urlsplit(path)
+        title_match = TITLE_PATH.match(url.path)
+        if url.path == '/find':
+            query = parse_qs(url.query).get('q', [''])[0]
+            body, content_type = self.search_page.replace(TEMPLATE_TITLE_ID, fake_title_id(query).encode()), 'text/html'
+        elif title_match:
+            body, content_type = self.title_page.replace(TEMPLATE_TITLE_ID, title_match[1].encode()), 'text/html'
+        elif url.path.startswith('/images/'):
+            # trailing bytes after the end of the jpeg are ignored by image readers
+            body, content_type = self.image + url.path.encode(), 'image/jpeg'
+        else:
+            self._count('not_found')
+            return 404, {}, b''
+
+        # pages are the same for a url on every request, so it serves as the etag
+        etag = f'"{hashlib.sha1(path.encode()).hexdigest()}"'
+        if headers.get('If-None-Match') == etag:
+            self._count('not_modified')
+            return 304, {'ETag': etag}, b''
+        return 200, {'Content-Type': content_type, 'ETag': etag}, body
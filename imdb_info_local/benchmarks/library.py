@@ -0,0 +1,153 @@
+"""Benchmarks of scanning, persisting and listing large libraries, with no network.
+
+scanning - process_directory on a synthetic tree of title directories, with the IMDb
+    lookups mocked: a first run adding every title, then a run with nothing changed
+persistence - reconcile_directories on a table of title data, a tenth of whose
+    directories were deleted, as run_scraper runs it
+rendering - TitleListView listing every title of a synthetic catalog - see catalog.py
+
+Like the scraper benchmark these leave the database and media alone: rows are added in a
+transaction that is rolled back, and title directories go to a temporary directory.
+"""
+from contextlib import contextmanager
+import logging
+from pathlib import Path
+import shutil
+import statistics
+import tempfile
+import time
+from unittest.mock import patch
+import zlib
+
+from django.db import transaction
+from django.test import RequestFactory, override_settings
+
+from imdb_info_local.benchmarks.scraper import make_title_dirs, title_dir_name
+from imdb_info_local.catalog import generate_catalog
+from imdb_info_local.imdb import IMDBFindTitleResult, IMDBTitleData
+from imdb_info_local.management.commands import run_scraper
+from imdb_info_local.models import IMDBTitleSearchData
+from imdb_info_local.views import TitleListView
+
+logger = logging.getLogger(__name__)
+
+SCANNING_TITLE_COUNTS = (1000, 10000, 100000)
+PERSISTENCE_TITLE_COUNTS = (10000, 100000)
+RENDERING_TITLE_COUNTS = (10000,)
+# fraction of title directories deleted before timing reconcile_directories
+DELETED_FRACTION = 0.1
+INSERT_BATCH_SIZE = 1000
+BLURB = ('A synthetic title, with a blurb about as long as the ones on IMDb, so that the title list renders '
+         'roughly as much html for each title as it does for real ones.')
+
+
+def fake_search_results(title: str) -> [IMDBFindTitleResult]:
+    title_url = f'https://www.imdb.com/title/tt{zlib.crc32(title.encode()) % 10 ** 8:08d}/'
+    return [IMDBFindTitleResult(img_url='', title_url=title_url, text=f'{title} (Movie)')]
+
+
+def fake_title_data(title_url: str, *args) -> IMDBTitleData:
+    return IMDBTitleData(7.5, BLURB, None, title_url=title_url)
+
+
+@contextmanager
+def rolled_back():
+    """Discards everything written to the db in the block."""
+    with transaction.atomic():
+        yield
+        transaction.set_rollback(True)
+
+
+@contextmanager
+def quiet():
+    """Turns off logging below warnings - the scraper logs every title."""
+    logging.disable(logging.INFO)
+    try:
+        yield
+    finally:
+        logging.disable(logging.NOTSET)
+
+
+def make_title_rows(directory: Path, count: int, title_type: str = IMDBTitleSearchData.MOVIE):
+    """Bulk inserts title data for the title directories make_title_dirs(directory, count) creates."""
+    rows = []
+    for i in range(count):
+        name = title_dir_name(i)
+        rows.append(IMDBTitleSearchData(
+            type=title_type, title=run_scraper.title_from_directory_name(name), rating=round(5 + i % 50 / 10, 1),
+            blurb=BLURB, find_results=f'<ul><li>{name}</li></ul>', file_path=str(directory.resolve() / name),
+            file_mtime=1600000000 + i, file_ctime=1600000000 + i,
+        ))
+    IMDBTitleSearchData.objects.bulk_create(rows, batch_size=INSERT_BATCH_SIZE)
+
+
+def run_scanning(titles: [int] = SCANNING_TITLE_COUNTS, workers: int = run_scraper.DEFAULT_WORKERS) -> [dict]:
+    results = []
+    for count in titles:
+        logger.info(f'scanning benchmark with {count} titles')
+        with tempfile.TemporaryDirectory(prefix='imdb-library-benchmark-') as temp_dir:
+            title_dir = make_title_dirs(Path(temp_dir) / 'titles', count)
+            with patch.object(run_scraper, 'imdb_title_search_results', fake_search_results), \
+                    patch.object(run_scraper, 'imdb_title_data', fake_title_data), \
+                    override_settings(MEDIA_ROOT=str(Path(temp_dir) / 'media')), quiet(), rolled_back():
+                for run in ('new', 'unchanged'):
+                    start = time.perf_counter()
+                    added = run_scraper.process_directory(title_dir, 'MO', workers)
+                    seconds = time.perf_counter() - start
+                    results.append({
+                        'benchmark': f'scanning.process_directory.{run}',
+                        'titles': count,
+                        'added': len(added),
+                        'seconds': round(seconds, 3),
+                        'titles_per_sec': round(count / seconds) if seconds else 0,
+                    })
+    return results
+
+
+def run_persistence(titles: [int] = PERSISTENCE_TITLE_COUNTS) -> [dict]:
+    results = []
+    for count in titles:
+        logger.info(f'persistence benchmark with {count} titles')
+        with tempfile.TemporaryDirectory(prefix='imdb-library-benchmark-') as temp_dir:
+            title_dir = make_title_dirs(Path(temp_dir) / 'titles', count)
+            deleted = sorted(title_dir.iterdir())[::round(1 / DELETED_FRACTION)]
+            for path in deleted:
+                shutil.rmtree(path)
+            with override_settings(MEDIA_ROOT=str(Path(temp_dir) / 'media')), quiet(), rolled_back():
+                make_title_rows(title_dir, count)
+                start = time.perf_counter()
+                result = run_scraper.reconcile_directories([(title_dir, 'MO')])
+                seconds = time.perf_counter() - start
+        results.append({
+            'benchmark': 'persistence.reconcile_directories',
+            'titles': count,
+            'removed': len(result.removed),
+            'seconds': round(seconds, 3),
+            'titles_per_sec': round(count / seconds) if seconds else 0,
+        })
+    return results
+
+
+def run_rendering(titles: [int] = RENDERING_TITLE_COUNTS, repeat: int = 3) -> [dict]:
+    results = []
+    view = TitleListView.as_view(title_type='Movies')
+    for count in titles:
+        logger.info(f'rendering benchmark with {count} titles')
+        with tempfile.TemporaryDirectory(prefix='imdb-library-benchmark-') as temp_dir, \
+                override_settings(MEDIA_ROOT=str(Path(temp_dir) / 'media')), quiet(), rolled_back():
+            generate_catalog(count, [Path(temp_dir)], tv_fraction=0)
+            timings = []
+            for _ in range(repeat):
+                start = time.perf_counter()
+                response = view(RequestFactory().get('/movies/'))
+                response.render()
+                timings.append(time.perf_counter() - start)
+        results.append({
+            'benchmark': 'rendering.TitleListView',
+            'titles': count,
+            'repeat': repeat,
+            'median_ms': round(statistics.median(timings) * 1000, 1),
+            'min_ms': round(min(timings) * 1000, 1),
+            'page_kb': round(len(response.content) / 1024),
+        })
+    return results
@@ -0,0 +1,63 @@
+"""Benchmark of parsing the search and title page fixtures in tests/data.
+
+Times what imdb_title_search_results and imdb_title_data do once a page is fetched:
+title_search_results_from_content on each search page, with the json data and by
+scraping the html, and extract_title_page on the title page with the configured
+extractor.  See the extractors suite to compare the title page extractors.
+"""
+import logging
+import statistics
+import time
+
+from imdb_info_local.benchmarks.extractors import DATA_DIR, TITLE_PAGES
+from imdb_info_local.extractors import extract_title_page, extractor_name
+from imdb_info_local.imdb import title_search_results_from_content
+
+SEARCH_PAGES = {
+    'imdb-search-american-dad.html': 'American Dad',
+    'imdb-search-archer.html': 'Archer',
+    'imdb-search-archer-alt-html-format.html': 'Archer',
+    'imdb-search-looney-tunes-golden-collection.html': 'Looney Tunes Golden Collection',
+}
+SEARCH_EXTRACTORS = ('json', 'soup')
+
+
+def timings_ms(fn, repeat: int) -> dict:
+    """:return median and min milliseconds of repeat calls of fn"""
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    return {
+        'repeat': repeat,
+        'median_ms': round(statistics.median(timings) * 1000, 2),
+        'min_ms': round(min(timings) * 1000, 2),
+    }
+
+
+def run(repeat: int = 20) -> [dict]:
+    results = []
+    # parsing logs every page at info
+    logging.disable(logging.INFO)
+    try:
+        for page, title in SEARCH_PAGES.items():
+            content = (DATA_DIR / page).read_bytes()
+            for extractor in SEARCH_EXTRACTORS:
+                results.append({
+                    'benchmark': f'parsing.search.{extractor}',
+                    'page': page,
+                    'page_kb': round(len(content) / 1024, 1),
+                    **timings_ms(lambda: title_search_results_from_content(title, content, extractor), repeat),
+                })
+        for page in TITLE_PAGES:
+            content = (DATA_DIR / page).read_bytes()
+            results.append({
+                'benchmark': f'parsing.title.{extractor_name()}',
+                'page': page,
+                'page_kb': round(len(content) / 1024, 1),
+                **timings_ms(lambda: extract_title_page(content), repeat),
+            })
+    finally:
+        logging.disable(logging.NOTSET)
+    return results
@@ -0,0 +1,72 @@
+"""Benchmark results stored as json, to compare runs over time.
+
+A results file holds when and where the benchmarks ran, and the result rows of each
+suite.  compare() matches the rows of a run with those of an earlier results file
+and adds how much each timing changed.
+"""
+from datetime import datetime, timezone
+import json
+from pathlib import Path
+import platform
+
+import django
+from django.db import connection
+
+from imdb_info_local.cache import AtomicFile
+
+# fields that, with the benchmark name, identify a result row across runs
+KEY_FIELDS = ('page', 'titles', 'engine', 'workers', 'cache')
+# timings compared, lower is better
+TIME_FIELDS = ('median_ms', 'seconds')
+# readable by whoever collects the results
+RESULTS_FILE_MODE = 0o644
+
+
+def run_info() -> dict:
+    return {
+        'time': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'host': platform.node(),
+        'platform': platform.platform(),
+        'python': platform.python_version(),
+        'django': django.get_version(),
+        'database': connection.vendor,
+    }
+
+
+def write_results(path: Path, results: {str: [dict]}):
+    """Writes the results of each suite, with run_info(), to a json file.
+
+    :param results - suite name -> result rows
+    """
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with AtomicFile(path, RESULTS_FILE_MODE) as f:
+        f.write(json.dumps({'run': run_info(), 'results': results}, indent=2).encode())
+
+
+def read_results(path: Path) -> {str: [dict]}:
+    """:return suite name -> result rows from a file written by write_results"""
+    return json.loads(Path(path).read_text())['results']
+
+
+def row_key(row: dict) -> tuple:
+    return (row['benchmark'],) + tuple(row.get(name) for name in KEY_FIELDS)
+
+
+def compare(rows: [dict], baseline: [dict]) -> [dict]:
+    """Adds the change in timing from the matching baseline row to each row.
+
+    :return copies of rows with 'baseline' - the baseline's timing - and 'change' - e.g. '+12.5%',
+        or the rows unchanged if none match
+    """
+    baseline_rows = {row_key(row): row for row in baseline}
+    compared = []
+    for row in rows:
+        row = dict(row)
+        baseline_row = baseline_rows.get(row_key(row))
+        time_field = next((name for name in TIME_FIELDS if name in row), None)
+        if baseline_row and time_field and baseline_row.get(time_field):
+            row['baseline'] = baseline_row[time_field]
+            row['change'] = f'{(row[time_field] - baseline_row[time_field]) / baseline_row[time_field]:+.1%}'
+        compared.append(row)
+    return compared
@@ -0,0 +1,142 @@
+"""Throughput benchmark of run_scraper's process_directory against the fake IMDb server.
+
+Each scenario scrapes a directory of synthetic title directories with an engine,
+number of workers and response cache setting, against a FakeIMDbServer with some
+latency.  Runs are repeatable - the titles, and the server's jitter and injected
+errors, are the same every time.
+
+The benchmark leaves the database, media and response cache alone: titles are saved in
+a transaction that is rolled back, and images and the cache go to a temporary directory.
+The scraper's own rate limit is turned off, so throughput is limited by the engine.
+"""
+from dataclasses import dataclass, field
+import logging
+from pathlib import Path
+import tempfile
+import time
+
+from django.db import transaction
+from django.test import override_settings
+
+from imdb_info_local.benchmarks.fake_imdb import FakeIMDbServer
+from imdb_info_local.http_client import reset_session
+from imdb_info_local.http_policy import reset_policy
+from imdb_info_local.management.commands.run_scraper import process_directory
+
+logger = logging.getLogger(__name__)
+
+TITLE_COUNTS = (1000, 10000)
+# seconds added to every fake IMDb response, roughly a round trip to imdb.com
+DEFAULT_LATENCY = 0.05
+SEED = 1
+
+
+@dataclass
+class Scenario:
+    name: str
+    engine: str = 'thread'
+    workers: int = 4
+    # 'off' - no response cache, 'cold' - empty cache, 'warm' - cache filled by an untimed run first
+    # (pages only - images aren't cached)
+    cache: str = 'off'
+    # FakeIMDbServer options, e.g. to inject errors
+    server: dict = field(default_factory=dict)
+    # more settings, e.g. to stream title pages
+    settings: dict = field(default_factory=dict)
+
+
+SCENARIOS = [
+    Scenario('thread-4', 'thread', 4),
+    Scenario('thread-16', 'thread', 16),
+    Scenario('async-16', 'async', 16),
+    Scenario('async-64', 'async', 64),
+    Scenario('async-64-stream', 'async', 64, settings={'IMDB_INFO_LOCAL_STREAM_TITLE_PAGES': True}),
+    Scenario('thread-16-cold-cache', 'thread', 16, cache='cold'),
+    Scenario('thread-16-warm-cache', 'thread', 16, cache='warm'),
+    Scenario('async-64-warm-cache', 'async', 64, cache='warm'),
+    Scenario('async-64-errors', 'async', 64, server={'error_rate': 0.02}),
+    Scenario('async-64-throttled', 'async', 64, server={'requests_per_second': 100}),
+]
+
+
+def title_dir_name(i: int) -> str:
+    """:return name of the i'th synthetic title directory, named like real ones"""
+    return f'Synthetic-Title-{i:05d}-{1950 + i % 70}'
+
+
+def make_title_dirs(directory: Path, count: int) -> Path:
+    """Creates `count` title directories under directory."""
+    directory.mkdir(parents=True, exist_ok=True)
+    for i in range(count):
+        (directory / title_dir_name(i)).mkdir(exist_ok=True)
+    return directory
+
+
+def scrape_once(directory: Path, scenario: Scenario) -> (int, float):
+    """Scrapes directory, discarding the titles saved.
+
+    :return (number of titles added, seconds taken)
+    """
+    with transaction.atomic():
+        start = time.perf_counter()
+        added = process_directory(directory, 'MO', scenario.workers, scenario.engine)
+        seconds = time.perf_counter() - start
+        transaction.set_rollback(True)
+    return len(added), seconds
+
+
+def run_scenario(scenario: Scenario, titles: int, latency: float = DEFAULT_LATENCY) -> dict:
+    with tempfile.TemporaryDirectory(prefix='imdb-scraper-benchmark-') as temp_dir:
+        temp_dir = Path(temp_dir)
+        title_dir = make_title_dirs(temp_dir / 'titles', titles)
+        server = FakeIMDbServer(latency=latency, jitter=latency, seed=SEED, **scenario.server)
+        with server:
+            with override_settings(
+                IMDB_INFO_LOCAL_BASE_URL=server.base_url,
+                IMDB_INFO_LOCAL_REQUESTS_PER_SECOND=0,
+                IMDB_INFO_LOCAL_HTTP_POOL_SIZE=max(scenario.workers, 1),
+                IMDB_INFO_LOCAL_CACHE_DIR=None if scenario.cache == 'off' else str(temp_dir / 'cache'),
+                MEDIA_ROOT=str(temp_dir / 'media'),
+                **scenario.settings,
+            ):
+                reset_session()
+                reset_policy()
+                try:
+                    if scenario.cache == 'warm':
+                        scrape_once(title_dir, scenario)
+                        server.stats.clear()
+                    added, seconds = scrape_once(title_dir, scenario)
+                finally:
+                    reset_session()
+                    reset_policy()
+    stats = server.stats
+    return {
+        'benchmark': f'scraper.{scenario.name}',
+        'titles': titles,
+        'engine': scenario.engine,
+        'workers': scenario.workers,
+        'cache': scenario.cache,
+        'added': added,
+        'seconds': round(seconds, 2),
+        'titles_per_sec': round(added / seconds, 1) if seconds else 0,
+        'requests': stats['requests'],
+        'errors': stats['errors'],
+        'throttled': stats['throttled'],
+        'not_modified': stats['not_modified'],
+    }
+
+
+def run(repeat: int = 1, titles: [int] = TITLE_COUNTS, scenarios: [str] = None,
+        latency: float = DEFAULT_LATENCY) -> [dict]:
+    """Runs each scenario `repeat` times for each number of titles.
+
+    :param scenarios - names of the scenarios in SCENARIOS to run, default all
+    """
+    selected = [scenario for scenario in SCENARIOS if not scenarios or scenario.name in scenarios]
+    results = []
+    for count in titles:
+        for scenario in selected:
+            for _ in range(repeat):
+                logger.info(f'scraper benchmark {scenario.name} with {count} titles')
+                results.append(run_scenario(scenario, count, latency))
+    return results
@@ -0,0 +1,219 @@
+"""On-disk cache of responses from IMDb.
+
+Entries are keyed by url and stored under the sha256 of the url:
+<cache dir>/<first 2 hex chars>/<sha256>.body - the response content
+<cache dir>/<first 2 hex chars>/<sha256>.json - url, kind, fetch time and validators
+
+Each kind of response ('search', 'title') has its own time to live.  Images are not
+cached - they are downloaded straight into the image store, see http_client.fetch_to_file.
+Stale entries are kept - they are still served in cache-only mode.  When the
+cache grows past its byte cap, least recently used entries are evicted (each
+hit touches the entry's mtime).
+
+Settings (all optional):
+IMDB_INFO_LOCAL_CACHE_DIR - directory for the cache, None disables caching
+IMDB_INFO_LOCAL_CACHE_TTL - dict of kind -> seconds
+IMDB_INFO_LOCAL_CACHE_MAX_BYTES - size at which entries are evicted
+"""
+from dataclasses import dataclass, field
+import hashlib
+import json
+import logging
+import os
+from pathlib import Path
+import tempfile
+import threading
+import time
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# cache modes
+NORMAL = 'normal'
+# never touch the network - serve all entries, fresh or stale
+CACHE_ONLY = 'cache-only'
+# neither read nor write the cache
+NO_CACHE = 'no-cache'
+CACHE_MODES = (NORMAL, CACHE_ONLY, NO_CACHE)
+
+DAY = 24 * 60 * 60
+DEFAULT_TTL = {
+    'search': 1 * DAY,
+    'title': 7 * DAY,
+}
+DEFAULT_MAX_BYTES = 500 * 1024 * 1024
+# evict down to this fraction of the cap so eviction doesn't run on every write
+EVICT_TO_FRACTION = 0.9
+
+_mode = NORMAL
+_cache = None
+_cache_lock = threading.Lock()
+
+
+class CacheMiss(Exception):
+    """Raised in cache-only mode for a url that is not cached."""
+
+
+@dataclass
+class CacheEntry:
+    url: str
+    kind: str
+    content: bytes
+    fetched: float
+    headers: dict = field(default_factory=dict)
+
+    def age(self) -> float:
+        return time.time() - self.fetched
+
+
+class ResponseCache:
+
+    def __init__(self, directory: Path, ttl: dict = None, max_bytes: int = DEFAULT_MAX_BYTES):
+        self.directory = Path(directory)
+        self.ttl = {**DEFAULT_TTL, **(ttl or {})}
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        # total size of body files, computed on first write
+        self._size = None
+
+    def _paths(self, url: str) -> (Path, Path):
+        key = hashlib.sha256(url.encode()).hexdigest()
+        subdir = self.directory / key[:2]
+        return subdir / f'{key}.body', subdir / f'{key}.json'
+
+    def is_fresh(self, entry: CacheEntry) -> bool:
+        return entry.age() < self.ttl.get(entry.kind, 0)
+
+    def get(self, url: str) -> CacheEntry:
+        """:return the CacheEntry for url, fresh or stale, or None"""
+        body_path, meta_path = self._paths(url)
+        try:
+            meta = json.loads(meta_path.read_text())
+            content = body_path.read_bytes()
+            os.utime(body_path)
+        except (OSError, ValueError):
+            return None
+        return CacheEntry(url=url, kind=meta['kind'], content=content, fetched=meta['fetched'],
+                          headers=meta.get('headers', {}))
+
+    def set(self, url: str, kind: str, content: bytes, headers: dict = None):
+        body_path, meta_path = self._paths(url)
+        body_path.parent.mkdir(parents=True, exist_ok=True)
+        old_size = body_path.stat().st_size if body_path.exists() else 0
+        meta = {'url': url, 'kind': kind, 'fetched': time.time(), 'headers': headers or {}}
+        _atomic_write(body_path, content)
+        _atomic_write(meta_path, json.dumps(meta).encode())
+        with self.lock:
+            if self._size is None:
+                self._size = self._total_size()
+            else:
+                self._size += len(content) - old_size
+            if self._size > self.max_bytes:
+                self._evict()
+
+    def touch(self, url: str):
+        """Marks the entry for url as fresh again, e.g. after a 304 response."""
+        body_path, meta_path = self._paths(url)
+        try:
+            meta = json.loads(meta_path.read_text())
+        except (OSError, ValueError):
+            return
+        meta['fetched'] = time.time()
+        _atomic_write(meta_path, json.dumps(meta).encode())
+
+    def _body_files(self) -> [(Path, os.stat_result)]:
+        return [(path, path.stat()) for path in self.directory.glob('*/*.body')]
+
+    def _total_size(self) -> int:
+        return sum(stat.st_size for _, stat in self._body_files())
+
+    def _evict(self):
+        """Removes least recently used entries until the cache is under the cap."""
+        target = self.max_bytes * EVICT_TO_FRACTION
+        body_files = sorted(self._body_files(), key=lambda path_stat: path_stat[1].st_mtime)
+        size = sum(stat.st_size for _, stat in body_files)
+        evicted = 0
+        for body_path, stat in body_files:
+            if size <= target:
+                break
+            body_path.unlink(missing_ok=True)
+            body_path.with_suffix('.json').unlink(missing_ok=True)
+            size -= stat.st_size
+            evicted += 1
+        self._size = size
+        logger.debug(f'cache: evicted {evicted} entries, size now {size} bytes')
+
+    def clear(self):
+        with self.lock:
+            for path in self.directory.glob('*/*'):
+                path.unlink(missing_ok=True)
+            self._size = 0
+
+
+class AtomicFile:
+    """Context manager for writing a file atomically.
+
+    Writes go to a temp file in the same directory, which is renamed to path on
+    success and removed on error, so readers never see a partially written file.
+    The temp file is only readable by the owner unless a mode is given.
+    """
+    def __init__(self, path: Path, mode: int = None):
+        self.path = Path(path)
+        self.mode = mode
+        self.file = None
+        self.tmp_path = None
+
+    def __enter__(self):
+        fd, self.tmp_path = tempfile.mkstemp(dir=self.path.parent, prefix='.tmp-')
+        self.file = os.fdopen(fd, 'wb')
+        return self.file
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.file.close()
+        if exc_type is None:
+            if self.mode is not None:
+                os.chmod(self.tmp_path, self.mode)
+            os.replace(self.tmp_path, self.path)
+        else:
+            os.unlink(self.tmp_path)
+
+
+def _atomic_write(path: Path, content: bytes):
+    with AtomicFile(path) as f:
+        f.write(content)
+
+
+def set_cache_mode(mode: str):
+    global _mode
+    assert mode in CACHE_MODES, 'wrong cache mode'
+    _mode = mode
+
+
+def cache_mode() -> str:
+    return _mode
+
+
+def get_cache() -> ResponseCache:
+    """Returns the cache for the current settings, or None if caching is off."""
+    global _cache
+    directory = getattr(settings, 'IMDB_INFO_LOCAL_CACHE_DIR', None)
+    if _mode == NO_CACHE or not directory:
+        return None
+    if _cache is None or _cache.directory != Path(directory):
+        with _cache_lock:
+            if _cache is None or _cache.directory != Path(directory):
+                _cache = ResponseCache(
+                    directory,
+                    ttl=getattr(settings, 'IMDB_INFO_LOCAL_CACHE_TTL', None),
+                    max_bytes=getattr(settings, 'IMDB_INFO_LOCAL_CACHE_MAX_BYTES', DEFAULT_MAX_BYTES),
+                )
+    return _cache
+
+
+def store_content(url: str, kind: str, content: bytes, headers: dict = None):
+    """Stores fetched content for url if caching is on."""
+    cache = get_cache()
+    if cache:
+        cache.set(url, kind, content, headers)
+
@@ -0,0 +1,194 @@
+"""Synthetic catalogs of titles, for load testing and benchmarks.
+
+generate_catalog() adds title data that looks like run_scraper's - titles, ratings,
+blurbs, find results html and poster images with thumbnails - along with the title
+directories it came from, under <root>/movies and <root>/tv of each root.  Point
+IMDB_INFO_LOCAL_VIDEO_DIRS at those directories to run the scraper's reconciliation
+against the catalog.
+
+A catalog is the same for the same seed and options: the titles, their data, and the
+directories' mtimes.  Posters are a small set of placeholder images shared by the
+titles, like titles from the same franchise share images in the content addressed
+image store.
+"""
+from dataclasses import dataclass
+import logging
+import os
+from pathlib import Path
+import random
+import tempfile
+
+from django.conf import settings
+from django.db import transaction
+from PIL import Image, ImageDraw
+
+from .models import IMDBTitleSearchData, IMAGE_SUBDIRECTORY, image_directory, store_image
+from .thumbnails import ensure_thumbnails
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SEED = 0
+DEFAULT_TV_FRACTION = 0.3
+DEFAULT_IMAGES = 50
+DEFAULT_BATCH_SIZE = 1000
+# fraction of titles with no rating, like those not released yet - stored as 0, as the scraper does
+UNRATED_FRACTION = 0.03
+FIND_RESULTS_COUNT = 3
+POSTER_SIZE = (182, 268)
+# title directory mtimes fall in the 10 years from 2014
+MTIME_START = 1388534400
+MTIME_RANGE = 10 * 365 * 24 * 60 * 60
+MOVIES_SUBDIRECTORY = 'movies'
+TV_SUBDIRECTORY = 'tv'
+
+ADJECTIVES = ['Last', 'Silent', 'Broken', 'Hidden', 'Golden', 'Dark', 'Lost', 'Wild', 'Final', 'Crimson',
+              'Midnight', 'Frozen', 'Electric', 'Secret', 'Distant', 'Burning', 'Hollow', 'Little', 'Savage', 'Blue']
+NOUNS = ['Empire', 'River', 'Detective', 'Garden', 'Machine', 'Kingdom', 'Stranger', 'Harbor', 'Witness', 'Signal',
+         'Orchard', 'Frontier', 'Station', 'Island', 'Circus', 'Archive', 'Shepherd', 'Comet', 'Lantern', 'Valley']
+PLACES = ['Brooklyn', 'Mars', 'the North', 'Paris', 'the Desert', 'Tokyo', 'the Deep', 'Avalon', 'Texas', 'Berlin']
+NAMES = ['Nora', 'Archer', 'Maude', 'Felix', 'Ingrid', 'Oscar', 'June', 'Rafael', 'Tilda', 'Marcus']
+TITLE_PATTERNS = ['The {adjective} {noun}', '{noun} of {place}', '{adjective} {noun}', 'A {noun} in {place}',
+                  '{name} and the {noun}', 'The {noun}', '{name} Is {adjective}', 'Return to {place}']
+BLURB_PATTERNS = [
+    'A {adjective} {noun} turns the lives of two strangers in {place} upside down.',
+    'When {name} finds a {noun} that should not exist, an ordinary week in {place} becomes a race against time.',
+    'Years after the {noun} closed, {name} goes back to {place} to settle an old score.',
+    'An unlikely crew sets out across {place} to find the {adjective} {noun} before anyone else does.',
+    'A {adjective} comedy about {name}, a {noun} and the worst family reunion {place} has ever seen.',
+]
+MOVIE_KINDS = ['', ' (Short)', ' (TV Movie)', ' (Video)']
+TV_KINDS = [' (TV Series)', ' (TV Mini Series)']
+
+
+@dataclass
+class SyntheticTitle:
+    type: str
+    title: str
+    dir_name: str
+    rating: float
+    blurb: str
+    find_results: str
+    title_url: str
+    mtime: int
+    # index of the title's placeholder image
+    image: int
+
+
+def _words(rng: random.Random) -> dict:
+    return dict(adjective=rng.choice(ADJECTIVES), noun=rng.choice(NOUNS), place=rng.choice(PLACES),
+                name=rng.choice(NAMES))
+
+
+def _find_results_html(rng: random.Random, title: str, year: int, kinds: [str]) -> (str, str):
+    """:return (find results html, url of the first result) - like run_scraper.find_results_html"""
+    results = []
+    for i in range(FIND_RESULTS_COUNT):
+        title_url = f'https://www.imdb.com/title/tt{rng.randrange(100000, 9999999):07d}/'
+        name = title if i == 0 else rng.choice(TITLE_PATTERNS).format(**_words(rng))
+        results.append((title_url, f'{name} ({year if i == 0 else year + rng.randint(-30, 5)}){rng.choice(kinds)}'))
+    html = '<ul>' + ''.join(f'<li><a href="{url}">{text}</a></li>\n' for url, text in results) + '</ul>'
+    return html, results[0][0]
+
+
+def synthetic_titles(count: int, seed: int = DEFAULT_SEED, tv_fraction: float = DEFAULT_TV_FRACTION,
+                     images: int = DEFAULT_IMAGES) -> [SyntheticTitle]:
+    """:return count titles, the same for the same arguments, with unique directory names for each type"""
+    rng = random.Random(seed)
+    seen = set()
+    titles = []
+    for _ in range(count):
+        title_type = IMDBTitleSearchData.TV if rng.random() < tv_fraction else IMDBTitleSearchData.MOVIE
+        name = rng.choice(TITLE_PATTERNS).format(**_words(rng))
+        year = rng.randint(1950, 2023)
+        # movie directories end with the year, tv directories are just the name
+        base_dir_name = f'{name}-{year}' if title_type == IMDBTitleSearchData.MOVIE else name
+        base_dir_name = base_dir_name.replace(' ', '-')
+        dir_name, n = base_dir_name, 1
+        while (title_type, dir_name) in seen:
+            n += 1
+            dir_name = f'{base_dir_name}-{n}'
+        seen.add((title_type, dir_name))
+        kinds = TV_KINDS if title_type == IMDBTitleSearchData.TV else MOVIE_KINDS
+        find_results, title_url = _find_results_html(rng, name, year, kinds)
+        rating = 0 if rng.random() < UNRATED_FRACTION else round(min(9.8, max(1.5, rng.gauss(6.6, 1.1))), 1)
+        # drawn whether or not there are images, so the titles don't depend on the number of images
+        image = rng.random()
+        titles.append(SyntheticTitle(
+            type=title_type,
+            title=dir_name.replace('-', ' '),
+            dir_name=dir_name,
+            rating=rating,
+            blurb=rng.choice(BLURB_PATTERNS).format(**_words(rng)),
+            find_results=find_results,
+            title_url=title_url,
+            mtime=MTIME_START + rng.randrange(MTIME_RANGE),
+            image=int(image * images) if images else None,
+        ))
+    return titles
+
+
+def placeholder_images(count: int, seed: int = DEFAULT_SEED) -> [(str, bool)]:
+    """Stores count placeholder posters, with thumbnails, in the image store.
+
+    :return (storage name, e.g. 'title-images/<sha256>.jpg', whether its thumbnails were made) of each image
+    """
+    rng = random.Random(seed)
+    names = []
+    image_directory().mkdir(parents=True, exist_ok=True)
+    with tempfile.TemporaryDirectory(dir=image_directory(), prefix='.placeholders-') as temp_dir:
+        for i in range(count):
+            background = tuple(rng.randrange(40, 216) for _ in range(3))
+            image = Image.new('RGB', POSTER_SIZE, background)
+            draw = ImageDraw.Draw(image)
+            draw.rectangle((12, 12, POSTER_SIZE[0] - 12, POSTER_SIZE[1] - 12), outline=(255, 255, 255), width=3)
+            draw.text((24, POSTER_SIZE[1] // 2), f'Placeholder {i + 1}', fill=(255, 255, 255))
+            path = Path(temp_dir) / f'placeholder-{i}.jpg'
+            image.save(path, format='JPEG', quality=85)
+            os.chmod(path, settings.FILE_UPLOAD_PERMISSIONS or 0o644)
+            stored_path = store_image(path, move=True)
+            names.append((IMAGE_SUBDIRECTORY + stored_path.name,
+                          ensure_thumbnails(stored_path, settings.FILE_UPLOAD_PERMISSIONS)))
+    return names
+
+
+def title_directory(root: Path, title: SyntheticTitle) -> Path:
+    subdirectory = TV_SUBDIRECTORY if title.type == IMDBTitleSearchData.TV else MOVIES_SUBDIRECTORY
+    return root / subdirectory / title.dir_name
+
+
+def generate_catalog(count: int, roots: [Path], seed: int = DEFAULT_SEED, tv_fraction: float = DEFAULT_TV_FRACTION,
+                     images: int = DEFAULT_IMAGES, batch_size: int = DEFAULT_BATCH_SIZE) -> int:
+    """Adds a synthetic catalog of count titles to the db, with their title directories.
+
+    Titles are spread over the roots in turn.  Titles already in the db, e.g. from an
+    earlier catalog with the same seed, are left alone.
+
+    :param roots - directories to create the title directories under
+    :param images - number of placeholder images shared by the titles, 0 for no images
+    :return number of titles added
+    """
+    titles = synthetic_titles(count, seed, tv_fraction, images)
+    placeholders = placeholder_images(images, seed) if images else []
+    existing = set(IMDBTitleSearchData.objects.values_list('type', 'file_path'))
+    added = 0
+    for start in range(0, len(titles), batch_size):
+        rows = []
+        for i, title in enumerate(titles[start:start + batch_size], start):
+            path = title_directory(roots[i % len(roots)], title)
+            path.mkdir(parents=True, exist_ok=True)
+            os.utime(path, (title.mtime, title.mtime))
+            file_path = str(path.resolve())
+            if (title.type, file_path) in existing:
+                continue
+            image, has_thumbnails = placeholders[title.image] if placeholders else ('', False)
+            rows.append(IMDBTitleSearchData(
+                type=title.type, title=title.title, rating=title.rating, blurb=title.blurb,
+                find_results=title.find_results, file_path=file_path, file_mtime=title.mtime,
+                file_ctime=int(path.stat().st_ctime), title_url=title.title_url,
+                image=image, has_thumbnails=has_thumbnails,
+            ))
+        with transaction.atomic():
+            IMDBTitleSearchData.objects.bulk_create(rows)
+        added += len(rows)
+        logger.info(f'added {added} synthetic titles')
+    return added
@@ -0,0 +1,129 @@
+"""In-run coalescing of IMDb lookups.
+
+The same title can be in several video directories, or be both a movie and a tv
+directory, and different directory names can find the same IMDb title.  During a
+run_scraper run, lookups go through a SingleFlight so that each search query and
+each title page is fetched once: a lookup that is already in flight is waited for,
+and one that has finished is answered with its result.
+
+Searches are keyed by the normalized query - case and whitespace don't change
+IMDb's results - and title pages by their IMDb title id.  Failed lookups are not
+kept, so a later lookup of the same key tries again.
+
+Coalescing is on between start_run() and finish_run(), which returns the hit counts.
+Outside a run - e.g. the website's update view - lookups go straight through.
+"""
+import asyncio
+from collections import Counter
+from concurrent.futures import Future
+import logging
+import threading
+
+from .imdb import filename_stem_from_title_url
+
+logger = logging.getLogger(__name__)
+
+SEARCH = 'search'
+TITLE = 'title'
+
+_single_flight = None
+
+
+class SingleFlight:
+    """Thread safe single flight - one call per key, its result shared by every caller.
+
+    Works for callers in threads and on an event loop alike: a key's result is held
+    in a concurrent.futures.Future, which coroutines await through asyncio.wrap_future.
+    """
+    def __init__(self):
+        self.futures = {}
+        self.stats = Counter()
+        self.lock = threading.Lock()
+
+    def _claim(self, kind: str, key: str) -> (Future, bool):
+        """:return (future for the key, True if the caller must make the call)"""
+        with self.lock:
+            future = self.futures.get((kind, key))
+            if future:
+                self.stats[f'{kind}_hits'] += 1
+                return future, False
+            future = self.futures[(kind, key)] = Future()
+            self.stats[f'{kind}_calls'] += 1
+            return future, True
+
+    def _failed(self, kind: str, key: str, future: Future, error: BaseException):
+        with self.lock:
+            self.futures.pop((kind, key), None)
+        future.set_exception(error)
+
+    def do(self, kind: str, key: str, fn, *args):
+        """:return fn(*args), called only if no call for (kind, key) was made before"""
+        future, owner = self._claim(kind, key)
+        if not owner:
+            return future.result()
+        try:
+            result = fn(*args)
+        except BaseException as e:
+            self._failed(kind, key, future, e)
+            raise
+        future.set_result(result)
+        return result
+
+    async def do_async(self, kind: str, key: str, coroutine_fn, *args):
+        """Async do() - :return await coroutine_fn(*args)"""
+        future, owner = self._claim(kind, key)
+        if not owner:
+            return await asyncio.wrap_future(future)
+        try:
+            result = await coroutine_fn(*args)
+        except BaseException as e:
+            self._failed(kind, key, future, e)
+            raise
+        future.set_result(result)
+        return result
+
+
+def normalized_query(title: str) -> str:
+    return ' '.join(title.lower().split())
+
+
+def title_key(title_url: str) -> str:
+    return filename_stem_from_title_url(title_url) or title_url
+
+
+def _key(kind: str, value: str) -> str:
+    return normalized_query(value) if kind == SEARCH else title_key(value)
+
+
+def coalesced(kind: str, value: str, fn, *args):
+    """Calls fn(*args) through the run's SingleFlight, if a run is in progress.
+
+    :param kind - SEARCH with the title searched for, or TITLE with the title url
+    """
+    single_flight = _single_flight
+    if single_flight is None:
+        return fn(*args)
+    return single_flight.do(kind, _key(kind, value), fn, *args)
+
+
+async def coalesced_async(kind: str, value: str, coroutine_fn, *args):
+    """Async coalesced()"""
+    single_flight = _single_flight
+    if single_flight is None:
+        return await coroutine_fn(*args)
+    return await single_flight.do_async(kind, _key(kind, value), coroutine_fn, *args)
+
+
+def start_run():
+    global _single_flight
+    _single_flight = SingleFlight()
+
+
+def finish_run() -> Counter:
+    """Ends coalescing for the run.
+
+    :return counts of calls made and hits for each kind, e.g. {'search_calls': 10, 'search_hits': 2}
+    """
+    global _single_flight
+    single_flight, _single_flight = _single_flight, None
+    return single_flight.stats if single_flight else Counter()
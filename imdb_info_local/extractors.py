@@ -0,0 +1,333 @@
+"""Extractors for the fields scraped from an IMDB title page.
+
+IMDb pages are rendered from json embedded in the page, which is more stable
+than the html around it.  The json extractor is the default, and the json is also
+used for search results - see imdb.title_search_results_from_content.
+
+Title pages are ~800 KB, but only the rating, plot and poster image are needed.
+Each extractor takes the raw page content and returns TitlePageFields:
+
+soup - BeautifulSoup tree of the whole page with html.parser.  The original
+    implementation, and the fallback for the others.
+strainer - BeautifulSoup with a SoupStrainer, so only the elements holding the
+    fields are built into a tree.
+lxml - lxml's C parser and XPath.  Requires lxml.
+json - no html parsing at all - the page data is decoded from the __NEXT_DATA__
+    (or JSON-LD) script block pulled out of the raw bytes.
+stream - StreamingTitlePageParser fed the whole page.  The parser is incremental,
+    so it is also used to stop reading a streamed title page as soon as the
+    fields are found - see http_client.fetch_streaming.
+
+The extractor is selected per call, or with the setting IMDB_INFO_LOCAL_HTML_EXTRACTOR.
+If a fast extractor is unavailable, fails, or finds none of the fields, the
+soup extractor is used instead.
+"""
+import codecs
+from dataclasses import dataclass
+import html
+from html.parser import HTMLParser
+import json
+import logging
+import re
+
+from bs4 import BeautifulSoup, SoupStrainer
+from django.conf import settings
+
+try:
+    import lxml.html
+except ImportError:
+    lxml = None
+
+logger = logging.getLogger(__name__)
+
+RATING_TESTID = 'hero-rating-bar__aggregate-rating__score'
+PLOT_TESTID = 'plot-l'
+POSTER_TESTID = 'hero-media__poster'
+
+NEXT_DATA_START = b'<script id="__NEXT_DATA__"'
+JSON_LD_START = b'<script type="application/ld+json"'
+SCRIPT_END = b'</script>'
+# IMDb image urls take size modifiers after ._V1_ - the title page html shows
+# the poster at this width, so request the same size rather than the original
+POSTER_WIDTH = 190
+# size of the chunks the stream extractor feeds to its parser
+STREAM_CHUNK_SIZE = 16 * 1024
+
+DEFAULT_EXTRACTOR = 'json'
+FALLBACK_EXTRACTOR = 'soup'
+
+
+@dataclass
+class TitlePageFields:
+    # Note that rating is 0 if there is no rating.  None works with sorting on the db model
+    # as well, however the value given to None shows as higher than numerical ratings.  This
+    # way the rating is lower.  Downstream we still render the rating as 'N/A' if it is 0, since
+    # IMDb doesn't allow 0 ratings.
+    rating: float = 0
+    blurb: str = ''
+    img_url: str = None
+
+    def __bool__(self):
+        return bool(self.rating or self.blurb or self.img_url)
+
+
+def _rating_from_text(text: str) -> float:
+    return float(text.split('/')[0]) if text else 0
+
+
+def fields_from_soup(soup: BeautifulSoup) -> TitlePageFields:
+    """Finds the fields in a parsed title page."""
+    ratings_div = soup.find('div', attrs={'data-testid': RATING_TESTID})
+    plot_p = soup.find('span', attrs={'data-testid': PLOT_TESTID})
+    img_list = soup.select('img.ipc-image')
+    return TitlePageFields(
+        rating=_rating_from_text(ratings_div.text) if ratings_div else 0,
+        blurb=plot_p.text if plot_p else '',
+        img_url=img_list[0]['src'] if img_list else None,
+    )
+
+
+def extract_with_soup(content: bytes) -> TitlePageFields:
+    return fields_from_soup(BeautifulSoup(content, 'html.parser'))
+
+
+_title_page_strainer = SoupStrainer(
+    attrs={'data-testid': re.compile(f'^({RATING_TESTID}|{PLOT_TESTID}|{POSTER_TESTID})$')}
+)
+
+
+def extract_with_strainer(content: bytes) -> TitlePageFields:
+    # the poster img.ipc-image is inside the hero-media__poster div
+    return fields_from_soup(BeautifulSoup(content, 'html.parser', parse_only=_title_page_strainer))
+
+
+def extract_with_lxml(content: bytes) -> TitlePageFields:
+    doc = lxml.html.fromstring(content)
+    ratings = doc.xpath(f'//div[@data-testid="{RATING_TESTID}"]')
+    plots = doc.xpath(f'//span[@data-testid="{PLOT_TESTID}"]')
+    img_urls = doc.xpath('//img[contains(concat(" ", normalize-space(@class), " "), " ipc-image ")]/@src')
+    return TitlePageFields(
+        rating=_rating_from_text(ratings[0].text_content()) if ratings else 0,
+        blurb=plots[0].text_content() if plots else '',
+        img_url=str(img_urls[0]) if img_urls else None,
+    )
+
+
+def script_json(content: bytes, script_start: bytes):
+    """Decodes the json in the first script block starting with script_start.
+
+    :return decoded json or None if there is no such block or it isn't valid json
+    """
+    start = content.find(script_start)
+    if start == -1:
+        return None
+    start = content.find(b'>', start) + 1
+    end = content.find(SCRIPT_END, start)
+    if not start or end == -1:
+        return None
+    try:
+        return json.loads(content[start:end])
+    except ValueError:
+        return None
+
+
+def next_data(content: bytes) -> dict:
+    """:return the page data from the __NEXT_DATA__ script block, or None"""
+    data = script_json(content, NEXT_DATA_START)
+    try:
+        return data['props']['pageProps']
+    except (KeyError, TypeError):
+        return None
+
+
+def sized_image_url(img_url: str, width: int) -> str:
+    """:return IMDb image url resized to width, or img_url if it has no size modifier"""
+    if img_url and '._V1_.' in img_url:
+        return img_url.replace('._V1_.', f'._V1_QL75_UX{width}_.')
+    return img_url
+
+
+def cropped_image_url(img_url: str, width: int, height: int, image_width: int, image_height: int) -> str:
+    """:return IMDb image url scaled to cover width x height and cropped to it, centred, as the
+    search page html does, or sized_image_url(img_url, width) if the image size is unknown
+
+    :param image_width, image_height - size of the full image
+    """
+    if not img_url or '._V1_.' not in img_url or not image_width or not image_height:
+        return sized_image_url(img_url, width)
+    if image_width * height > image_height * width:
+        # wider than the box - scaled to its height, cropped at the sides
+        scaled = (2 * image_width * height + image_height) // (2 * image_height)
+        size, crop = f'UY{height}', f'CR{(scaled - width + 1) // 2},0,{width},{height}'
+    else:
+        scaled = (2 * image_height * width + image_width) // (2 * image_width)
+        size, crop = f'UX{width}', f'CR0,{(scaled - height + 1) // 2},{width},{height}'
+    return img_url.replace('._V1_.', f'._V1_QL75_{size}_{crop}_.')
+
+
+def _fields_from_next_data(page_data: dict) -> TitlePageFields:
+    above_the_fold = page_data.get('aboveTheFoldData') or {}
+    ratings = above_the_fold.get('ratingsSummary') or {}
+    plot_text = (above_the_fold.get('plot') or {}).get('plotText') or {}
+    image = above_the_fold.get('primaryImage') or {}
+    return TitlePageFields(
+        rating=ratings.get('aggregateRating') or 0,
+        blurb=plot_text.get('plainText') or '',
+        img_url=sized_image_url(image.get('url'), POSTER_WIDTH),
+    )
+
+
+def _fields_from_json_ld(json_ld: dict) -> TitlePageFields:
+    rating = (json_ld.get('aggregateRating') or {}).get('ratingValue')
+    return TitlePageFields(
+        rating=float(rating) if rating else 0,
+        blurb=html.unescape(json_ld.get('description') or ''),
+        img_url=sized_image_url(json_ld.get('image'), POSTER_WIDTH),
+    )
+
+
+def extract_with_json(content: bytes) -> TitlePageFields:
+    page_data = next_data(content)
+    if page_data:
+        return _fields_from_next_data(page_data)
+    json_ld = script_json(content, JSON_LD_START)
+    if isinstance(json_ld, dict):
+        return _fields_from_json_ld(json_ld)
+    return TitlePageFields()
+
+
+class StreamingTitlePageParser(HTMLParser):
+    """Incremental title page parser.
+
+    feed() it the page in chunks - once `done` the rest of the page can be skipped.
+    The JSON-LD block in the page's head has all the fields, so usually only the
+    first chunk is needed.  Otherwise the fields are read from the html.
+    """
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+        self.fields = TitlePageFields()
+        self.json_ld_found = False
+        self.in_poster = False
+        # (field, tag, nesting depth) of the element whose text is being collected
+        self.capture = None
+        self.text = []
+
+    @property
+    def done(self) -> bool:
+        return self.json_ld_found or bool(self.fields.rating and self.fields.blurb and self.fields.img_url)
+
+    def feed(self, data: bytes):
+        if not self.done:
+            super().feed(self.decoder.decode(data))
+
+    def close(self) -> TitlePageFields:
+        if not self.done:
+            super().feed(self.decoder.decode(b'', final=True))
+            super().close()
+        return self.fields
+
+    def handle_starttag(self, tag, attrs):
+        if self.capture:
+            field, capture_tag, depth = self.capture
+            if tag == capture_tag:
+                self.capture = (field, capture_tag, depth + 1)
+            return
+        attrs = dict(attrs)
+        testid = attrs.get('data-testid')
+        if tag == 'script' and attrs.get('type') == 'application/ld+json':
+            self.capture = ('json_ld', tag, 1)
+        elif testid == RATING_TESTID and not self.fields.rating:
+            self.capture = ('rating', tag, 1)
+        elif testid == PLOT_TESTID and not self.fields.blurb:
+            self.capture = ('blurb', tag, 1)
+        elif testid == POSTER_TESTID:
+            self.in_poster = True
+        elif tag == 'img' and self.in_poster and 'ipc-image' in (attrs.get('class') or '').split():
+            self.fields.img_url = self.fields.img_url or attrs.get('src')
+            self.in_poster = False
+
+    def handle_endtag(self, tag):
+        if not self.capture:
+            return
+        field, capture_tag, depth = self.capture
+        if tag != capture_tag:
+            return
+        if depth > 1:
+            self.capture = (field, capture_tag, depth - 1)
+            return
+        text = ''.join(self.text)
+        self.capture = None
+        self.text = []
+        if field == 'json_ld':
+            self._handle_json_ld(text)
+        elif field == 'rating':
+            self.fields.rating = _rating_from_text(text)
+        else:
+            self.fields.blurb = text
+
+    def handle_data(self, data):
+        if self.capture:
+            self.text.append(data)
+
+    def _handle_json_ld(self, text: str):
+        try:
+            json_ld = json.loads(text)
+        except ValueError:
+            return
+        if isinstance(json_ld, dict):
+            fields = _fields_from_json_ld(json_ld)
+            if fields:
+                self.fields = fields
+                self.json_ld_found = True
+
+
+def extract_with_stream(content: bytes) -> TitlePageFields:
+    parser = StreamingTitlePageParser()
+    for start in range(0, len(content), STREAM_CHUNK_SIZE):
+        if parser.done:
+            break
+        parser.feed(content[start:start + STREAM_CHUNK_SIZE])
+    return parser.close()
+
+
+EXTRACTORS = {
+    'soup': extract_with_soup,
+    'strainer': extract_with_strainer,
+    'lxml': extract_with_lxml,
+    'json': extract_with_json,
+    'stream': extract_with_stream,
+}
+
+
+def available_extractors() -> [str]:
+    return [name for name in EXTRACTORS if name != 'lxml' or lxml is not None]
+
+
+def extractor_name(name: str = None) -> str:
+    """:return name, or the name in settings, if it is available - otherwise the fallback"""
+    name = name or getattr(settings, 'IMDB_INFO_LOCAL_HTML_EXTRACTOR', DEFAULT_EXTRACTOR)
+    assert name in EXTRACTORS, f'unknown extractor: {name}'
+    if name not in available_extractors():
+        logger.debug(f'extractor {name} not available, using {FALLBACK_EXTRACTOR}')
+        return FALLBACK_EXTRACTOR
+    return name
+
+
+def extract_title_page(content: bytes, extractor: str = None) -> TitlePageFields:
+    """Extracts rating, blurb and image url from title page content.
+
+    :param content - title page html
+    :param extractor - name of extractor in EXTRACTORS, default from settings
+    :return TitlePageFields
+    """
+    name = extractor_name(extractor)
+    if name != FALLBACK_EXTRACTOR:
+        try:
+            fields = EXTRACTORS[name](content)
+            if fields:
+                return fields
+            logger.debug(f'extractor {name} found no fields, falling back to {FALLBACK_EXTRACTOR}')
+        except Exception as e:
+            logger.warning(f'extractor {name} failed, falling back to {FALLBACK_EXTRACTOR}: {e}')
+    return EXTRACTORS[FALLBACK_EXTRACTOR](content)
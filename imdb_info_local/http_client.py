@@ -0,0 +1,434 @@
+"""Shared HTTP client for all requests made to IMDb.
+
+Every search page, title page and image download goes through one pooled
+requests.Session, so connections to www.imdb.com and the image host are kept
+alive and reused instead of paying a new DNS lookup + TCP + TLS handshake per
+request.
+
+Settings (all optional):
+IMDB_INFO_LOCAL_HTTP_POOL_SIZE - max connections kept alive per host
+IMDB_INFO_LOCAL_HTTP_TIMEOUT - (connect, read) timeout in seconds
+IMDB_INFO_LOCAL_REQUESTS_PER_SECOND - global request rate shared by all scraper workers,
+    0 or None for no limit
+IMDB_INFO_LOCAL_STREAM_TITLE_PAGES - read title pages incrementally, stopping once the fields are found
+IMDB_INFO_LOCAL_STREAM_MAX_BYTES - most of a streamed page to read if the fields are not found
+
+fetch() and fetch_content() are the entry points for scraping - they go through
+the on-disk response cache (see cache.py) before the network.
+"""
+from dataclasses import dataclass, field
+import logging
+from pathlib import Path
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+from django.conf import settings
+
+from . import metrics
+from .http_policy import get_policy, RetriesExhausted
+from .cache import (get_cache, cache_mode, store_content, AtomicFile, CacheEntry, CacheMiss,
+                    CACHE_ONLY)
+
+logger = logging.getLogger(__name__)
+
+# Oct 26, 2022 - may need to update
+# Use this user agent to ensure the page we scrape is roughly as expected
+FIREFOX_USER_AGENT = 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10.15; rv:106.0) Gecko/20100101 Firefox/106.0'
+
+DEFAULT_POOL_SIZE = 10
+DEFAULT_TIMEOUT = (5, 30)
+DEFAULT_REQUESTS_PER_SECOND = 3
+# response headers kept with cached content
+CACHED_HEADERS = ('ETag', 'Last-Modified', 'Content-Type')
+DEFAULT_STREAM_MAX_BYTES = 2 * 1024 * 1024
+STREAM_CHUNK_SIZE = 16 * 1024
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+# number of distinct hosts to keep pools for - www.imdb.com and the image host
+POOL_CONNECTIONS = 4
+
+try:
+    import brotli  # noqa: F401 - urllib3 decodes br responses when this is installed
+    ACCEPT_ENCODING = 'gzip, deflate, br'
+except ImportError:
+    ACCEPT_ENCODING = 'gzip, deflate'
+
+_session = None
+_session_lock = threading.Lock()
+_rate_limiter = None
+
+
+def pool_size() -> int:
+    return getattr(settings, 'IMDB_INFO_LOCAL_HTTP_POOL_SIZE', DEFAULT_POOL_SIZE)
+
+
+def timeout():
+    return getattr(settings, 'IMDB_INFO_LOCAL_HTTP_TIMEOUT', DEFAULT_TIMEOUT)
+
+
+def requests_per_second() -> float:
+    return getattr(settings, 'IMDB_INFO_LOCAL_REQUESTS_PER_SECOND', DEFAULT_REQUESTS_PER_SECOND)
+
+
+def stream_title_pages() -> bool:
+    return getattr(settings, 'IMDB_INFO_LOCAL_STREAM_TITLE_PAGES', False)
+
+
+def stream_max_bytes() -> int:
+    return getattr(settings, 'IMDB_INFO_LOCAL_STREAM_MAX_BYTES', DEFAULT_STREAM_MAX_BYTES)
+
+
+class TokenBucket:
+    """Thread safe token bucket rate limiter.
+
+    Tokens are added at `rate` per second up to `capacity`.  Each request takes
+    one token, waiting until one is available.  So bursts of up to `capacity`
+    requests are allowed, but the long run average stays at `rate`.
+    """
+    def __init__(self, rate: float, capacity: float = None):
+        self.rate = rate
+        self.capacity = capacity if capacity else max(rate, 1)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def try_acquire(self) -> float:
+        """Takes a token if one is available without waiting.
+
+        :return 0 if a token was taken, otherwise seconds until one will be available
+        """
+        with self.lock:
+            self._refill(time.monotonic())
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return 0
+            return (1 - self.tokens) / self.rate
+
+    def acquire(self) -> float:
+        """Takes a token, sleeping until one is available.
+
+        :return seconds spent waiting
+        """
+        waited = 0.0
+        while True:
+            wait = self.try_acquire()
+            if not wait:
+                return waited
+            time.sleep(wait)
+            waited += wait
+
+
+def get_rate_limiter():
+    """Returns the shared TokenBucket, or None if requests are not rate limited."""
+    global _rate_limiter
+    rate = requests_per_second()
+    if not rate:
+        return None
+    if _rate_limiter is None or _rate_limiter.rate != rate:
+        with _session_lock:
+            if _rate_limiter is None or _rate_limiter.rate != rate:
+                _rate_limiter = TokenBucket(rate)
+    return _rate_limiter
+
+
+def _create_session() -> requests.Session:
+    session = requests.Session()
+    # pool_block so that more concurrent requests than pool_size wait for a free
+    # connection rather than opening throwaway connections
+    adapter = HTTPAdapter(pool_connections=POOL_CONNECTIONS, pool_maxsize=pool_size(), pool_block=True)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    session.headers.update({
+        'User-Agent': FIREFOX_USER_AGENT,
+        'Accept-Encoding': ACCEPT_ENCODING,
+        'Connection': 'keep-alive',
+    })
+    logger.debug(f'created http session: pool size: {pool_size()}, accept-encoding: {ACCEPT_ENCODING}')
+    return session
+
+
+def get_session() -> requests.Session:
+    """Returns the shared session, creating it on first use."""
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                _session = _create_session()
+    return _session
+
+
+def reset_session():
+    """Closes the shared session so the next request creates a new one,
+    e.g. after changing the pool settings."""
+    global _session
+    with _session_lock:
+        if _session is not None:
+            _session.close()
+        _session = None
+
+
+def http_get(url: str, **kwargs) -> requests.Response:
+    """GET url with the shared session, under the rate limiter and the http policy.
+
+    429 and 5xx responses, connection errors and timeouts are retried with backoff -
+    see http_policy.py.
+
+    :param url - url to fetch
+    :param kwargs - passed on to requests.Session.get, timeout defaults to the setting
+    :return requests.Response
+    :raise http_policy.RetriesExhausted if the request still fails after retries
+    """
+    kwargs.setdefault('timeout', timeout())
+    policy = get_policy()
+    rate_limiter = get_rate_limiter()
+    attempt = 0
+    while True:
+        wait = policy.wait_time()
+        while wait:
+            time.sleep(wait)
+            wait = policy.wait_time()
+        if rate_limiter:
+            rate_limiter.acquire()
+        with policy.controller.slot():
+            start = time.monotonic()
+            try:
+                r = get_session().get(url, **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                delay = policy.failed(url, attempt, time.monotonic() - start, e)
+            else:
+                try:
+                    delay = policy.completed(url, attempt, time.monotonic() - start, r.status_code, r.headers)
+                except RetriesExhausted:
+                    # a streamed response holds its connection until closed
+                    r.close()
+                    raise
+                if delay is None:
+                    return r
+                r.close()
+        time.sleep(delay)
+        attempt += 1
+
+
+@dataclass
+class Validators:
+    """Cache validators from a response, sent back to revalidate with a conditional GET."""
+    etag: str = ''
+    last_modified: str = ''
+
+    def __bool__(self):
+        return bool(self.etag or self.last_modified)
+
+    @classmethod
+    def from_headers(cls, headers) -> 'Validators':
+        return cls(etag=headers.get('ETag', ''), last_modified=headers.get('Last-Modified', ''))
+
+    def request_headers(self) -> dict:
+        headers = {}
+        if self.etag:
+            headers['If-None-Match'] = self.etag
+        if self.last_modified:
+            headers['If-Modified-Since'] = self.last_modified
+        return headers
+
+
+@dataclass
+class FetchResult:
+    """Content for a url and its validators.
+
+    not_modified is True when the caller passed validators and the content has
+    not changed since - content may then be None if it was not cached.
+    """
+    content: bytes
+    validators: Validators = field(default_factory=Validators)
+    not_modified: bool = False
+
+
+def fetch(url: str, kind: str, validators: Validators = None) -> FetchResult:
+    """Gets the content for url from the response cache, or fetches and caches it.
+
+    Stale cache entries are revalidated with a conditional GET using their stored
+    validators, or `validators` if given, so unchanged pages are not downloaded again.
+
+    :param url - url to fetch
+    :param kind - 'search' or 'title' - determines how long the response is cached
+    :param validators - validators the caller stored from an earlier fetch of url
+    :return FetchResult
+    :raise cache.CacheMiss in cache-only mode if url is not cached
+    """
+    with metrics.timed(f'{kind}_fetch'):
+        entry, result = cached_fetch_result(url, validators)
+        if result:
+            return result
+        conditional = validators or entry_validators(entry)
+        r = http_get(url, headers=conditional.request_headers())
+        return fetch_result_for_response(url, kind, r.status_code, r.content, r.headers, entry, validators)
+
+
+class StreamedBody:
+    """Feeds a response body to an incremental parser as it arrives.
+
+    The parser needs feed(bytes) and a `done` property.  Reading stops when the parser
+    is done or max_bytes have been read.  The body is only kept if it may be cached,
+    ie - while the whole body is being read with caching on.
+    """
+    def __init__(self, url: str, parser, max_bytes: int = None):
+        self.url = url
+        self.parser = parser
+        self.max_bytes = max_bytes or stream_max_bytes()
+        self.chunks = [] if get_cache() else None
+        self.received = 0
+        self.stopped = False
+
+    def add(self, chunk: bytes) -> bool:
+        """:return True to keep reading"""
+        self.received += len(chunk)
+        metrics.inc('response_bytes', len(chunk))
+        self.parser.feed(chunk)
+        if self.parser.done or self.received >= self.max_bytes:
+            if not self.parser.done:
+                logger.warning(f'stopped reading {self.url} at {self.received} bytes without finding all fields')
+            self.stopped = True
+            self.chunks = None
+        elif self.chunks is not None:
+            self.chunks.append(chunk)
+        return not self.stopped
+
+    def result(self, kind: str, headers) -> FetchResult:
+        """:return FetchResult for the body read - content is None unless the whole body was read"""
+        content = b''.join(self.chunks) if self.chunks is not None else None
+        logger.debug(f'streamed {self.received} bytes, stopped early: {self.stopped}: {self.url}')
+        if content is not None:
+            store_content(self.url, kind, content, cached_headers(headers))
+        return FetchResult(content, Validators.from_headers(headers))
+
+
+def fetch_streaming(url: str, kind: str, parser, validators: Validators = None) -> FetchResult:
+    """fetch(), feeding the content to parser as it arrives and closing the
+    connection as soon as the parser is done.
+
+    Cached content is fed to the parser whole.  A page is only cached if all of it was read.
+
+    :param parser - incremental parser with feed(bytes) and `done`,
+        eg - extractors.StreamingTitlePageParser
+    :return FetchResult, content is None if reading stopped early
+    :raise cache.CacheMiss in cache-only mode if url is not cached
+    """
+    with metrics.timed(f'{kind}_fetch'):
+        entry, result = cached_fetch_result(url, validators)
+        if result:
+            if result.content and not result.not_modified:
+                parser.feed(result.content)
+            return result
+        conditional = validators or entry_validators(entry)
+        with http_get(url, headers=conditional.request_headers(), stream=True) as r:
+            if r.status_code != 200:
+                return fetch_result_for_response(url, kind, r.status_code, r.content, r.headers, entry, validators)
+            body = StreamedBody(url, parser)
+            for chunk in r.iter_content(STREAM_CHUNK_SIZE):
+                if not body.add(chunk):
+                    break
+            return body.result(kind, r.headers)
+
+
+def fetch_to_file(url: str, kind: str, path: Path, mode: int = None) -> bool:
+    """Downloads url into the file at path.
+
+    Downloads are streamed in chunks to a temp file next to path, which is then
+    renamed to path, so the content is never all in memory and concurrent downloads
+    to the same path can't leave a mixed or partial file.
+
+    Downloads bypass the response cache - images are kept in the image store, named by
+    the hash of their content, so caching them too would only write each one twice.
+
+    :param mode - permissions for the file, owner only if None
+    :return True if the file was written, False for an error response or in cache-only mode
+    """
+    if not downloads_allowed(url):
+        return False
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with metrics.timed(f'{kind}_fetch'):
+        with http_get(url, stream=True) as r:
+            if r.status_code != 200:
+                logger.warning(f'{r.status_code} response for {url}')
+                return False
+            with AtomicFile(path, mode) as f:
+                for chunk in r.iter_content(DOWNLOAD_CHUNK_SIZE):
+                    metrics.inc('response_bytes', len(chunk))
+                    f.write(chunk)
+            return True
+
+
+def downloads_allowed(url: str) -> bool:
+    """:return False in cache-only mode, where fetch_to_file would have to use the network"""
+    if cache_mode() == CACHE_ONLY:
+        logger.info(f'not downloading in cache-only mode: {url}')
+        return False
+    return True
+
+
+def entry_validators(entry: CacheEntry) -> Validators:
+    return Validators.from_headers(entry.headers) if entry else Validators()
+
+
+def cached_fetch_result(url: str, validators: Validators = None) -> (CacheEntry, FetchResult):
+    """Looks up url in the response cache.
+
+    :return (cache entry or None, FetchResult if the cached content can be used
+        without a request, otherwise None)
+    :raise cache.CacheMiss in cache-only mode if url is not cached
+    """
+    cache = get_cache()
+    entry = cache.get(url) if cache else None
+    if cache_mode() == CACHE_ONLY or (entry and cache.is_fresh(entry)):
+        if entry is None:
+            metrics.inc('cache_misses')
+            raise CacheMiss(url)
+        metrics.inc('cache_hits')
+        cached_validators = entry_validators(entry)
+        return entry, FetchResult(entry.content, cached_validators,
+                                  not_modified=bool(validators) and validators == cached_validators)
+    if cache:
+        metrics.inc('cache_stale' if entry else 'cache_misses')
+    return entry, None
+
+
+def fetch_result_for_response(url: str, kind: str, status: int, content: bytes, headers,
+                              entry: CacheEntry, validators: Validators = None) -> FetchResult:
+    """Builds the FetchResult for a response from IMDb, caching the content.
+
+    :param entry - stale cache entry for url that may have been revalidated, or None
+    :param validators - validators the caller sent, if any
+    """
+    if content:
+        metrics.inc('response_bytes', len(content))
+    if status == 304:
+        metrics.inc('not_modified')
+        logger.debug(f'not modified: {url}')
+        conditional = validators or entry_validators(entry)
+        cached = entry is not None and entry_validators(entry) == conditional
+        if cached:
+            get_cache().touch(url)
+        return FetchResult(entry.content if cached else None, conditional, not_modified=bool(validators))
+    if 200 <= status < 300:
+        store_content(url, kind, content, cached_headers(headers))
+    return FetchResult(content, Validators.from_headers(headers))
+
+
+def fetch_content(url: str, kind: str) -> bytes:
+    """Gets the content for url from the response cache, or fetches and caches it.
+
+    :param url - url to fetch
+    :param kind - 'search' or 'title' - determines how long the response is cached
+    :return response content
+    :raise cache.CacheMiss in cache-only mode if url is not cached
+    """
+    return fetch(url, kind).content
+
+
+def cached_headers(headers) -> dict:
+    return {name: headers[name] for name in CACHED_HEADERS if name in headers}
@@ -0,0 +1,289 @@
+"""Retry, circuit breaker and adaptive concurrency policy for requests to IMDb.
+
+Every request from http_client.http_get and the async client goes through one
+shared HTTPPolicy:
+
+* retryable failures - 429 and 5xx responses, connection errors and timeouts -
+  are retried with jittered exponential backoff, waiting at least as long as
+  the response's Retry-After
+* a circuit breaker opens after consecutive failures, pausing all requests for
+  a while, then lets one probe request through to test whether IMDb has recovered
+* an AIMD controller limits the number of requests in flight - it halves the
+  limit when requests fail or are slower than the target latency, and adds one
+  per round of healthy requests - so long runs keep close to the highest
+  concurrency IMDb tolerates
+
+Settings (optional):
+IMDB_INFO_LOCAL_HTTP_POLICY - dict overriding any of DEFAULT_POLICY
+"""
+from contextlib import contextmanager
+from email.utils import parsedate_to_datetime
+import logging
+import random
+import threading
+import time
+
+from django.conf import settings
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+DEFAULT_POLICY = {
+    # attempts after the first before giving up on a request
+    'max_retries': 5,
+    # backoff before retry n is a random time up to min(cap, base * 2 ** n) seconds
+    'backoff_base': 1.0,
+    'backoff_cap': 60.0,
+    # consecutive failures that open the circuit, and seconds before a probe is let through
+    'failure_threshold': 5,
+    'reset_timeout': 30.0,
+    # concurrency limits for the AIMD controller - it starts at the max.  The thread engine
+    # is also limited by the http pool size, and the async engine by its --workers
+    'min_in_flight': 1,
+    'max_in_flight': 32,
+    # requests slower than this count as congestion, in seconds
+    'target_latency': 5.0,
+}
+# seconds to wait between checks while another request probes a half open circuit
+PROBE_POLL = 0.5
+
+_policy = None
+_policy_lock = threading.Lock()
+
+
+class RetriesExhausted(Exception):
+    """Raised when a request still fails after the policy's retries."""
+    def __init__(self, url: str, reason: str):
+        super().__init__(f'{url}: {reason}')
+        self.url = url
+        self.reason = reason
+
+
+def parse_retry_after(value: str) -> float:
+    """:return seconds to wait from a Retry-After header - seconds or an http date - or None"""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def backoff_delay(attempt: int, base: float, cap: float, retry_after: float = None) -> float:
+    """Full jitter exponential backoff, but no less than retry_after.
+
+    :param attempt - 0 for the first retry
+    """
+    delay = random.uniform(0, min(cap, base * 2 ** attempt))
+    return max(delay, retry_after or 0)
+
+
+class CircuitBreaker:
+    """Thread safe circuit breaker.
+
+    closed - requests go through.  After failure_threshold consecutive failures it opens.
+    open - requests wait until reset_timeout has passed, then it is half open.
+    half open - one probe request goes through while the others wait.  The circuit
+        closes if the probe succeeds, and opens again if it fails.
+    """
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half-open'
+
+    def __init__(self, failure_threshold: int, reset_timeout: float):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.probe_started = 0.0
+        self.lock = threading.Lock()
+
+    def wait_time(self) -> float:
+        """:return 0 if a request may go now, otherwise seconds to wait before asking again"""
+        with self.lock:
+            if self.state == self.CLOSED:
+                return 0
+            now = time.monotonic()
+            if self.state == self.OPEN:
+                remaining = self.opened_at + self.reset_timeout - now
+                if remaining > 0:
+                    return remaining
+                self.state = self.HALF_OPEN
+            elif now - self.probe_started < self.reset_timeout:
+                # another request is probing - a probe that never reported back is replaced
+                return PROBE_POLL
+            self.probe_started = now
+            logger.info('circuit half open - probing')
+            return 0
+
+    def record_success(self):
+        with self.lock:
+            if self.state != self.CLOSED:
+                logger.info('circuit closed')
+            self.state = self.CLOSED
+            self.failures = 0
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.state == self.HALF_OPEN or (self.state == self.CLOSED and
+                                                self.failures >= self.failure_threshold):
+                logger.warning(f'circuit open for {self.reset_timeout}s after {self.failures} failures')
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+
+
+class AIMDController:
+    """Thread safe limit on requests in flight, adjusted by additive increase /
+    multiplicative decrease.
+
+    Each failed or slow request halves the limit, at most once per target_latency
+    so one burst of failures doesn't collapse it.  Each healthy request adds 1 / limit,
+    ie - the limit grows by one per round of healthy requests.
+    """
+    def __init__(self, maximum: int, minimum: int = 1, target_latency: float = DEFAULT_POLICY['target_latency'],
+                 decrease_factor: float = 0.5):
+        self.maximum = maximum
+        self.minimum = minimum
+        self.target_latency = target_latency
+        self.decrease_factor = decrease_factor
+        self.limit = float(maximum)
+        self.in_flight = 0
+        self.last_decrease = float('-inf')
+        self.condition = threading.Condition()
+
+    def try_acquire(self) -> bool:
+        """Takes a slot if one is free without waiting."""
+        with self.condition:
+            if self.in_flight < int(self.limit):
+                self.in_flight += 1
+                return True
+            return False
+
+    def acquire(self):
+        with self.condition:
+            while self.in_flight >= int(self.limit):
+                self.condition.wait()
+            self.in_flight += 1
+
+    def release(self):
+        with self.condition:
+            self.in_flight -= 1
+            self.condition.notify()
+
+    @contextmanager
+    def slot(self):
+        self.acquire()
+        try:
+            yield
+        finally:
+            self.release()
+
+    def record(self, latency: float, ok: bool):
+        with self.condition:
+            if not ok or latency > self.target_latency:
+                now = time.monotonic()
+                if now - self.last_decrease >= self.target_latency:
+                    self.limit = max(self.minimum, self.limit * self.decrease_factor)
+                    self.last_decrease = now
+                    logger.info(f'requests in flight limit down to {int(self.limit)}')
+            else:
+                self.limit = min(self.maximum, self.limit + 1 / self.limit)
+                self.condition.notify_all()
+
+
+class HTTPPolicy:
+    """Decides whether and when to retry a request, and tracks the circuit breaker
+    and concurrency limit shared by all requests.
+
+    Request loops call wait_time() before each attempt, send inside a controller
+    slot, then completed() or failed(), which return the delay before retrying.
+    """
+    def __init__(self, max_retries: int, backoff_base: float, backoff_cap: float,
+                 breaker: CircuitBreaker, controller: AIMDController):
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+        self.breaker = breaker
+        self.controller = controller
+
+    def wait_time(self) -> float:
+        return self.breaker.wait_time()
+
+    def completed(self, url: str, attempt: int, latency: float, status: int, headers) -> float:
+        """Records a response.
+
+        :return None if the response should be used, otherwise seconds to wait before retrying
+        :raise RetriesExhausted for a retryable response on the last attempt
+        """
+        metrics.inc('requests')
+        metrics.observe('request', latency)
+        if status in RETRY_STATUSES:
+            metrics.inc('request_errors')
+            self.breaker.record_failure()
+            self.controller.record(latency, ok=False)
+            return self._retry_delay(url, attempt, f'{status} response', parse_retry_after(headers.get('Retry-After')))
+        self.breaker.record_success()
+        self.controller.record(latency, ok=True)
+        return None
+
+    def failed(self, url: str, attempt: int, latency: float, error: Exception) -> float:
+        """Records a connection error or timeout.
+
+        :return seconds to wait before retrying
+        :raise RetriesExhausted on the last attempt
+        """
+        metrics.inc('requests')
+        metrics.inc('request_errors')
+        metrics.observe('request', latency)
+        self.breaker.record_failure()
+        self.controller.record(latency, ok=False)
+        return self._retry_delay(url, attempt, f'{type(error).__name__}: {error}')
+
+    def _retry_delay(self, url: str, attempt: int, reason: str, retry_after: float = None) -> float:
+        if attempt >= self.max_retries:
+            metrics.inc('requests_failed')
+            raise RetriesExhausted(url, reason)
+        metrics.inc('retries')
+        delay = backoff_delay(attempt, self.backoff_base, self.backoff_cap, retry_after)
+        logger.info(f'retrying in {delay:.1f}s: {reason}: {url}')
+        return delay
+
+
+def policy_settings() -> dict:
+    return {**DEFAULT_POLICY, **getattr(settings, 'IMDB_INFO_LOCAL_HTTP_POLICY', {})}
+
+
+def get_policy() -> HTTPPolicy:
+    """Returns the shared HTTPPolicy, creating it on first use."""
+    global _policy
+    if _policy is None:
+        with _policy_lock:
+            if _policy is None:
+                options = policy_settings()
+                _policy = HTTPPolicy(
+                    max_retries=options['max_retries'],
+                    backoff_base=options['backoff_base'],
+                    backoff_cap=options['backoff_cap'],
+                    breaker=CircuitBreaker(options['failure_threshold'], options['reset_timeout']),
+                    controller=AIMDController(
+                        maximum=options['max_in_flight'],
+                        minimum=options['min_in_flight'],
+                        target_latency=options['target_latency'],
+                    ),
+                )
+    return _policy
+
+
+def reset_policy():
+    """Drops the shared policy so the next request creates one from the current settings."""
+    global _policy
+    with _policy_lock:
+        _policy = None
@@ -1,16 +1,33 @@
 import re
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 import logging
 from pathlib import Path
 from urllib.parse import urlparse
+import uuid
 
-import requests
 from bs4 import BeautifulSoup
+from django.conf import settings
 
-from .utils import parse_html_for_url
+from . import metrics
+from .http_client import fetch, fetch_content, fetch_streaming, fetch_to_file, stream_title_pages, Validators
+from .extractors import (StreamingTitlePageParser, extract_title_page, extractor_name, next_data, cropped_image_url,
+                         TitlePageFields)
+from .models import image_directory, store_image
+from .thumbnails import ensure_thumbnails
 
 logger = logging.getLogger(__name__)
 
+# size of the search result thumbnails in the html, used for the json results
+SEARCH_IMAGE_WIDTH = 100
+SEARCH_IMAGE_HEIGHT = 148
+DEFAULT_BASE_URL = 'https://www.imdb.com'
+
+
+def base_url() -> str:
+    """:return url that search and title pages are fetched from - IMDB_INFO_LOCAL_BASE_URL, e.g. to
+    point the scraper at a local fake IMDb (benchmarks/fake_imdb.py)"""
+    return getattr(settings, 'IMDB_INFO_LOCAL_BASE_URL', DEFAULT_BASE_URL).rstrip('/')
+
 
 @dataclass
 class IMDBFindTitleResult:
@@ -22,7 +39,7 @@ class IMDBFindTitleResult:
         return self.text
 
 
-def imdb_title_search_results(title: str) -> [IMDBFindTitleResult]:
+def imdb_title_search_results(title: str, extractor: str = None) -> [IMDBFindTitleResult]:
     """Searches for a title.
 
     Uses IMDB's search page to query for title and scrapes the results page.
@@ -30,12 +47,70 @@ def imdb_title_search_results(title: str) -> [IMDBFindTitleResult]:
 
     As of Oct 26, 2022, the html page returned from requests may have an
     alternate html format.  This is handled by _title_search_results_alternate_html.
+    With the 'json' extractor, the results are decoded from the page's json data
+    instead, which is the same for both formats.
 
+    :param extractor - name of the extractor - see extractors.py
     :return [IMDBFindTitleResult]
     """
+    content = fetch_content(title_search_url(title), kind='search')
+    return title_search_results_from_content(title, content, extractor)
+
+
+def title_search_url(title: str) -> str:
     name_query = title.replace(' ', '+')
-    url = f'https://www.imdb.com/find?q={name_query}'
-    soup = parse_html_for_url(url)
+    return f'{base_url()}/find?q={name_query}'
+
+
+def title_search_results_from_content(title: str, content: bytes, extractor: str = None) -> [IMDBFindTitleResult]:
+    """Scrapes the search results page content for candidate titles.
+
+    With the 'json' extractor, falls back to scraping the html if the page has no json data.
+    """
+    with metrics.timed('parse'):
+        if extractor_name(extractor) == 'json':
+            titles = title_search_results_from_next_data(title, next_data(content))
+            if titles is not None:
+                return titles
+            logger.debug(f'  {title} - no json data in search page, scraping html')
+        return title_search_results_from_soup(title, BeautifulSoup(content, 'html.parser'))
+
+
+def title_search_results_from_next_data(title: str, page_data: dict) -> [IMDBFindTitleResult]:
+    """Gets candidate titles from the search page's __NEXT_DATA__ json.
+
+    The results are built to be the same as those scraped from the html.
+
+    :param page_data - decoded page props from the search page, or None
+    :return [IMDBFindTitleResult], or None if page_data has no title results
+    """
+    try:
+        results = page_data['titleResults']['results']
+    except (KeyError, TypeError):
+        return None
+    logger.info(f'  {title} - json title results found - {len(results)} results')
+    titles = []
+    for i, result in enumerate(results):
+        image = result.get('titlePosterImageModel') or {}
+        img_url = cropped_image_url(image.get('url'), SEARCH_IMAGE_WIDTH, SEARCH_IMAGE_HEIGHT,
+                                    image.get('maxWidth'), image.get('maxHeight'))
+        if not img_url:
+            continue
+        title_url = f'{base_url()}/title/{result["id"]}/?ref_=fn_al_tt_{i}'
+        text_parts = [result.get('titleNameText'), result.get('titleReleaseText'), result.get('titleTypeText'),
+                      ', '.join(result.get('topCredits') or [])]
+        text = re.sub(r'\s\s+', ' ', ' '.join(part for part in text_parts if part)).strip()
+        titles.append(IMDBFindTitleResult(img_url=img_url, title_url=title_url, text=text))
+    return titles
+
+
+def title_search_results_from_soup(title: str, soup: BeautifulSoup) -> [IMDBFindTitleResult]:
+    """Scrapes the parsed search results page for candidate titles.
+
+    :param title - title searched for, used for logging
+    :param soup - parsed IMDB search page
+    :return [IMDBFindTitleResult]
+    """
     results_table = soup.find('table', class_='findList')
     titles = []
     if results_table:
@@ -44,7 +119,7 @@ def imdb_title_search_results(title: str) -> [IMDBFindTitleResult]:
         for tr in rows:
             img_url = tr.td.img['src']
             relative_url = tr.find_all('td')[1].a['href']
-            title_url = f'https://www.imdb.com{relative_url}'
+            title_url = f'{base_url()}{relative_url}'
             text = tr.find_all('td')[1].text.strip()
             titles.append(IMDBFindTitleResult(img_url, title_url, text))
     else:
@@ -80,7 +155,7 @@ def _largest_image_from_img_tag(img_tag: BeautifulSoup) -> str:
 def _title_url_from_li_tag(li_soup):
     a_tag = li_soup.find('a', href=re.compile('/title/.*'))
     relative_url = a_tag['href']
-    return f'https://www.imdb.com{relative_url}'
+    return f'{base_url()}{relative_url}'
 
 
 @dataclass
@@ -88,6 +163,9 @@ class IMDBTitleData:
     rating: float
     blurb: str
     image_file: Path
+    # where the data came from and its validators for revalidating later - not compared
+    title_url: str = field(default='', compare=False)
+    validators: Validators = field(default_factory=Validators, compare=False)
 
     def __str__(self):
         rating_str = f'{self.rating:.1f}/10' if self.rating else 'N/A'
@@ -101,45 +179,81 @@ def filename_stem_from_title_url(title_url: str) -> str:
         return m.groups()[0]
 
 
-def imdb_title_data(title_url: str) -> IMDBTitleData:
+def imdb_title_data(title_url: str, validators: Validators = None, extractor: str = None) -> IMDBTitleData:
     """Scrapes IMDB page for rating and title info.
 
+    If validators stored from an earlier scrape of the page are given, the page is
+    revalidated with a conditional GET, and nothing is parsed or downloaded if it
+    has not changed.
+
+    With the IMDB_INFO_LOCAL_STREAM_TITLE_PAGES setting on, and no extractor given,
+    the page is streamed and only read until the fields are found.
+
     :param - title_url - url of IMDB's page for the title.
-    :return IMDBTitleData - ie - rating and blurb (summary)
+    :param - validators - etag / last modified from the last scrape of title_url
+    :param - extractor - name of the html extractor to use - see extractors.py
+    :return IMDBTitleData - ie - rating and blurb (summary), or None if not modified
     """
-    soup = parse_html_for_url(title_url)
-    ratings_div = soup.find('div', attrs={'data-testid': "hero-rating-bar__aggregate-rating__score"})
-    # Note that we assign 0 here if there is no rating.  None works with sorting on the db model
-    # as well, however the value given to None shows as higher than numerical ratings.  This
-    # way the rating is lower.  Downstream we still render the rating as 'N/A' if it is 0, since
-    # IMDb doesn't allow 0 ratings.
-    rating = float(ratings_div.text.split('/')[0]) if ratings_div else 0
-    plot_p = soup.find('span', attrs={'data-testid': 'plot-l'})
-    if plot_p and plot_p.text:
-        blurb = plot_p.text
+    if stream_title_pages() and not extractor:
+        parser = StreamingTitlePageParser()
+        result = fetch_streaming(title_url, kind='title', parser=parser, validators=validators)
+        fields = parser.close()
     else:
-        blurb = f'No blurb for title_url: <a href="{title_url}">{title_url}</a>'
-    if not blurb:
-        logger.info(f'no blurb: title_url: {title_url}\n')
+        result = fetch(title_url, kind='title', validators=validators)
+        fields = TitlePageFields()
+    if result.not_modified:
+        logger.info(f'title page not modified: {title_url}')
+        return None
+    if not fields and result.content:
+        # not streamed, or streamed to the end without finding the fields
+        with metrics.timed('parse'):
+            fields = extract_title_page(result.content, extractor)
     image_filename_stem = filename_stem_from_title_url(title_url)
-    image_file = imdb_title_image_file(soup, image_filename_stem)
-    return IMDBTitleData(rating, blurb, image_file)
+    image_file = imdb_title_image_file(fields.img_url, image_filename_stem)
+    return IMDBTitleData(fields.rating, title_blurb(title_url, fields), image_file,
+                         title_url=title_url, validators=result.validators)
+
+
+def title_blurb(title_url: str, fields: TitlePageFields) -> str:
+    """:return the blurb from the title page, or a link to the page if there is none"""
+    if fields.blurb:
+        return fields.blurb
+    logger.info(f'no blurb: title_url: {title_url}')
+    return f'No blurb for title_url: <a href="{title_url}">{title_url}</a>'
 
 
-def imdb_title_image_file(html_soup: BeautifulSoup, filename_stem: str) -> Path:
-    """Parses html for image url, downloads and stores image locally.
+def download_file_path(img_url: str, filename_stem: str) -> Path:
+    """:return unique temporary path in the image directory to download the title's image to
 
-    :param html_soup - Beautiful soup parsed html
+    :param img_url - url the image is downloaded from, used for the file extension
     :param filename_stem - base filename for image file without extension
-    :return Path to local image file or None
     """
-    img_list = html_soup.select('img.ipc-image')
-    if img_list:
-        img_url = img_list[0]['src']
-        filename = filename_stem + Path(urlparse(img_url).path).suffix
-        local_file = f'/tmp/{filename}'
-        r = requests.get(img_url)
-        with open(local_file, 'wb') as f:
-            f.write(r.content)
-
-        return Path(local_file)
+    suffix = Path(urlparse(img_url).path).suffix
+    return image_directory() / f'.download-{filename_stem}-{uuid.uuid4().hex}{suffix}'
+
+
+def imdb_title_image_file(img_url: str, filename_stem: str) -> Path:
+    """Downloads the title's image straight into the image store, and creates its thumbnails.
+
+    :param img_url - url of the image from the title page, may be None
+    :param filename_stem - base filename for the download, used until the image is stored
+    :return Path to stored image file or None
+    """
+    if img_url:
+        download_path = download_file_path(img_url, filename_stem)
+        try:
+            if fetch_to_file(img_url, 'image', download_path, settings.FILE_UPLOAD_PERMISSIONS):
+                return store_downloaded_image(download_path)
+        finally:
+            download_path.unlink(missing_ok=True)
+
+
+def store_downloaded_image(download_path: Path) -> Path:
+    """Moves a downloaded image into the image store and creates its thumbnails.
+
+    :return Path to stored image file
+    """
+    with metrics.timed('image_store'):
+        image_path = store_image(download_path, move=True)
+        ensure_thumbnails(image_path, settings.FILE_UPLOAD_PERMISSIONS)
+    return image_path
@@ -0,0 +1,260 @@
+"""asyncio versions of the IMDB scraping functions in imdb.py.
+
+Pages and images are fetched with aiohttp, with a bound on the number of
+requests in flight, so hundreds of titles can be scraped from one thread.
+Parsing is shared with imdb.py, so both engines return the same results.
+Parsing - including feeding streamed pages to their parser - hashing and resizing
+images, writing downloads and response cache reads and writes all block, so they
+run in the loop's default thread pool rather than on the loop.
+
+aiohttp is only needed when this engine is used.
+"""
+import asyncio
+from contextlib import asynccontextmanager
+from functools import partial
+import logging
+import threading
+from concurrent.futures import Future
+from pathlib import Path
+
+from django.conf import settings
+
+from .http_client import (FIREFOX_USER_AGENT, ACCEPT_ENCODING, pool_size, timeout, get_rate_limiter,
+                          stream_title_pages, FetchResult, StreamedBody, STREAM_CHUNK_SIZE, DOWNLOAD_CHUNK_SIZE,
+                          cached_fetch_result, entry_validators, fetch_result_for_response, downloads_allowed,
+                          Validators)
+from . import metrics
+from .cache import AtomicFile
+from .http_policy import get_policy, RetriesExhausted
+from .imdb import (IMDBFindTitleResult, IMDBTitleData, title_search_url, title_search_results_from_content,
+                   title_blurb, filename_stem_from_title_url, download_file_path, store_downloaded_image)
+from .extractors import StreamingTitlePageParser, TitlePageFields, extract_title_page
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_IN_FLIGHT = 32
+# seconds between checks for a free slot when the http policy limits requests in flight
+SLOT_POLL = 0.05
+
+
+def run_blocking(func, *args):
+    """:return awaitable of func(*args) run in the event loop's default executor"""
+    return asyncio.get_running_loop().run_in_executor(None, func, *args)
+
+
+@asynccontextmanager
+async def atomic_file(path: Path, mode: int = None):
+    """cache.AtomicFile, with the temp file created, and renamed or removed, in the executor.
+    Writes to the file should go through run_blocking too."""
+    atomic = AtomicFile(path, mode)
+    f = await run_blocking(atomic.__enter__)
+    try:
+        yield f
+    except BaseException as e:
+        await run_blocking(atomic.__exit__, type(e), e, e.__traceback__)
+        raise
+    await run_blocking(atomic.__exit__, None, None, None)
+
+
+class AsyncHTTPClient:
+    """aiohttp session that bounds the number of requests in flight.
+
+    Requests share the rate limiter with the synchronous http client.
+    """
+    def __init__(self, max_in_flight: int = DEFAULT_MAX_IN_FLIGHT):
+        self.max_in_flight = max_in_flight
+        self.session = None
+        self.semaphore = None
+
+    async def open(self):
+        if aiohttp is None:
+            raise ImportError('aiohttp must be installed to use the async scraping engine')
+        timeouts = timeout()
+        connect_timeout, read_timeout = timeouts if isinstance(timeouts, tuple) else (timeouts, timeouts)
+        self.semaphore = asyncio.Semaphore(self.max_in_flight)
+        self.session = aiohttp.ClientSession(
+            headers={'User-Agent': FIREFOX_USER_AGENT, 'Accept-Encoding': ACCEPT_ENCODING},
+            timeout=aiohttp.ClientTimeout(sock_connect=connect_timeout, sock_read=read_timeout),
+            connector=aiohttp.TCPConnector(limit=self.max_in_flight, limit_per_host=pool_size()),
+        )
+
+    async def close(self):
+        if self.session:
+            await self.session.close()
+            self.session = None
+
+    async def fetch(self, url: str, kind: str, parser=None, validators: Validators = None) -> FetchResult:
+        """Async http_client.fetch - gets content from the response cache or fetches it.
+
+        :param parser - if given, the content is streamed to it - see http_client.fetch_streaming
+        :param validators - validators the caller stored from an earlier fetch of url
+        """
+        with metrics.timed(f'{kind}_fetch'):
+            entry, result = await run_blocking(cached_fetch_result, url, validators)
+            if result:
+                if parser and result.content and not result.not_modified:
+                    await run_blocking(parser.feed, result.content)
+                return result
+            async with self.semaphore:
+                headers = (validators or entry_validators(entry)).request_headers()
+                async with await self._get(url, headers) as response:
+                    if parser and response.status == 200:
+                        return await self._read_streaming(url, kind, parser, response)
+                    content = await response.read()
+                    return await run_blocking(fetch_result_for_response, url, kind, response.status, content,
+                                              response.headers, entry, validators)
+
+    async def fetch_to_file(self, url: str, kind: str, path: Path, mode: int = None) -> bool:
+        """Async http_client.fetch_to_file"""
+        if not downloads_allowed(url):
+            return False
+        await run_blocking(partial(path.parent.mkdir, parents=True, exist_ok=True))
+        with metrics.timed(f'{kind}_fetch'):
+            async with self.semaphore:
+                async with await self._get(url, {}) as response:
+                    if response.status != 200:
+                        logger.warning(f'{response.status} response for {url}')
+                        return False
+                    async with atomic_file(path, mode) as f:
+                        async for chunk in response.content.iter_chunked(DOWNLOAD_CHUNK_SIZE):
+                            metrics.inc('response_bytes', len(chunk))
+                            await run_blocking(f.write, chunk)
+                    return True
+
+    async def _get(self, url: str, headers: dict):
+        """Async http_client.http_get - GET url under the rate limiter and the http policy.
+
+        :return aiohttp.ClientResponse
+        :raise http_policy.RetriesExhausted if the request still fails after retries
+        """
+        policy = get_policy()
+        loop = asyncio.get_running_loop()
+        attempt = 0
+        while True:
+            wait = policy.wait_time()
+            while wait:
+                await asyncio.sleep(wait)
+                wait = policy.wait_time()
+            await self._wait_for_rate_limiter()
+            while not policy.controller.try_acquire():
+                await asyncio.sleep(SLOT_POLL)
+            start = loop.time()
+            try:
+                response = await self.session.get(url, headers=headers)
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+                delay = policy.failed(url, attempt, loop.time() - start, e)
+            else:
+                try:
+                    delay = policy.completed(url, attempt, loop.time() - start, response.status, response.headers)
+                except RetriesExhausted:
+                    response.release()
+                    raise
+                if delay is None:
+                    return response
+                response.release()
+            finally:
+                policy.controller.release()
+            await asyncio.sleep(delay)
+            attempt += 1
+
+    async def _wait_for_rate_limiter(self):
+        rate_limiter = get_rate_limiter()
+        while rate_limiter:
+            wait = rate_limiter.try_acquire()
+            if not wait:
+                break
+            await asyncio.sleep(wait)
+
+    async def _read_streaming(self, url: str, kind: str, parser, response) -> FetchResult:
+        body = StreamedBody(url, parser)
+        async for chunk in response.content.iter_chunked(STREAM_CHUNK_SIZE):
+            if not await run_blocking(body.add, chunk):
+                # drop the connection rather than reading the rest of the page
+                response.close()
+                break
+        return await run_blocking(body.result, kind, response.headers)
+
+
+async def imdb_title_search_results_async(client: AsyncHTTPClient, title: str,
+                                          extractor: str = None) -> [IMDBFindTitleResult]:
+    """Async imdb.imdb_title_search_results"""
+    result = await client.fetch(title_search_url(title), 'search')
+    return await run_blocking(title_search_results_from_content, title, result.content, extractor)
+
+
+async def imdb_title_data_async(client: AsyncHTTPClient, title_url: str, validators: Validators = None,
+                                extractor: str = None) -> IMDBTitleData:
+    """Async imdb.imdb_title_data
+
+    :return IMDBTitleData, or None if the page is not modified since validators
+    """
+    parser = StreamingTitlePageParser() if stream_title_pages() and not extractor else None
+    result = await client.fetch(title_url, 'title', parser, validators)
+    if result.not_modified:
+        logger.info(f'title page not modified: {title_url}')
+        return None
+    fields = await run_blocking(parser.close) if parser else TitlePageFields()
+    if not fields and result.content:
+        with metrics.timed('parse'):
+            fields = await run_blocking(extract_title_page, result.content, extractor)
+    image_filename_stem = filename_stem_from_title_url(title_url)
+    image_file = await imdb_title_image_file_async(client, fields.img_url, image_filename_stem)
+    return IMDBTitleData(fields.rating, title_blurb(title_url, fields), image_file,
+                         title_url=title_url, validators=result.validators)
+
+
+async def imdb_title_image_file_async(client: AsyncHTTPClient, img_url: str, filename_stem: str) -> Path:
+    """Async imdb.imdb_title_image_file"""
+    if img_url:
+        download_path = download_file_path(img_url, filename_stem)
+        try:
+            if await client.fetch_to_file(img_url, 'image', download_path, settings.FILE_UPLOAD_PERMISSIONS):
+                return await run_blocking(store_downloaded_image, download_path)
+        finally:
+            download_path.unlink(missing_ok=True)
+
+
+class AsyncScrapeExecutor:
+    """Runs scraping coroutines on an event loop in a background thread.
+
+    submit() and shutdown() mirror concurrent.futures.Executor, so callers can
+    use this engine the same way as a ThreadPoolExecutor.  Coroutine functions
+    are passed the executor's AsyncHTTPClient as their first argument.
+    """
+    def __init__(self, max_in_flight: int = DEFAULT_MAX_IN_FLIGHT):
+        self.client = AsyncHTTPClient(max_in_flight)
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, name='imdb-async-scraper', daemon=True)
+        self.thread.start()
+        try:
+            asyncio.run_coroutine_threadsafe(self.client.open(), self.loop).result()
+        except Exception:
+            self._stop_loop()
+            raise
+
+    def submit(self, fn, *args, **kwargs) -> Future:
+        """Schedules coroutine function fn(client, *args, **kwargs) on the loop."""
+        return asyncio.run_coroutine_threadsafe(fn(self.client, *args, **kwargs), self.loop)
+
+    async def _finish(self, cancel_futures: bool):
+        tasks = [task for task in asyncio.all_tasks(self.loop) if task is not asyncio.current_task()]
+        if cancel_futures:
+            for task in tasks:
+                task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await self.client.close()
+
+    def _stop_loop(self):
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
+
+    def shutdown(self, wait: bool = True, cancel_futures: bool = False):
+        """Waits for (or cancels) scheduled coroutines, then closes the client and loop."""
+        asyncio.run_coroutine_threadsafe(self._finish(cancel_futures), self.loop).result()
+        self._stop_loop()
@@ -0,0 +1,125 @@
+"""Journal of the titles run_scraper is working on, so an interrupted run can be resumed.
+
+Scraping a title goes through stages, and the last one completed is recorded in its
+ScrapeJournalEntry:
+
+scanned - the title directory was found and the title isn't in the db
+searched - IMDb was searched for the title - the find results are recorded
+fetched - the title page was scraped and its image stored - the title data is recorded
+saved - the title data is in the db - the entry is deleted
+
+Checkpoints are written in the same transaction as the batch of title data saved with
+them (see run_scraper.process_directory), so a run that fails or is killed at title
+4,000 of 5,000 loses at most one batch of progress.  When a title is scraped again,
+whether by `run_scraper --resume` or a normal run, it continues from its last completed
+stage - a fetched title is saved without any requests to IMDb.
+
+`run_scraper --resume` works on the titles in the journal only, without scanning the
+video directories again.
+"""
+from collections import defaultdict
+from dataclasses import dataclass, field, asdict
+import logging
+import os
+from pathlib import Path
+
+from .http_client import Validators
+from .imdb import IMDBFindTitleResult, IMDBTitleData
+from .models import IMDBTitleSearchData, ScrapeJournalEntry
+from .scan import RootScan, TitleDirectory
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class ScrapeCheckpoint:
+    """Progress of one title through the scraping stages.
+
+    Made from a journal entry in the main thread, updated by the scraping worker, and
+    read back into the entry by the main thread once the worker is done with it.
+    """
+    stage: str = ScrapeJournalEntry.SCANNED
+    find_results: [dict] = field(default_factory=list)
+    title_data: dict = None
+
+    @classmethod
+    def from_entry(cls, entry: ScrapeJournalEntry) -> 'ScrapeCheckpoint':
+        if entry is None:
+            return cls()
+        return cls(entry.stage, entry.data.get('find_results', []), entry.data.get('title_data'))
+
+    def searched(self, find_results: [IMDBFindTitleResult]):
+        self.stage = ScrapeJournalEntry.SEARCHED
+        self.find_results = [asdict(find_result) for find_result in find_results]
+
+    def fetched(self, title_data: IMDBTitleData):
+        self.stage = ScrapeJournalEntry.FETCHED
+        self.title_data = dict(
+            rating=title_data.rating,
+            blurb=title_data.blurb,
+            image_file=str(title_data.image_file) if title_data.image_file else None,
+            title_url=title_data.title_url,
+            etag=title_data.validators.etag,
+            last_modified=title_data.validators.last_modified,
+        )
+
+    def search_results(self) -> [IMDBFindTitleResult]:
+        return [IMDBFindTitleResult(**find_result) for find_result in self.find_results]
+
+    def imdb_title_data(self) -> IMDBTitleData:
+        data = self.title_data
+        return IMDBTitleData(data['rating'], data['blurb'], Path(data['image_file']) if data['image_file'] else None,
+                             title_url=data['title_url'],
+                             validators=Validators(etag=data['etag'], last_modified=data['last_modified']))
+
+    def update_entry(self, entry: ScrapeJournalEntry, error: str = ''):
+        entry.stage = self.stage
+        entry.data = {'find_results': self.find_results, 'title_data': self.title_data}
+        entry.error = error
+
+
+def journal_titles(title_type: str, new_titles: [(TitleDirectory, str)]) -> {str: ScrapeJournalEntry}:
+    """Adds entries for the titles that aren't in the journal yet.
+
+    :param new_titles - (title directory, title) pairs
+    :return file path -> journal entry, for each of new_titles
+    """
+    if not new_titles:
+        return {}
+    ScrapeJournalEntry.objects.bulk_create(
+        [ScrapeJournalEntry(type=title_type, title=title, file_path=title_dir.path,
+                            file_mtime_ns=title_dir.mtime_ns, file_ctime_ns=title_dir.ctime_ns)
+         for title_dir, title in new_titles],
+        ignore_conflicts=True)
+    paths = {title_dir.path for title_dir, _ in new_titles}
+    return {entry.file_path: entry for entry in ScrapeJournalEntry.objects.filter(type=title_type)
+            if entry.file_path in paths}
+
+
+def prune_journal() -> int:
+    """Deletes the entries of titles that are in the db, or whose directories are gone.
+
+    :return number of entries deleted
+    """
+    titles_in_db = set(IMDBTitleSearchData.objects.values_list('type', 'title'))
+    stale = [entry.pk for entry in ScrapeJournalEntry.objects.only('type', 'title', 'file_path')
+             if (entry.type, entry.title) in titles_in_db or not os.path.isdir(entry.file_path)]
+    ScrapeJournalEntry.objects.filter(pk__in=stale).delete()
+    return len(stale)
+
+
+def resume_scans() -> [RootScan]:
+    """:return scans of the unsaved titles in the journal, one per (directory, title type),
+        as if their directories had just been scanned"""
+    prune_journal()
+    title_dirs = defaultdict(list)
+    for entry in ScrapeJournalEntry.objects.all():
+        path = Path(entry.file_path)
+        title_dirs[(path.parent, entry.type)].append(
+            TitleDirectory(path.name, entry.file_path, entry.file_mtime_ns, entry.file_ctime_ns))
+    return [RootScan(root, title_type, available=True, entries=entries)
+            for (root, title_type), entries in title_dirs.items()]
+
+
+def clear_journal():
+    ScrapeJournalEntry.objects.all().delete()
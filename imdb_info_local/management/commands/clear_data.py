@@ -5,14 +5,19 @@ from django.core.management.base import BaseCommand
 from django.conf import settings
 
 from imdb_info_local.models import IMDBTitleSearchData, IMAGE_SUBDIRECTORY
+from imdb_info_local.journal import clear_journal
+from imdb_info_local.scan import clear_manifests
 
 
 class Command(BaseCommand):
     help = """Deletes all IMDBTitleSearchData objects from the database and all
-    title images from media storage."""
+    title images from media storage.  Incremental scan manifests and the scrape journal
+    are deleted too, so the next run_scraper --incremental adds everything again."""
 
     def handle(self, *args, **options):
         IMDBTitleSearchData.objects.all().delete()
+        clear_journal()
+        clear_manifests()
         for filename in Path(settings.MEDIA_ROOT).joinpath(IMAGE_SUBDIRECTORY).glob('*'):
             if filename.name != '.gitignore':
                 os.remove(filename)
@@ -0,0 +1,34 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from imdb_info_local.benchmarks.fake_imdb import FakeIMDbServer
+
+
+class Command(BaseCommand):
+    help = """Serve a local fake IMDb built from the test fixtures, for running the scraper offline.
+    Point the scraper at it by setting IMDB_INFO_LOCAL_BASE_URL to the url shown."""
+
+    def add_arguments(self, parser):
+        parser.add_argument('-p', '--port', type=int, default=8765, help='Port to serve on.  Default: 8765')
+        parser.add_argument('--latency', type=float, default=0.0, help='Seconds to delay each response.')
+        parser.add_argument('--jitter', type=float, default=0.0, help='Up to this many more seconds of delay.')
+        parser.add_argument('--error-rate', type=float, default=0.0,
+                            help='Fraction of requests answered with --error-status.')
+        parser.add_argument('--error-status', type=int, default=503, help='Status of injected errors.')
+        parser.add_argument('--rate', type=float, default=0,
+                            help='Requests per second above which requests get a 429.  Default: no limit')
+        parser.add_argument('--seed', type=int, help='Seed for jitter and injected errors.')
+
+    def handle(self, *args, **options):
+        server = FakeIMDbServer(port=options['port'], latency=options['latency'], jitter=options['jitter'],
+                                error_rate=options['error_rate'], error_status=options['error_status'],
+                                requests_per_second=options['rate'], seed=options['seed'])
+        with server:
+            self.stdout.write(f'fake IMDb serving on {server.base_url} - Ctrl-C to stop')
+            try:
+                while True:
+                    time.sleep(1)
+            except KeyboardInterrupt:
+                pass
+        self.stdout.write(f'served: {dict(server.stats)}')
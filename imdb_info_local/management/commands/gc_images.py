@@ -0,0 +1,111 @@
+from pathlib import Path, PurePosixPath
+import logging
+import os
+import time
+
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+
+from imdb_info_local.models import IMDBTitleSearchData, ScrapeJournalEntry, IMAGE_SUBDIRECTORY, image_directory
+from imdb_info_local.thumbnails import image_stem, thumbnail_paths
+
+logger = logging.getLogger(__name__)
+
+# image files checked against the db and deleted at a time
+DEFAULT_BATCH_SIZE = 500
+# seconds - newer files may be images stored for titles a running scrape hasn't saved yet
+DEFAULT_MIN_AGE = 3600
+
+
+def files_in_use() -> set:
+    """:return names of the image files, and their thumbnails, used by title data - including title
+        data fetched by an interrupted scrape and waiting in the journal to be saved"""
+    names = IMDBTitleSearchData.objects.exclude(image='').exclude(image__isnull=True).values_list('image', flat=True)
+    image_names = set(PurePosixPath(name).name for name in names.iterator())
+    for data in ScrapeJournalEntry.objects.filter(stage=ScrapeJournalEntry.FETCHED).values_list('data', flat=True):
+        image_file = (data.get('title_data') or {}).get('image_file')
+        if image_file:
+            image_names.add(Path(image_file).name)
+    in_use = set()
+    for name in image_names:
+        image_path = image_directory() / name
+        in_use.add(name)
+        in_use.update(path.name for path in thumbnail_paths(image_path))
+    return in_use
+
+
+def orphaned_image_files(min_age: float = DEFAULT_MIN_AGE) -> [Path]:
+    """:return files in the image directory that no title uses - images and thumbnails
+
+    Dot files - downloads and temp files in progress, .gitignore - and files modified in the
+    last min_age seconds are left out.
+    """
+    in_use = files_in_use()
+    cutoff = time.time() - min_age
+    orphans = []
+    try:
+        with os.scandir(image_directory()) as entries:
+            for entry in entries:
+                if entry.name.startswith('.') or entry.name in in_use or not entry.is_file():
+                    continue
+                if entry.stat().st_mtime > cutoff:
+                    continue
+                orphans.append(Path(entry.path))
+    except FileNotFoundError:
+        return []
+    return sorted(orphans)
+
+
+def remove_image_files(paths: [Path], batch_size: int = DEFAULT_BATCH_SIZE) -> int:
+    """Deletes image files in batches.
+
+    Each batch is checked against the db again just before it is deleted, so an image
+    a title started using since the orphans were found is kept, and so are its thumbnails.
+
+    :return number of files deleted
+    """
+    deleted = 0
+    for start in range(0, len(paths), batch_size):
+        batch = paths[start:start + batch_size]
+        names = {IMAGE_SUBDIRECTORY + path.name: path for path in batch}
+        # thumbnails are in use if their image is, whatever the image's extension
+        stems = {name: image_stem(path.name) for name, path in names.items()}
+        query = Q(image__in=names)
+        for stem in set(stems.values()) - {None}:
+            query |= Q(image__startswith=f'{IMAGE_SUBDIRECTORY}{stem}.')
+        in_use = set(IMDBTitleSearchData.objects.filter(query).values_list('image', flat=True))
+        stems_in_use = {PurePosixPath(name).stem for name in in_use}
+        for name, path in names.items():
+            if name in in_use or stems[name] in stems_in_use:
+                logger.debug(f'image now in use: {name}')
+                continue
+            path.unlink(missing_ok=True)
+            deleted += 1
+        logger.debug(f'deleted {deleted} of {len(paths)} orphaned image files')
+    return deleted
+
+
+class Command(BaseCommand):
+    help = """Deletes title images, and thumbnails, in media storage that no title uses,
+    e.g. the images of titles removed before images were deleted with their titles,
+    or images left by an interrupted scrape."""
+
+    def add_arguments(self, parser):
+        parser.add_argument('-n', '--dry-run', action='store_true',
+                            help='List the orphaned image files without deleting them.')
+        parser.add_argument('--min-age', type=float, default=DEFAULT_MIN_AGE,
+                            help=f'Only delete files not modified for this many seconds (default {DEFAULT_MIN_AGE}), '
+                                 'so images stored by a scrape that is running are kept.')
+        parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE,
+                            help=f'Files checked against the db and deleted at a time (default {DEFAULT_BATCH_SIZE}).')
+
+    def handle(self, *args, **options):
+        orphans = orphaned_image_files(options['min_age'])
+        size = sum(path.stat().st_size for path in orphans if path.exists())
+        if options['dry_run']:
+            for path in orphans:
+                self.stdout.write(str(path))
+            self.stdout.write(f'{len(orphans)} orphaned image files, {size / 1e6:.1f} MB')
+            return
+        deleted = remove_image_files(orphans, max(options['batch_size'], 1))
+        self.stdout.write(f'deleted {deleted} of {len(orphans)} orphaned image files, {size / 1e6:.1f} MB')
@@ -0,0 +1,37 @@
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+
+from imdb_info_local.catalog import (DEFAULT_SEED, DEFAULT_TV_FRACTION, DEFAULT_IMAGES, DEFAULT_BATCH_SIZE,
+                                     MOVIES_SUBDIRECTORY, TV_SUBDIRECTORY, generate_catalog)
+
+
+class Command(BaseCommand):
+    help = """Adds a synthetic catalog of titles to the db, with placeholder images and matching
+    title directories, for load testing.  The same seed gives the same catalog."""
+
+    def add_arguments(self, parser):
+        parser.add_argument('count', type=int, help='Number of titles.')
+        parser.add_argument('-R', '--root', action='append', required=True,
+                            help=f'Directory to create title directories under, in {MOVIES_SUBDIRECTORY}/ and ' +
+                                 f'{TV_SUBDIRECTORY}/, may be repeated to spread titles over several roots.')
+        parser.add_argument('--seed', type=int, default=DEFAULT_SEED,
+                            help=f'Random seed (default {DEFAULT_SEED}).')
+        parser.add_argument('--tv-fraction', type=float, default=DEFAULT_TV_FRACTION,
+                            help=f'Fraction of titles that are tv series (default {DEFAULT_TV_FRACTION}).')
+        parser.add_argument('--images', type=int, default=DEFAULT_IMAGES,
+                            help=f'Number of placeholder images shared by the titles (default {DEFAULT_IMAGES}), ' +
+                                 '0 for titles without images.')
+        parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE,
+                            help=f'Titles inserted at a time (default {DEFAULT_BATCH_SIZE}).')
+
+    def handle(self, *args, **options):
+        if options['count'] < 0 or options['images'] < 0:
+            raise CommandError('count and --images must not be negative')
+        roots = [Path(root) for root in options['root']]
+        added = generate_catalog(options['count'], roots, options['seed'], options['tv_fraction'],
+                                 options['images'], max(options['batch_size'], 1))
+        self.stdout.write(f'added {added} synthetic titles')
+        movie_dirs = [str((root / MOVIES_SUBDIRECTORY).resolve()) for root in roots]
+        tv_dirs = [str((root / TV_SUBDIRECTORY).resolve()) for root in roots]
+        self.stdout.write(f"IMDB_INFO_LOCAL_VIDEO_DIRS = {{'TV': {tv_dirs}, 'Movies': {movie_dirs}}}")
@@ -0,0 +1,60 @@
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+import logging
+import os
+
+from django.core.management.base import BaseCommand
+from django.conf import settings
+
+from rich.progress import track
+
+from imdb_info_local.models import IMDBTitleSearchData
+from imdb_info_local.thumbnails import ensure_thumbnails
+
+logger = logging.getLogger(__name__)
+
+# images handed to each worker process at a time
+CHUNK_SIZE = 16
+# images whose titles are marked as having thumbnails, or not, per query
+UPDATE_BATCH_SIZE = 500
+
+
+def image_names(force: bool = False) -> [str]:
+    """:return names of the stored title images whose titles aren't marked as having thumbnails,
+        all of them if force"""
+    titles = IMDBTitleSearchData.objects.exclude(image='').exclude(image__isnull=True)
+    if not force:
+        titles = titles.filter(has_thumbnails=False)
+    names = titles.order_by().values_list('image', flat=True).distinct()
+    return [name for name in names if (Path(settings.MEDIA_ROOT) / name).is_file()]
+
+
+def mark_thumbnails(names: [str], has_thumbnails: bool):
+    for start in range(0, len(names), UPDATE_BATCH_SIZE):
+        (IMDBTitleSearchData.objects.filter(image__in=names[start:start + UPDATE_BATCH_SIZE])
+         .update(has_thumbnails=has_thumbnails))
+
+
+class Command(BaseCommand):
+    help = """Creates thumbnails for title images that don't have them, e.g. images saved
+    before thumbnails were made on download, and marks the titles as having them."""
+
+    def add_arguments(self, parser):
+        parser.add_argument('-w', '--workers', type=int, default=os.cpu_count(),
+                            help='Number of worker processes.  Default: number of cpus')
+        parser.add_argument('-f', '--force', action='store_true',
+                            help='Recreate thumbnails that already exist.')
+
+    def handle(self, *args, **options):
+        names = image_names(options['force'])
+        paths = [Path(settings.MEDIA_ROOT) / name for name in names]
+        mode = settings.FILE_UPLOAD_PERMISSIONS
+        made, failed = [], []
+        with ProcessPoolExecutor(max_workers=options['workers']) as executor:
+            results = executor.map(ensure_thumbnails, paths, [mode] * len(paths), [options['force']] * len(paths),
+                                   chunksize=CHUNK_SIZE)
+            for name, ok in track(zip(names, results), total=len(paths), description='Creating thumbnails...'):
+                (made if ok else failed).append(name)
+        mark_thumbnails(made, True)
+        mark_thumbnails(failed, False)
+        self.stdout.write(f'created thumbnails for {len(made)} of {len(paths)} images')
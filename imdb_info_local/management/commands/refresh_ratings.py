@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+
+from imdb_info_local.refresh import (DEFAULT_MAX_REQUESTS, DEFAULT_MAX_TIME, DEFAULT_MIN_AGE_DAYS, DEFAULT_WORKERS,
+                                     refresh_ratings)
+
+
+class Command(BaseCommand):
+    help = """Re-fetches the title pages of the stalest titles - those scraped longest ago, and most
+    recently added - to refresh their ratings, until a request or time budget is spent."""
+
+    def add_arguments(self, parser):
+        parser.add_argument('--max-requests', type=int, default=DEFAULT_MAX_REQUESTS,
+                            help=f'Requests to IMDb to make at most, including retries and images ' +
+                                 f'(default {DEFAULT_MAX_REQUESTS}).')
+        parser.add_argument('--max-time', type=float, default=DEFAULT_MAX_TIME,
+                            help=f'Seconds to start refreshing titles for (default {DEFAULT_MAX_TIME}).')
+        parser.add_argument('--min-age', type=float, default=DEFAULT_MIN_AGE_DAYS,
+                            help=f'Only refresh titles not scraped for this many days (default {DEFAULT_MIN_AGE_DAYS}).')
+        parser.add_argument('-w', '--workers', type=int, default=DEFAULT_WORKERS,
+                            help=f'Number of titles to refresh concurrently (default {DEFAULT_WORKERS}).')
+
+    def handle(self, *args, **options):
+        result = refresh_ratings(max(options['max_requests'], 0), options['max_time'], options['min_age'],
+                                 options['workers'])
+        self.stdout.write(f'refreshed {result.refreshed} titles, {result.not_modified} not modified, ' +
+                          f'{result.failed} failed, {result.requests} requests - stopped: {result.stopped}')
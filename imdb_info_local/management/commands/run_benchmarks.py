@@ -0,0 +1,66 @@
+from django.core.management.base import BaseCommand
+
+from imdb_info_local.benchmarks import extractors, library, parsing, scraper
+from imdb_info_local.benchmarks.results import compare, read_results, write_results
+
+# suite -> (run function, options of this command it takes)
+SUITES = {
+    'parsing': (parsing.run, ['repeat']),
+    'extractors': (extractors.run, ['repeat']),
+    'scanning': (library.run_scanning, ['titles']),
+    'persistence': (library.run_persistence, ['titles']),
+    'rendering': (library.run_rendering, ['repeat', 'titles']),
+    'scraper': (scraper.run, ['repeat', 'titles', 'scenarios', 'latency']),
+}
+
+
+class Command(BaseCommand):
+    help = """Run performance benchmarks and print the results."""
+
+    def add_arguments(self, parser):
+        parser.add_argument('-s', '--suite', action='append', choices=SUITES.keys(),
+                            help='Suite to run, may be repeated.  Default all suites.')
+        parser.add_argument('-r', '--repeat', type=int,
+                            help='Runs of each timed operation.  Default: 20 for parsing and extractors, '
+                                 '3 for rendering, 1 for scraper')
+        parser.add_argument('-t', '--titles', type=int, action='append',
+                            help=f'Number of synthetic titles, may be repeated.  '
+                                 f'Default: scanning {", ".join(map(str, library.SCANNING_TITLE_COUNTS))}, '
+                                 f'persistence {", ".join(map(str, library.PERSISTENCE_TITLE_COUNTS))}, '
+                                 f'rendering {", ".join(map(str, library.RENDERING_TITLE_COUNTS))}, '
+                                 f'scraper {", ".join(map(str, scraper.TITLE_COUNTS))}')
+        parser.add_argument('--scenario', dest='scenarios', action='append',
+                            choices=[scenario.name for scenario in scraper.SCENARIOS],
+                            help='scraper - scenario to run, may be repeated.  Default all scenarios.')
+        parser.add_argument('--latency', type=float,
+                            help=f'scraper - seconds the fake IMDb delays each response.  '
+                                 f'Default: {scraper.DEFAULT_LATENCY}')
+        parser.add_argument('-o', '--json-out', metavar='PATH',
+                            help='Also write the results as json to PATH.')
+        parser.add_argument('-c', '--compare', metavar='PATH',
+                            help='Show the change in timings from the results in PATH, written by an earlier '
+                                 '--json-out.')
+
+    def handle(self, *args, **options):
+        baseline = read_results(options['compare']) if options.get('compare') else {}
+        results = {}
+        for suite in options.get('suite') or SUITES:
+            run, option_names = SUITES[suite]
+            results[suite] = run(**{name: options[name] for name in option_names if options.get(name) is not None})
+            rows = compare(results[suite], baseline[suite]) if suite in baseline else results[suite]
+            self.stdout.write(format_table(rows))
+            if options.get('json_out'):
+                # written after each suite, so a long run that is stopped keeps the suites it finished
+                write_results(options['json_out'], results)
+
+
+def format_table(rows: [dict]) -> str:
+    if not rows:
+        return ''
+    columns = list(dict.fromkeys(col for row in rows for col in row))
+    widths = {col: max(len(col), *(len(str(row.get(col, ''))) for row in rows)) for col in columns}
+    lines = ['  '.join(col.ljust(widths[col]) for col in columns)]
+    lines.append('  '.join('-' * widths[col] for col in columns))
+    for row in rows:
+        lines.append('  '.join(str(row.get(col, '')).ljust(widths[col]) for col in columns))
+    return '\n'.join(lines) + '\n'
@@ -1,20 +1,50 @@
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field, replace
 from pathlib import Path
+import json
 import logging
-import time
+import os
 
 from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Q
 from django.utils import timezone
 from django.conf import settings
-from django.core.files import File
 
 from rich.progress import track
 
-from imdb_info_local.models import IMDBTitleSearchData, add_image_file, NONEXISTENT_PATH
-from imdb_info_local.imdb import (imdb_title_search_results, imdb_title_data,
+from imdb_info_local.cache import set_cache_mode, CacheMiss, NORMAL, CACHE_ONLY, NO_CACHE
+from imdb_info_local import coalesce, metrics
+from imdb_info_local.coalesce import SEARCH, TITLE, coalesced, coalesced_async
+from imdb_info_local.http_policy import RetriesExhausted
+from imdb_info_local.journal import ScrapeCheckpoint, journal_titles, prune_journal, resume_scans
+from imdb_info_local.profiling import Profile, PROFILERS
+from imdb_info_local.models import (IMDBTitleSearchData, ScrapeJournalEntry, add_image_file, update_image_file,
+                                    release_images, NONEXISTENT_PATH)
+from imdb_info_local.scan import (RootScan, RootManifest, RootDiff, TitleDirectory, load_manifest, save_manifest,
+                                  scan_root, scan_roots, diff_scan)
+from imdb_info_local.imdb import (imdb_title_search_results, imdb_title_data, filename_stem_from_title_url,
                                   IMDBTitleData, IMDBFindTitleResult)
+from imdb_info_local.imdb_async import (AsyncScrapeExecutor, AsyncHTTPClient, imdb_title_search_results_async,
+                                        imdb_title_data_async)
 
 logger = logging.getLogger(__name__)
 
+# number of titles scraped concurrently - requests are still limited overall by
+# IMDB_INFO_LOCAL_REQUESTS_PER_SECOND
+DEFAULT_WORKERS = 4
+# 'thread' - a pool of `workers` threads, 'async' - one asyncio event loop with
+# at most `workers` requests in flight
+ENGINES = ('thread', 'async')
+DEFAULT_ENGINE = 'thread'
+# scraped titles saved to the db per transaction
+SAVE_BATCH_SIZE = 100
+# titles looked up in the db per query when reconciling - under sqlite's variable limit
+TITLE_LOOKUP_BATCH_SIZE = 500
+# fields set on the title data of a renamed title directory
+REPLACED_FIELDS = ['title', 'type', 'rating', 'blurb', 'find_results', 'file_path', 'file_mtime', 'file_ctime',
+                   'title_url', 'etag', 'last_modified', 'image', 'has_thumbnails', 'last_scraped']
+
 
 class IMDBTitleSearchResults:
     def __init__(self, title: str,
@@ -28,7 +58,7 @@ class IMDBTitleSearchResults:
         return f"{self.title}\n{self.title_data}"
 
 
-def get_imdb_title_data(title: str) -> IMDBTitleSearchResults:
+def get_imdb_title_data(title: str, checkpoint: ScrapeCheckpoint = None) -> IMDBTitleSearchResults:
     """Searches IMDB for title and scrapes for info.
 
     The algorithm:
@@ -40,19 +70,40 @@ def get_imdb_title_data(title: str) -> IMDBTitleSearchResults:
     The find results from step 2 are saved so they can be presented to the
     user in case the wrong title is picked.
 
+    During a run, searches and title pages are shared with other titles that look up
+    the same ones - see coalesce.py.
+
+    :param checkpoint - the title's progress from an earlier attempt, if any.  Stages
+        already completed are skipped, and it is updated as each stage completes.
     :return IMDBTitleSearchResults
     """
-    search_results = imdb_title_search_results(title)
-    if search_results:
-        target = search_results[0]
-        title_data = imdb_title_data(target.title_url)
-        return IMDBTitleSearchResults(title, search_results, title_data)
-    else:
-        return IMDBTitleSearchResults(
-            title=title,
-            find_results=search_results,
-            title_data= IMDBTitleData(0, 'No titles found in search', NONEXISTENT_PATH)
-        )
+    checkpoint = checkpoint or ScrapeCheckpoint()
+    if checkpoint.stage == ScrapeJournalEntry.SCANNED:
+        checkpoint.searched(coalesced(SEARCH, title, imdb_title_search_results, title))
+    search_results = checkpoint.search_results()
+    if checkpoint.stage == ScrapeJournalEntry.SEARCHED:
+        title_url = search_results[0].title_url if search_results else None
+        checkpoint.fetched(coalesced(TITLE, title_url, imdb_title_data, title_url) if title_url else
+                           IMDBTitleData(0, 'No titles found in search', NONEXISTENT_PATH))
+    return IMDBTitleSearchResults(title, search_results, checkpoint.imdb_title_data())
+
+
+async def get_imdb_title_data_async(client: AsyncHTTPClient, title: str,
+                                    checkpoint: ScrapeCheckpoint = None) -> IMDBTitleSearchResults:
+    """Async version of get_imdb_title_data for the async engine.
+
+    :param client - AsyncHTTPClient used for all requests
+    :return IMDBTitleSearchResults
+    """
+    checkpoint = checkpoint or ScrapeCheckpoint()
+    if checkpoint.stage == ScrapeJournalEntry.SCANNED:
+        checkpoint.searched(await coalesced_async(SEARCH, title, imdb_title_search_results_async, client, title))
+    search_results = checkpoint.search_results()
+    if checkpoint.stage == ScrapeJournalEntry.SEARCHED:
+        title_url = search_results[0].title_url if search_results else None
+        checkpoint.fetched(await coalesced_async(TITLE, title_url, imdb_title_data_async, client, title_url)
+                           if title_url else IMDBTitleData(0, 'No titles found in search', NONEXISTENT_PATH))
+    return IMDBTitleSearchResults(title, search_results, checkpoint.imdb_title_data())
 
 
 def find_results_html(find_results: [IMDBFindTitleResult]) -> str:
@@ -63,36 +114,262 @@ def find_results_html(find_results: [IMDBFindTitleResult]) -> str:
     return html
 
 
-def remove_title_data_for_deleted_files(directory: Path, title_type: str='MO') -> [str]:
+def remove_title_data_for_deleted_files(directory: Path, title_type: str='MO', scan: RootScan = None) -> [str]:
     """Remove unneeded title data model objects
 
+    Only the path, title and image of the title data under directory are read from the db,
+    and the title data whose title directories are gone is deleted with one query.  Their
+    image files are deleted too, unless another title uses them.
+
     :param directory - path to directory holding videos
     :param title_type - 'MO' for movies, or 'TV' for tv shows
+    :param scan - scan of directory, if already made
     :return - list of titles removed
     """
-    if not directory.is_dir():
+    assert title_type in ('MO', 'TV'), 'wrong title type'
+    if scan is None:
+        with metrics.timed('scan'):
+            scan = scan_root(directory, title_type)
+    if not scan.available:
         logger.info(f'Not removing titles: directory does not exist: {str(directory.resolve())}')
         return []
-    assert title_type in ('MO', 'TV'), 'wrong title type'
 
-    video_title_dirs = [file for file in directory.iterdir() if file.is_dir()]
+    removed, removed_pks, removed_images = [], [], []
+    title_paths_in_dir = scan.paths
+    title_data_in_dir = (IMDBTitleSearchData.objects
+                         .filter(type=title_type, file_path__startswith=os.path.join(str(directory.resolve()), ''))
+                         .values_list('pk', 'file_path', 'title', 'image'))
+    for pk, file_path, title, image in title_data_in_dir.iterator():
+        if file_path not in title_paths_in_dir:
+            removed_pks.append(pk)
+            removed.append(title)
+            removed_images.append(image)
+
+    with metrics.timed('db_write'), transaction.atomic():
+        IMDBTitleSearchData.objects.filter(pk__in=removed_pks).delete()
+    release_images(removed_images)
+    return removed
+
+
+def title_from_directory_name(name: str) -> str:
+    return name.replace('-', ' ')
+
+
+def update_file_times(title_type: str, title_dirs: [TitleDirectory]):
+    """Updates the stored mtime and ctime of title directories whose contents changed, so
+    that e.g. a tv show with new episodes is listed with the recently changed titles."""
+    for title_dir in title_dirs:
+        (IMDBTitleSearchData.objects.filter(type=title_type, file_path=title_dir.path)
+         .update(file_mtime=title_dir.mtime, file_ctime=title_dir.ctime))
+
+
+@dataclass
+class Reconciliation:
+    """Differences between the scanned title directories and one snapshot of the title data in the db."""
+    # (scan, its title directories with no title data), in scan order
+    added: list = field(default_factory=list)
+    # title data whose title directories are gone
+    removed: [IMDBTitleSearchData] = field(default_factory=list)
+    # (title data, its title directory in a new place)
+    moved: list = field(default_factory=list)
+
+
+@dataclass
+class ReconcileResult:
+    removed: [str] = field(default_factory=list)
+    moved: [str] = field(default_factory=list)
+    added: [str] = field(default_factory=list)
+
+    def __bool__(self):
+        return bool(self.removed or self.moved or self.added)
+
+
+def titles_of_type_in_db(keys: {(str, str)}) -> {(str, str)}:
+    """:param keys - (title type, title) pairs
+    :return the keys that title data in the db has, wherever its directory is"""
+    found = set()
+    for title_type in {title_type for title_type, _ in keys}:
+        titles = sorted(title for key_type, title in keys if key_type == title_type)
+        for start in range(0, len(titles), TITLE_LOOKUP_BATCH_SIZE):
+            found.update(IMDBTitleSearchData.objects
+                         .filter(type=title_type, title__in=titles[start:start + TITLE_LOOKUP_BATCH_SIZE])
+                         .values_list('type', 'title'))
+    return found
+
+
+def reconcile(scans: [RootScan]) -> Reconciliation:
+    """Compares scans of the video directories with the title data in the db, in one pass.
+
+    Only title data under a listed directory can be removed or moved - titles on a drive
+    that isn't mounted, or in a directory an incremental scan skipped, are left alone.
+    A new title directory with the same title and type as title data whose directory is
+    gone is a move, e.g. a title moved to another drive.  Otherwise, as in process_directory,
+    a new title directory is only added if there is no title data with its title and type.
+
+    Only the title data under the listed directories is read from the db, filtered there by
+    type and path prefix, and then the titles of the new title directories are looked up.
+    """
+    listed = [scan for scan in scans if scan.available and scan.entries is not None]
+    if not listed:
+        return Reconciliation()
+    under_listed = Q()
+    for scan in listed:
+        under_listed |= Q(type=scan.title_type, file_path__startswith=os.path.join(str(scan.root.resolve()), ''))
+    scanned_paths = {(scan.title_type, entry.path) for scan in listed for entry in scan.entries}
+    snapshot = list(IMDBTitleSearchData.objects.filter(under_listed)
+                    .only('title', 'type', 'file_path', 'title_url', 'image'))
+    paths_in_db = {(title_data.type, title_data.file_path) for title_data in snapshot}
+    gone = {}
+    for title_data in snapshot:
+        if (title_data.type, title_data.file_path) not in scanned_paths:
+            gone.setdefault((title_data.type, title_data.title), []).append(title_data)
+    unknown = [(scan, entry) for scan in listed for entry in scan.entries
+               if (scan.title_type, entry.path) not in paths_in_db]
+    titles_in_db = titles_of_type_in_db({(scan.title_type, title_from_directory_name(entry.name))
+                                         for scan, entry in unknown})
+
+    reconciliation = Reconciliation()
+    for scan in listed:
+        new_entries = []
+        for entry in scan.entries:
+            if (scan.title_type, entry.path) in paths_in_db:
+                continue
+            key = (scan.title_type, title_from_directory_name(entry.name))
+            if gone.get(key):
+                reconciliation.moved.append((gone[key].pop(), entry))
+            elif key in titles_in_db:
+                logger.debug(f'title of same type exists: {key[1]} type: {key[0]}')
+            else:
+                new_entries.append(entry)
+        if new_entries:
+            reconciliation.added.append((scan, new_entries))
+    reconciliation.removed = [title_data for titles in gone.values() for title_data in titles]
+    return reconciliation
+
+
+def apply_reconciliation(reconciliation: Reconciliation, workers: int = DEFAULT_WORKERS,
+                         engine: str = DEFAULT_ENGINE) -> ReconcileResult:
+    """Moves, adds and removes title data to match the video directories.
+
+    Moved titles only have their paths updated - nothing is fetched from IMDb.  Title data
+    whose directory is gone is only deleted after the new titles are scraped: a new title
+    directory whose top search result is the same IMDb title, e.g. a renamed directory,
+    takes over that title data rather than it being deleted and a new row created.
+    """
+    result = ReconcileResult()
+    moved = []
+    for title_data, entry in reconciliation.moved:
+        logger.debug(f'title moved: {title_data.title}: {title_data.file_path} -> {entry.path}')
+        title_data.file_path, title_data.file_mtime, title_data.file_ctime = entry.path, entry.mtime, entry.ctime
+        moved.append(title_data)
+        result.moved.append(title_data.title)
+    with metrics.timed('db_write'):
+        IMDBTitleSearchData.objects.bulk_update(moved, ['file_path', 'file_mtime', 'file_ctime'])
+
+    replaceable = {(title_data.type, filename_stem_from_title_url(title_data.title_url)): title_data
+                   for title_data in reconciliation.removed if title_data.title_url}
+    not_replaced = dict(replaceable)
+    for scan, entries in reconciliation.added:
+        result.added.extend(process_directory(scan.root, scan.title_type, workers, engine,
+                                              scan=replace(scan, entries=entries), replaces=not_replaced))
+    replaced = {id(title_data) for key, title_data in replaceable.items() if key not in not_replaced}
     removed = []
+    for title_data in reconciliation.removed:
+        if id(title_data) in replaced:
+            result.moved.append(title_data.title)
+        else:
+            removed.append(title_data)
+            result.removed.append(title_data.title)
+    with metrics.timed('db_write'):
+        IMDBTitleSearchData.objects.filter(pk__in=[title_data.pk for title_data in removed]).delete()
+    release_images(title_data.image.name for title_data in removed)
+    return result
 
-    title_paths_in_dir = set([str(title.resolve()) for title in video_title_dirs])
-    paths_and_titles_in_db = {title_data.file_path: title_data
-                              for title_data
-                              in IMDBTitleSearchData.objects.filter(type=title_type)
-                              if title_data.file_path.startswith(str(directory))}
-    titles_in_db_not_in_dir = set(paths_and_titles_in_db.keys()) - title_paths_in_dir
 
-    for title_path in titles_in_db_not_in_dir:
-        paths_and_titles_in_db[title_path].delete()
-        removed.append(paths_and_titles_in_db[title_path].title)
+def reconcile_directories(directories: [(Path, str)], workers: int = DEFAULT_WORKERS,
+                          engine: str = DEFAULT_ENGINE) -> ReconcileResult:
+    """Scans directories and reconciles the title data in the db with them in one pass.
 
-    return removed
+    :param directories - (directory, title type) pairs
+    """
+    with metrics.timed('scan'):
+        scans = scan_roots(directories)
+    for scan in scans:
+        if not scan.available:
+            logger.info(f'Not scanning titles: directory does not exist: {str(scan.root.resolve())}')
+    return apply_reconciliation(reconcile(scans), workers, engine)
+
+
+def process_directories_incrementally(directories: [(Path, str)], workers: int = DEFAULT_WORKERS,
+                                      engine: str = DEFAULT_ENGINE) -> ReconcileResult:
+    """Removes and adds titles for what changed in directories since the last incremental run.
 
+    Directories whose mtime hasn't changed are skipped without listing them - see scan.py.
+    The directories that changed are reconciled with the db as in a full run, and title
+    directories whose contents changed get their stored times updated.
 
-def process_directory(directory: Path, title_type: str = 'MO'):
+    :param directories - (directory, title type) pairs
+    :return - ReconcileResult
+    """
+    manifests = {(directory, title_type): load_manifest(directory, title_type)
+                 for directory, title_type in directories}
+    with metrics.timed('scan'):
+        scans = scan_roots(directories, {key: manifest for key, manifest in manifests.items() if manifest})
+    diffs = []
+    for scan in scans:
+        if not scan.available:
+            logger.info(f'Not scanning titles: directory does not exist: {str(scan.root.resolve())}')
+            continue
+        diff = diff_scan(scan, manifests[(scan.root, scan.title_type)] or RootManifest(str(scan.root), scan.title_type))
+        if diff is None:
+            logger.debug(f'directory unchanged: {scan.root}')
+            continue
+        logger.debug(f'directory changed: {scan.root}: {len(diff.added)} added, {len(diff.removed)} removed, '
+                     f'{len(diff.changed)} changed')
+        update_file_times(scan.title_type, diff.changed)
+        diffs.append(diff)
+
+    result = apply_reconciliation(reconcile(scans), workers, engine)
+    for diff in diffs:
+        save_manifest(scanned_manifest(diff))
+    return result
+
+
+def scanned_manifest(diff: RootDiff) -> RootManifest:
+    """:return the manifest for a directory after the titles in diff were processed
+
+    Title directories that were skipped after failed requests are left out, and the
+    directory's mtime isn't recorded, so they are tried again on the next run.
+    """
+    scan = diff.scan
+    titles = {entry.name: title_from_directory_name(entry.name) for entry in diff.added}
+    titles_in_db = set(IMDBTitleSearchData.objects.filter(type=scan.title_type, title__in=titles.values())
+                       .values_list('title', flat=True))
+    skipped = {name for name, title in titles.items() if title not in titles_in_db}
+    return RootManifest(
+        root=str(scan.root),
+        title_type=scan.title_type,
+        mtime_ns=None if skipped else scan.mtime_ns,
+        children={entry.name: entry.mtime_ns for entry in scan.entries if entry.name not in skipped},
+    )
+
+
+def save_title_data(new_title_data: [IMDBTitleSearchData], replaced_title_data: [IMDBTitleSearchData],
+                    checkpointed: [ScrapeJournalEntry] = (), saved: [ScrapeJournalEntry] = ()):
+    """Saves a batch of scraped title data, and the journal checkpoints that go with it, in one transaction.
+
+    :param checkpointed - journal entries of titles not saved, updated to their last completed stage
+    :param saved - journal entries of the titles saved, which are deleted
+    """
+    with metrics.timed('db_write'), transaction.atomic():
+        IMDBTitleSearchData.objects.bulk_create(new_title_data)
+        IMDBTitleSearchData.objects.bulk_update(replaced_title_data, REPLACED_FIELDS)
+        ScrapeJournalEntry.objects.bulk_update(checkpointed, ['stage', 'data', 'error'])
+        ScrapeJournalEntry.objects.filter(pk__in=[entry.pk for entry in saved]).delete()
+
+
+def process_directory(directory: Path, title_type: str = 'MO', workers: int = DEFAULT_WORKERS,
+                      engine: str = DEFAULT_ENGINE, scan: RootScan = None, replaces: dict = None):
     """Processes filepaths in directory.
 
     For each file:
@@ -122,31 +399,98 @@ def process_directory(directory: Path, title_type: str = 'MO'):
     and this is not meant to be robust in terms of the title that is displayed.
     It's more important to get the right IMdb info.
 
+    New titles are scraped by a pool of `workers` threads, so the search, title and
+    image requests for different titles overlap.  With the async engine all titles are
+    scraped on one event loop instead, with at most `workers` requests in flight.
+    The overall request rate is limited by the shared rate limiter in http_client.
+    Failed requests are retried by the http policy (see http_policy.py) - titles whose
+    requests still fail, or in cache-only mode whose pages aren't cached, are skipped and
+    left for the next run.
+    Results are saved to the db from this thread in directory order, in batches of
+    SAVE_BATCH_SIZE titles per transaction.  Each title's progress is checkpointed in the
+    journal with its batch - see journal.py - so a title that failed, or was in a batch
+    that wasn't saved, continues from its last completed stage the next time it is scraped.
+
     :param directory - path to directory holding videos
     :param title_type - 'MO' for movies, or 'TV' for tv shows
+    :param workers - number of titles (thread engine) or requests (async engine) in flight
+    :param engine - 'thread' or 'async'
+    :param scan - scan of directory, if already made - only its title directories are processed
+    :param replaces - (title type, IMDb title id) -> title data of a deleted title directory.  A title
+        whose top search result is one of these updates that title data instead of being added, and
+        is removed from replaces.
     :return - list of titles added
     """
-    if not directory.is_dir():
+    assert title_type in ('MO', 'TV'), 'wrong title type'
+    assert engine in ENGINES, 'wrong engine'
+    if scan is None:
+        with metrics.timed('scan'):
+            scan = scan_root(directory, title_type)
+    if not scan.available:
         logger.info(f'Not adding titles: directory does not exist: {str(directory.resolve())}')
         return []
-    assert title_type in ('MO', 'TV'), 'wrong title type'
-
-    added = []
-    title_subdirs = [d for d in directory.iterdir() if d.is_dir()]
 
-    for subdir in track(title_subdirs, description=f'Processing {title_type} titles...'):
-        try:
-            logger.debug(f'processing: {subdir}')
-            path = subdir.resolve()
-            mtime = int(subdir.stat().st_mtime)
-            ctime = int(subdir.stat().st_ctime)
-            logger.debug(f'path: {path}\nmtime: {mtime}, ctime: {ctime}')
-            title = subdir.name.replace('-', ' ')
-
-            if not IMDBTitleSearchData.objects.filter(title=title, type=title_type):
-                title_search_results = get_imdb_title_data(title)
+    added, skipped = [], []
+    new_titles = []
+    titles_in_db = set(IMDBTitleSearchData.objects.filter(type=title_type).values_list('title', flat=True))
+    for title_dir in scan.entries:
+        title = title_from_directory_name(title_dir.name)
+        if title not in titles_in_db:
+            new_titles.append((title_dir, title))
+            titles_in_db.add(title)
+        else:
+            logger.debug(f'title of same type exists: {title} type: {title_type}')
+
+    journal_entries = journal_titles(title_type, new_titles)
+    new_title_data, replaced_title_data, checkpointed, saved = [], [], [], []
+    # images of replaced titles, deleted once the batch is saved unless a title uses them
+    old_images = []
+
+    def save_batch():
+        save_title_data(new_title_data, replaced_title_data, checkpointed, saved)
+        release_images(old_images)
+        for batch in (new_title_data, replaced_title_data, checkpointed, saved, old_images):
+            batch.clear()
+
+    def record_checkpoint(title_dir: TitleDirectory, checkpoint: ScrapeCheckpoint, error: str):
+        entry = journal_entries.get(title_dir.path)
+        if entry:
+            checkpoint.update_entry(entry, error)
+            checkpointed.append(entry)
+
+    if engine == 'async':
+        executor = AsyncScrapeExecutor(max_in_flight=max(workers, 1))
+        scrape = get_imdb_title_data_async
+    else:
+        executor = ThreadPoolExecutor(max_workers=max(workers, 1))
+        scrape = get_imdb_title_data
+    try:
+        futures = []
+        for title_dir, title in new_titles:
+            checkpoint = ScrapeCheckpoint.from_entry(journal_entries.get(title_dir.path))
+            futures.append((title_dir, title, checkpoint, executor.submit(scrape, title, checkpoint)))
+        for title_dir, title, checkpoint, future in track(futures, description=f'Processing {title_type} titles...'):
+            try:
+                logger.debug(f'processing: {title_dir.path}')
+                path, mtime, ctime = title_dir.path, title_dir.mtime, title_dir.ctime
+                logger.debug(f'path: {path}\nmtime: {mtime}, ctime: {ctime}')
+
+                try:
+                    title_search_results = future.result()
+                except RetriesExhausted as e:
+                    # not saved, so the title is scraped again on the next run, from its checkpoint
+                    logger.warning(f'Skipping title, requests to IMDb failed: {title}: {e.reason}')
+                    skipped.append(title)
+                    record_checkpoint(title_dir, checkpoint, e.reason)
+                    continue
+                except CacheMiss as e:
+                    # --cache-only, and a page the title needs was never cached
+                    logger.warning(f'Skipping title, not in the response cache: {title}: {e}')
+                    skipped.append(title)
+                    record_checkpoint(title_dir, checkpoint, f'not cached: {e}')
+                    continue
                 logger.debug(f'title data: {title_search_results}')
-                title_data_instance = IMDBTitleSearchData(
+                fields = dict(
                     title=title,
                     type=title_type,
                     rating=title_search_results.title_data.rating,
@@ -154,20 +498,49 @@ def process_directory(directory: Path, title_type: str = 'MO'):
                     find_results=find_results_html(title_search_results.find_results),
                     file_path=path,
                     file_mtime=mtime,
-                    file_ctime=ctime
+                    file_ctime=ctime,
+                    title_url=title_search_results.title_data.title_url,
+                    last_scraped=timezone.now(),
                 )
-                add_image_file(title_data_instance, title_search_results.title_data.image_file)
-                title_data_instance.save()
-                added.append(title)
-                time.sleep(1)
-            else:
-                logger.debug(f'title of same type exists: {title} type: {title_type}')
-        except Exception as e:
-            logger.error(f'Exception handling dir: {subdir}')
-            raise
+                replaced = replaces.pop((title_type, filename_stem_from_title_url(fields['title_url'])), None) \
+                    if replaces and fields['title_url'] else None
+                if replaced:
+                    logger.debug(f'title directory renamed: {replaced.title} -> {title}')
+                    for name, value in fields.items():
+                        setattr(replaced, name, value)
+                    replaced.set_validators(title_search_results.title_data.validators)
+                    old_images.append(update_image_file(replaced, title_search_results.title_data.image_file,
+                                                        save=False))
+                    replaced_title_data.append(replaced)
+                else:
+                    title_data_instance = IMDBTitleSearchData(**fields)
+                    title_data_instance.set_validators(title_search_results.title_data.validators)
+                    add_image_file(title_data_instance, title_search_results.title_data.image_file, save=False)
+                    new_title_data.append(title_data_instance)
+                    added.append(title)
+                if title_dir.path in journal_entries:
+                    saved.append(journal_entries[title_dir.path])
+                if len(new_title_data) + len(replaced_title_data) >= SAVE_BATCH_SIZE:
+                    save_batch()
+            except Exception as e:
+                logger.error(f'Exception handling dir: {title_dir.path}')
+                record_checkpoint(title_dir, checkpoint, f'{type(e).__name__}: {e}')
+                raise
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
+        # titles scraped before an error are kept
+        save_batch()
+    if skipped:
+        logger.warning(f'Skipped {len(skipped)} titles after failed requests: {skipped}')
     return added
 
 
+def video_directories() -> [(Path, str)]:
+    """:return (directory, title type) for the directories in IMDB_INFO_LOCAL_VIDEO_DIRS, movies first"""
+    return ([(Path(movie_dir), 'MO') for movie_dir in settings.IMDB_INFO_LOCAL_VIDEO_DIRS['Movies']] +
+            [(Path(tv_dir), 'TV') for tv_dir in settings.IMDB_INFO_LOCAL_VIDEO_DIRS['TV']])
+
+
 class Command(BaseCommand):
     help = """Select movie or tv titles from filenames, scrape IMDB for data on each title.
     Then store as models."""
@@ -176,40 +549,105 @@ class Command(BaseCommand):
         parser.add_argument('-d', '--dir', help='Get titles from this directory.')
         parser.add_argument('-t', '--type', help='Use with -d, --dir, specify video type in directory -- ' +
                                                  '"TV" for tv shows, or "MO" for movies')
+        parser.add_argument('-w', '--workers', type=int, default=DEFAULT_WORKERS,
+                            help=f'Number of titles to scrape concurrently (default {DEFAULT_WORKERS}).  ' +
+                                 'With the async engine, the number of requests in flight.')
+        parser.add_argument('-e', '--engine', choices=ENGINES, default=DEFAULT_ENGINE,
+                            help=f'Scraping engine (default {DEFAULT_ENGINE}).')
+        parser.add_argument('-i', '--incremental', action='store_true',
+                            help='Only scan video directories, and titles in them, that changed since the last ' +
+                                 'incremental run.  Ignored with -d, --dir.')
+        parser.add_argument('-r', '--resume', action='store_true',
+                            help='Only scrape the titles an interrupted run did not save, each from the last stage ' +
+                                 'it completed, without scanning the video directories.')
+        parser.add_argument('--metrics-out', metavar='PATH',
+                            help='Write the run\'s metrics as json to PATH, and for the Prometheus textfile ' +
+                                 'collector to PATH with a .prom suffix.')
+        parser.add_argument('--profile', metavar='PATH',
+                            help='Profile the run and write the profile to PATH - see --profiler.')
+        parser.add_argument('--profiler', choices=PROFILERS,
+                            help='Profiler for --profile: cprofile (default), written as a .prof file, or ' +
+                                 'sampling (needs pyinstrument), written as a speedscope file.  Sampling only sees ' +
+                                 'the main thread, not the threads that scrape.')
+        cache_group = parser.add_mutually_exclusive_group()
+        cache_group.add_argument('--cache-only', action='store_true',
+                                 help='Only use cached IMDb responses, fresh or stale - never fetch from IMDb.')
+        cache_group.add_argument('--no-cache', action='store_true',
+                                 help='Neither read nor write the IMDb response cache.')
 
     def handle(self, *args, **options):
+        if options.get('cache_only'):
+            set_cache_mode(CACHE_ONLY)
+        elif options.get('no_cache'):
+            set_cache_mode(NO_CACHE)
+        profile = None
+        if options.get('profile'):
+            # both engines scrape in other threads - the async engine's event loop has its own
+            profile = Profile(options.get('profiler'), threads=True)
+            profile.start()
+        coalesce.start_run()
+        metrics.start_run()
+        try:
+            self.scrape(**options)
+        finally:
+            set_cache_mode(NORMAL)
+            if profile:
+                profile.stop()
+                path = profile.write(Path(options['profile']))
+                logger.info(f'Wrote {profile.profiler} profile to {path}')
+            stats = coalesce.finish_run()
+            if stats:
+                logger.info(f"Coalesced lookups: {stats['search_hits']} of " +
+                            f"{stats['search_calls'] + stats['search_hits']} searches and {stats['title_hits']} of " +
+                            f"{stats['title_calls'] + stats['title_hits']} title pages shared with another title")
+            self.report_metrics(metrics.finish_run(), options.get('metrics_out'))
+
+    def report_metrics(self, run_metrics: metrics.RunMetrics, metrics_out: str = None):
+        summary = run_metrics.summary()
+        phases = {phase: data['seconds'] for phase, data in summary['phases'].items()}
+        brief = {'duration_seconds': summary['duration_seconds'], 'phase_seconds': phases,
+                 'counters': summary['counters']}
+        logger.info(f'Run metrics: {json.dumps(brief)}')
+        if metrics_out:
+            metrics.write_metrics(run_metrics, Path(metrics_out))
+            logger.info(f'Wrote run metrics to {metrics_out}')
+
+    def scrape(self, **options):
         dir_ = options.get('dir')
         title_type = options.get('type')
-        if dir_ or title_type:
+        workers = options.get('workers') or DEFAULT_WORKERS
+        engine = options.get('engine') or DEFAULT_ENGINE
+        if options.get('resume'):
+            scans = resume_scans()
+            if not scans:
+                logger.info('No unsaved titles to resume')
+            for scan in scans:
+                added = process_directory(scan.root, scan.title_type, workers, engine, scan=scan)
+                if added:
+                    logger.info(f'Added titles: {added}')
+        elif dir_ or title_type:
             assert title_type in ('MO', 'TV'), 'wrong title type'
             if not (dir_ and title_type):
                 logger.error(f'Type must be specified with directory option: dir: {dir_}, type: {title_type}')
                 return
 
-            added_movies = process_directory(Path(dir_), title_type)
+            added_movies = process_directory(Path(dir_), title_type, workers, engine)
             if added_movies:
                 logger.info(f'Added movies: {added_movies}')
         else:
-
-            removed_movies, removed_tv = [], []
-            for movie_dir in settings.IMDB_INFO_LOCAL_VIDEO_DIRS['Movies']:
-                removed_movies.extend(remove_title_data_for_deleted_files(Path(movie_dir), 'MO'))
-            for tv_dir in settings.IMDB_INFO_LOCAL_VIDEO_DIRS['TV']:
-                removed_tv.extend(remove_title_data_for_deleted_files(Path(tv_dir), 'TV'))
-
-            added_movies, added_tv = [], []
-            for movie_dir in settings.IMDB_INFO_LOCAL_VIDEO_DIRS['Movies']:
-                added_movies.extend(process_directory(Path(movie_dir), 'MO'))
-            for tv_dir in settings.IMDB_INFO_LOCAL_VIDEO_DIRS['TV']:
-                added_tv.extend(process_directory(Path(tv_dir), 'TV'))
-
-            if removed_movies:
-                logger.info(f'Removed movies: {removed_movies}')
-            if removed_tv:
-                logger.info(f'Removed tv: {removed_tv}')
-            if added_movies:
-                logger.info(f'Added movies: {added_movies}')
-            if added_tv:
-                logger.info(f'Added tv: {added_tv}')
-            if not (removed_movies or removed_tv or added_movies or added_tv):
-                logger.info('No movie or tv titles added or removed')
+            pruned = prune_journal()
+            if pruned:
+                logger.debug(f'pruned {pruned} stale journal entries')
+            # one scan of all the directories, and one pass over the db, for removals, moves and additions
+            if options.get('incremental'):
+                result = process_directories_incrementally(video_directories(), workers, engine)
+            else:
+                result = reconcile_directories(video_directories(), workers, engine)
+            if result.removed:
+                logger.info(f'Removed titles: {result.removed}')
+            if result.moved:
+                logger.info(f'Moved titles: {result.moved}')
+            if result.added:
+                logger.info(f'Added titles: {result.added}')
+            if not result:
+                logger.info('No movie or tv titles added, moved or removed')
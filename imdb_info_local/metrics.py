@@ -0,0 +1,199 @@
+"""Performance metrics for a run_scraper run.
+
+Between start_run() and finish_run() the scraper records:
+
+phases - time spent in each phase, with a latency histogram:
+    scan - listing the video directories
+    search_fetch, title_fetch, image_fetch - getting pages and images, from the cache or IMDb
+    request - each request to IMDb, including retried attempts
+    parse - extracting search results and title page fields
+    image_store - hashing, storing and making thumbnails of downloaded images
+    db_write - saving title data
+counters - requests, retries, request errors, failed requests, response bytes,
+    cache hits and misses, not modified responses, ...
+
+Phase times are summed over titles scraped concurrently, so with several workers
+they add up to more than the run took.
+
+At the end of a run the metrics are logged as a json summary, and can be written
+to a json file and a Prometheus textfile collector file - see write_metrics().
+Outside a run - e.g. the website's update view - nothing is recorded.
+"""
+from bisect import bisect_left
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+import json
+import math
+from pathlib import Path
+import re
+import threading
+import time
+
+from .cache import AtomicFile
+
+# upper bounds of the latency histogram buckets, in seconds
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, math.inf)
+PROMETHEUS_PREFIX = 'imdb_info_local_scraper_last_run'
+# readable by the node exporter
+METRICS_FILE_MODE = 0o644
+
+_metrics = None
+
+
+class Histogram:
+    def __init__(self):
+        self.counts = [0] * len(BUCKETS)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(BUCKETS, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def cumulative(self) -> [(float, int)]:
+        """:return (bucket upper bound, observations <= bound) for each bucket"""
+        total, buckets = 0, []
+        for bound, count in zip(BUCKETS, self.counts):
+            total += count
+            buckets.append((bound, total))
+        return buckets
+
+
+class RunMetrics:
+    """Thread safe counters and phase histograms for one run."""
+    def __init__(self):
+        self.started = time.time()
+        self.finished = None
+        self.counters = Counter()
+        self.phases = defaultdict(Histogram)
+        self.lock = threading.Lock()
+
+    def inc(self, name: str, amount: int = 1):
+        with self.lock:
+            self.counters[name] += amount
+
+    def observe(self, phase: str, seconds: float):
+        with self.lock:
+            self.phases[phase].observe(seconds)
+
+    @property
+    def duration(self) -> float:
+        return (self.finished or time.time()) - self.started
+
+    def summary(self) -> dict:
+        """:return the metrics as a json serializable dict"""
+        with self.lock:
+            return {
+                'started': self.started,
+                'duration_seconds': round(self.duration, 3),
+                'counters': dict(sorted(self.counters.items())),
+                'phases': {
+                    phase: {
+                        'count': histogram.count,
+                        'seconds': round(histogram.sum, 3),
+                        'buckets': {('+Inf' if math.isinf(bound) else str(bound)): count
+                                    for bound, count in histogram.cumulative()},
+                    }
+                    for phase, histogram in sorted(self.phases.items())
+                },
+            }
+
+    def prometheus_text(self) -> str:
+        """:return the metrics in the Prometheus text exposition format, for the textfile collector"""
+        summary = self.summary()
+        lines = [
+            f'# HELP {PROMETHEUS_PREFIX}_timestamp_seconds When the last run_scraper run started.',
+            f'# TYPE {PROMETHEUS_PREFIX}_timestamp_seconds gauge',
+            f'{PROMETHEUS_PREFIX}_timestamp_seconds {summary["started"]}',
+            f'# HELP {PROMETHEUS_PREFIX}_duration_seconds How long the last run_scraper run took.',
+            f'# TYPE {PROMETHEUS_PREFIX}_duration_seconds gauge',
+            f'{PROMETHEUS_PREFIX}_duration_seconds {summary["duration_seconds"]}',
+        ]
+        for name, value in summary['counters'].items():
+            metric = f'{PROMETHEUS_PREFIX}_{prometheus_name(name)}'
+            lines += [f'# TYPE {metric} gauge', f'{metric} {value}']
+        metric = f'{PROMETHEUS_PREFIX}_phase_seconds'
+        lines += [f'# HELP {metric} Time spent in each phase of the last run_scraper run.',
+                  f'# TYPE {metric} histogram']
+        for phase, data in summary['phases'].items():
+            for bound, count in data['buckets'].items():
+                lines.append(f'{metric}_bucket{{phase="{phase}",le="{bound}"}} {count}')
+            lines.append(f'{metric}_sum{{phase="{phase}"}} {data["seconds"]}')
+            lines.append(f'{metric}_count{{phase="{phase}"}} {data["count"]}')
+        return '\n'.join(lines) + '\n'
+
+
+def prometheus_name(name: str) -> str:
+    return re.sub(r'[^a-zA-Z0-9_]', '_', name)
+
+
+def inc(name: str, amount: int = 1):
+    """Adds to a counter of the run in progress, if any."""
+    metrics = _metrics
+    if metrics is not None:
+        metrics.inc(name, amount)
+
+
+def counter(name: str) -> int:
+    """:return the count so far of the run in progress, 0 outside a run"""
+    metrics = _metrics
+    if metrics is None:
+        return 0
+    with metrics.lock:
+        return metrics.counters[name]
+
+
+def running() -> bool:
+    return _metrics is not None
+
+
+def observe(phase: str, seconds: float):
+    """Records the time taken by one operation of a phase of the run in progress, if any."""
+    metrics = _metrics
+    if metrics is not None:
+        metrics.observe(phase, seconds)
+
+
+@contextmanager
+def timed(phase: str):
+    """Times the block as one operation of phase - see observe()."""
+    if _metrics is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(phase, time.perf_counter() - start)
+
+
+def start_run():
+    global _metrics
+    _metrics = RunMetrics()
+
+
+def finish_run() -> RunMetrics:
+    """Ends recording for the run.
+
+    :return the run's metrics, or None if no run was started
+    """
+    global _metrics
+    metrics, _metrics = _metrics, None
+    if metrics:
+        metrics.finished = time.time()
+    return metrics
+
+
+def write_metrics(metrics: RunMetrics, path: Path):
+    """Writes the json summary to path, and the Prometheus textfile to path with a .prom suffix.
+
+    Point the node exporter's textfile collector at the .prom file's directory to
+    trend nightly runs.  Both files are written atomically.
+    """
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with AtomicFile(path, METRICS_FILE_MODE) as f:
+        f.write(json.dumps(metrics.summary(), indent=2).encode())
+    with AtomicFile(path.with_suffix('.prom'), METRICS_FILE_MODE) as f:
+        f.write(metrics.prometheus_text().encode())
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.18 on 2026-10-17 21:57
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('imdb_info_local', '0006_alter_imdbtitlesearchdata_rating'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='imdbtitlesearchdata',
+            name='etag',
+            field=models.CharField(blank=True, max_length=256),
+        ),
+        migrations.AddField(
+            model_name='imdbtitlesearchdata',
+            name='last_modified',
+            field=models.CharField(blank=True, max_length=64),
+        ),
+        migrations.AddField(
+            model_name='imdbtitlesearchdata',
+            name='title_url',
+            field=models.CharField(blank=True, max_length=512),
+        ),
+    ]
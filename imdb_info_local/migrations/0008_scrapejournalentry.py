@@ -0,0 +1,31 @@
+# Generated by Django 5.2.18 on 2026-10-17 22:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('imdb_info_local', '0007_imdbtitlesearchdata_title_url_validators'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ScrapeJournalEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('type', models.CharField(choices=[('TV', 'TV'), ('MO', 'Movie')], max_length=2)),
+                ('title', models.CharField(max_length=512)),
+                ('file_path', models.CharField(max_length=512)),
+                ('file_mtime_ns', models.BigIntegerField()),
+                ('file_ctime_ns', models.BigIntegerField()),
+                ('stage', models.CharField(choices=[('scanned', 'Scanned'), ('searched', 'Searched'), ('fetched', 'Fetched')], default='scanned', max_length=8)),
+                ('data', models.JSONField(default=dict)),
+                ('error', models.TextField(blank=True)),
+            ],
+            options={
+                'ordering': ['pk'],
+                'constraints': [models.UniqueConstraint(fields=('type', 'file_path'), name='unique_journal_title_path')],
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-17 22:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('imdb_info_local', '0008_scrapejournalentry'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='imdbtitlesearchdata',
+            name='last_scraped',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
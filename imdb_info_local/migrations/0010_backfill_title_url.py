@@ -0,0 +1,61 @@
+# Generated by Django 5.2.18 on 2026-10-17 23:03
+
+from pathlib import PurePosixPath
+import re
+
+from django.db import migrations
+
+BATCH_SIZE = 1000
+# find_results is run_scraper.find_results_html - the first link is the top search result,
+# whose url the scraper stores as title_url
+FIRST_HREF = re.compile(r'<a href="([^"]+/title/(tt\d+)[^"]*)"')
+
+
+def top_result_url(find_results: str, image: str, blurb: str) -> str:
+    """:return url of the top search result if the title data provably came from it, otherwise None
+
+    Before title_url was stored, a title could be updated from another search result in the
+    title list, without recording its url.  Those titles must keep a blank title_url, or
+    refresh_ratings would overwrite them from the top result.  Title data is from the top
+    result if its image was named after the result's IMDb id, as images were then, or its
+    blurb is the placeholder naming the result's url.
+    """
+    match = FIRST_HREF.search(find_results)
+    if not match:
+        return None
+    url, title_id = match.groups()
+    stem = PurePosixPath(image).stem if image else ''
+    if stem == title_id or stem.startswith(f'{title_id}_'):
+        return url
+    if f'No blurb for title_url: <a href="{url}">' in blurb:
+        return url
+    return None
+
+
+def backfill_title_url(apps, schema_editor):
+    """Sets title_url of titles scraped before it was added, where they came from their top search result."""
+    IMDBTitleSearchData = apps.get_model('imdb_info_local', 'IMDBTitleSearchData')
+    untitled = (IMDBTitleSearchData.objects.filter(title_url='').only('pk', 'find_results', 'image', 'blurb')
+                .order_by('pk'))
+    last_pk = None
+    # in pk order a batch at a time, as updated rows drop out of the query
+    while batch := list((untitled.filter(pk__gt=last_pk) if last_pk else untitled)[:BATCH_SIZE]):
+        last_pk = batch[-1].pk
+        titles = []
+        for title_data in batch:
+            title_url = top_result_url(title_data.find_results, title_data.image.name, title_data.blurb)
+            if title_url:
+                title_data.title_url = title_url
+                titles.append(title_data)
+        IMDBTitleSearchData.objects.bulk_update(titles, ['title_url'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('imdb_info_local', '0009_imdbtitlesearchdata_last_scraped'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_title_url, migrations.RunPython.noop),
+    ]
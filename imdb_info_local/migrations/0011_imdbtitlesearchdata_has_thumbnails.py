@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-17 23:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('imdb_info_local', '0010_backfill_title_url'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='imdbtitlesearchdata',
+            name='has_thumbnails',
+            field=models.BooleanField(default=False),
+        ),
+    ]
@@ -1,13 +1,21 @@
-from pathlib import Path
+import hashlib
+from pathlib import Path, PurePosixPath
 import os
+import shutil
 
-from django.db import models
-from django.core.files import File
+from django.conf import settings
+from django.db import models, transaction
+
+from .cache import AtomicFile
+from .http_client import Validators
+from .thumbnails import SCALES, FORMATS, thumbnail_path, ensure_thumbnails, remove_thumbnails
 
 # string value with trailing slash
 # add to path of MEDIA_ROOT for directory containing images
 IMAGE_SUBDIRECTORY = 'title-images/'
 
+HASH_CHUNK_SIZE = 64 * 1024
+
 # sentinel for a path when no image is saved locally
 NONEXISTENT_PATH = Path('/this path must not exist')
 
@@ -32,6 +40,13 @@ class IMDBTitleSearchData(models.Model):
         different title.
     file_* - file path and stat on the directory or file containing the tv series
         or movie
+    image - poster image, stored under the hash of its content, so titles with the same
+        image share one file - see store_image
+    title_url - url of the IMDB title page the data was scraped from
+    etag, last_modified - validators from the title page response, used to revalidate
+        the page with a conditional GET instead of downloading and parsing it again
+    last_scraped - when the title page was last fetched or revalidated, None for titles
+        scraped before this was recorded - see refresh.py
     """
     TV = "TV"
     MOVIE = "MO"
@@ -48,6 +63,12 @@ class IMDBTitleSearchData(models.Model):
     file_path = models.CharField(max_length=512)
     file_mtime = models.BigIntegerField()
     file_ctime = models.BigIntegerField()
+    title_url = models.CharField(max_length=512, blank=True)
+    etag = models.CharField(max_length=256, blank=True)
+    last_modified = models.CharField(max_length=64, blank=True)
+    last_scraped = models.DateTimeField(null=True, blank=True)
+    # whether the image's thumbnails were made - see thumbnails.py
+    has_thumbnails = models.BooleanField(default=False)
 
     class Meta:
         ordering = ['title']
@@ -55,32 +76,180 @@ class IMDBTitleSearchData(models.Model):
     def __str__(self):
         return self.title
 
+    def validators(self) -> Validators:
+        return Validators(etag=self.etag, last_modified=self.last_modified)
+
+    def set_validators(self, validators: Validators):
+        self.etag = validators.etag
+        self.last_modified = validators.last_modified
+
+    @property
+    def thumbnails(self) -> dict:
+        """Urls of the image's thumbnails for templates - see thumbnails.py
+
+        The urls follow from the image's name, and has_thumbnails records whether the files
+        were made, so the title lists don't check for thousands of files.
+
+        :return {'src': url of the 1x jpeg, 'jpeg': srcset, 'webp': srcset},
+            or None if there is no image or it has no thumbnails
+        """
+        if not self.image or not self.has_thumbnails:
+            return None
+        image_name = PurePosixPath(self.image.name)
+        urls = {(scale, image_format): self.image.storage.url(str(thumbnail_path(image_name, scale, image_format)))
+                for scale in SCALES for image_format in FORMATS}
+        srcsets = {image_format: ', '.join(f'{urls[scale, image_format]} {scale}x' for scale in SCALES)
+                   for image_format in FORMATS}
+        return {'src': urls[1, 'jpeg'], **srcsets}
+
     def verbose_str(self):
         return (f'{self.title}\nrating: {self.rating:.1f}/10 - type: {self.type}\n{self.blurb}\n' +
                 f'find_results:\n{self.find_results}')
 
 
-def add_image_file(title_data_model: IMDBTitleSearchData, image_path: Path):
+class ScrapeJournalEntry(models.Model):
+    """Checkpoint of a title that run_scraper has found but not saved yet - see journal.py
+
+    type, title, file_* - as in IMDBTitleSearchData, with the directory's times in nanoseconds
+    stage - the last stage completed for the title
+    data - what the completed stages found - find results, then title data
+    error - why the last attempt stopped, e.g. requests to IMDb failing
+    """
+    SCANNED = 'scanned'
+    SEARCHED = 'searched'
+    FETCHED = 'fetched'
+    stage_choices = (
+        (SCANNED, 'Scanned'),
+        (SEARCHED, 'Searched'),
+        (FETCHED, 'Fetched'),
+    )
+    type = models.CharField(max_length=2, choices=IMDBTitleSearchData.title_type_choices)
+    title = models.CharField(max_length=512)
+    file_path = models.CharField(max_length=512)
+    file_mtime_ns = models.BigIntegerField()
+    file_ctime_ns = models.BigIntegerField()
+    stage = models.CharField(max_length=8, choices=stage_choices, default=SCANNED)
+    data = models.JSONField(default=dict)
+    error = models.TextField(blank=True)
+
+    class Meta:
+        constraints = [models.UniqueConstraint(fields=['type', 'file_path'], name='unique_journal_title_path')]
+        ordering = ['pk']
+
+    def __str__(self):
+        return f'{self.title}: {self.stage}'
+
+
+def image_directory() -> Path:
+    return Path(settings.MEDIA_ROOT) / IMAGE_SUBDIRECTORY
+
+
+def hash_file(path: Path) -> str:
+    """:return sha256 hex digest of the file's content"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def store_image(image_path: Path, move: bool = False) -> Path:
+    """Adds an image file to the content addressed image store.
+
+    Images are stored as <sha256 of content><suffix> in the image directory, so an
+    image that is already stored is not written again.
+
+    :param image_path - image file to add
+    :param move - move image_path into the store, e.g. a fresh download in the image
+        directory, rather than copying it.  It is removed if the image is already stored.
+    :return path of the stored image
+    """
+    stored_path = image_directory() / f'{hash_file(image_path)}{image_path.suffix.lower()}'
+    if stored_path.exists():
+        if move:
+            image_path.unlink()
+    elif move:
+        os.replace(image_path, stored_path)
+    else:
+        stored_path.parent.mkdir(parents=True, exist_ok=True)
+        with open(image_path, 'rb') as src, AtomicFile(stored_path, settings.FILE_UPLOAD_PERMISSIONS) as dst:
+            shutil.copyfileobj(src, dst)
+    return stored_path
+
+
+def stored_image_name(image_path: Path) -> str:
+    """:return the storage name for image_path if it is already in the image directory, otherwise None"""
+    if image_path.parent.resolve() == image_directory().resolve():
+        return IMAGE_SUBDIRECTORY + image_path.name
+
+
+def release_images(names: [str]):
+    """Deletes the image files and thumbnails of image names that no title uses any more,
+    e.g. after the titles using them were deleted.
+
+    :param names - image field names, e.g. 'title-images/<sha256>.jpg'
+    """
+    names = {name for name in names if name}
+    if not names:
+        return
+    in_use = set(IMDBTitleSearchData.objects.filter(image__in=names).values_list('image', flat=True))
+    for name in names - in_use:
+        remove_image_file(image_directory() / PurePosixPath(name).name)
+
+
+def remove_image_file(image_path: Path):
+    """Deletes a stored image file and its thumbnails, if they exist."""
+    image_path.unlink(missing_ok=True)
+    remove_thumbnails(image_path)
+
+
+def _set_image_file(title_data_model: IMDBTitleSearchData, image_path: Path, save: bool = True):
+    # images already in the image directory - downloads and older tt-id named images - are
+    # used in place, others are copied into the store
+    name = stored_image_name(image_path) or stored_image_name(store_image(image_path))
+    title_data_model.image.name = name
+    title_data_model.has_thumbnails = ensure_thumbnails(Path(title_data_model.image.path),
+                                                        settings.FILE_UPLOAD_PERMISSIONS)
+    if save:
+        title_data_model.save()
+
+
+def add_image_file(title_data_model: IMDBTitleSearchData, image_path: Path, save: bool = True):
     """Add the image file to the model
 
     :param title_data_model - model to update
-    :param image_path - path to locally saved image file
+    :param image_path - path to image file already in media storage, or a local image file to store there
+    :param save - save the model, otherwise only its image and has_thumbnails fields are set, e.g. for a
+        bulk_create
     """
     if image_path and image_path.is_file():
-        with open(image_path, 'rb') as fp:
-            django_file = File(fp)
-            title_data_model.image.save(str(image_path.name), django_file, save=True)
+        _set_image_file(title_data_model, image_path, save)
 
 
-def update_image_file(title_data_model: IMDBTitleSearchData, image_path: Path):
+def update_image_file(title_data_model: IMDBTitleSearchData, image_path: Path, save: bool = True) -> str:
     """Update the image file for the model
 
+    Nothing is written if the model already has this image.  Otherwise the old image
+    file is deleted unless another title uses it - once the model is saved, so a failed
+    save never leaves the title pointing at a deleted file.
+
     :param title_data_model - model to update
-    :param image_path - path to locally saved image file
+    :param image_path - path to image file already in media storage, or a local image file to store there
+    :param save - save the model, otherwise only its image and has_thumbnails fields are set, e.g. for a
+        bulk_update.  The old image is then left for the caller to pass to release_images() after the
+        model is saved.
+    :return the name of the old image, None if the image wasn't changed
     """
-    if image_path and image_path.is_file():
-        with open(image_path, 'rb') as fp:
-            django_file = File(fp)
-            if title_data_model.image and Path(title_data_model.image.path).exists():
-                os.remove(title_data_model.image.path)
-            title_data_model.image.save(str(image_path.name), django_file, save=True)
+    if not (image_path and image_path.is_file()):
+        return None
+    name = stored_image_name(image_path) or stored_image_name(store_image(image_path))
+    if title_data_model.image.name == name:
+        return None
+    old_name = title_data_model.image.name or None
+    if save:
+        with transaction.atomic():
+            _set_image_file(title_data_model, image_directory() / Path(name).name, save)
+            transaction.on_commit(lambda: release_images([old_name]))
+    else:
+        _set_image_file(title_data_model, image_directory() / Path(name).name, save)
+    return old_name
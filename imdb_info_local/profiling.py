@@ -0,0 +1,169 @@
+"""Profiling hooks for finding hot spots on an install whose code can't be edited.
+
+`run_scraper --profile PATH` profiles a whole run, and ProfilingMiddleware profiles
+single requests to the title lists, search and title update views.
+
+Two profilers:
+cprofile - the standard library's deterministic profiler, written as a .prof file for
+    pstats or snakeviz.  Worker threads are profiled too and merged into one profile.
+sampling - pyinstrument, if it is installed, written as a speedscope file to open at
+    https://www.speedscope.app.  It has far less overhead, but only samples the thread
+    it was started in, so it suits the views.  Both scraper engines work in other threads -
+    the async engine runs its event loop in a background thread - so a run is profiled
+    with cprofile.
+
+Settings (all optional):
+IMDB_INFO_LOCAL_PROFILE_VIEWS - True to let ProfilingMiddleware profile requests with ?profile
+IMDB_INFO_LOCAL_PROFILE_DIR - where ProfilingMiddleware writes profiles
+IMDB_INFO_LOCAL_PROFILER - profiler for the views, default sampling if installed
+"""
+import cProfile
+import logging
+from pathlib import Path
+import pstats
+import sys
+import threading
+import time
+
+from django.conf import settings
+
+try:
+    from pyinstrument import Profiler as SamplingProfiler
+    from pyinstrument.renderers import SpeedscopeRenderer
+except ImportError:
+    SamplingProfiler = None
+
+logger = logging.getLogger(__name__)
+
+CPROFILE = 'cprofile'
+SAMPLING = 'sampling'
+PROFILERS = (CPROFILE, SAMPLING)
+SUFFIXES = {CPROFILE: '.prof', SAMPLING: '.speedscope.json'}
+
+PROFILE_PARAM = 'profile'
+PROFILE_HEADER = 'X-Profile-File'
+DEFAULT_PROFILE_DIR = 'profiles'
+# url names of the views ProfilingMiddleware profiles
+PROFILED_VIEWS = ('movie_list', 'movie_mtime', 'movie_ratings', 'tv_list', 'tv_mtime', 'tv_ratings',
+                  'search_results', 'title_update')
+
+
+def default_profiler(threads: bool = False) -> str:
+    """:param threads - True if the work to profile runs in other threads
+    :return the sampling profiler if it is installed and can see the work, otherwise cprofile"""
+    return SAMPLING if SamplingProfiler is not None and not threads else CPROFILE
+
+
+def profile_path(path: Path, profiler: str) -> Path:
+    """:return path, with the profiler's file suffix if it has none"""
+    path = Path(path)
+    return path if path.suffix else path.with_name(path.name + SUFFIXES[profiler])
+
+
+class Profile:
+    """A profiler that can be started, stopped, and written to a file."""
+    def __init__(self, profiler: str = None, threads: bool = False):
+        """:param profiler - CPROFILE or SAMPLING, default - see default_profiler()
+        :param threads - True to also profile threads started while profiling, with cprofile
+        """
+        self.profiler = profiler or default_profiler(threads)
+        if self.profiler not in PROFILERS:
+            raise ValueError(f'Unknown profiler: {self.profiler}')
+        if self.profiler == SAMPLING and SamplingProfiler is None:
+            raise ImportError('pyinstrument must be installed to use the sampling profiler')
+        if self.profiler == SAMPLING and threads:
+            logger.warning('The sampling profiler only sees the thread it is started in, not the threads doing '
+                           'the work - use cprofile')
+        self.threads = threads
+        self.thread_profiles = []
+        self.lock = threading.Lock()
+        if self.profiler == SAMPLING:
+            self.profile = SamplingProfiler(async_mode='enabled')
+        else:
+            self.profile = cProfile.Profile()
+
+    def _profile_thread(self, *args):
+        """threading.setprofile() hook - replaces itself with a cProfile of the new thread"""
+        sys.setprofile(None)
+        profile = cProfile.Profile()
+        with self.lock:
+            self.thread_profiles.append(profile)
+        profile.enable()
+
+    def start(self):
+        if self.profiler == SAMPLING:
+            self.profile.start()
+            return
+        # from python 3.12 cProfile sees every thread, before that only the one it's enabled in
+        if self.threads and sys.version_info < (3, 12):
+            threading.setprofile(self._profile_thread)
+        self.profile.enable()
+
+    def stop(self):
+        if self.profiler == SAMPLING:
+            self.profile.stop()
+            return
+        self.profile.disable()
+        if self.threads and sys.version_info < (3, 12):
+            threading.setprofile(None)
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    def write(self, path: Path) -> Path:
+        """Writes the profile, adding the profiler's file suffix to path if it has none.
+
+        :return path written to
+        """
+        path = profile_path(path, self.profiler)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        if self.profiler == SAMPLING:
+            path.write_text(self.profile.output(SpeedscopeRenderer()))
+            return path
+        stats = pstats.Stats(self.profile)
+        for profile in self.thread_profiles:
+            stats.add(profile)
+        stats.dump_stats(path)
+        return path
+
+
+def profile_dir() -> Path:
+    return Path(getattr(settings, 'IMDB_INFO_LOCAL_PROFILE_DIR', None) or DEFAULT_PROFILE_DIR)
+
+
+class ProfilingMiddleware:
+    """Profiles requests to the views in PROFILED_VIEWS that have a `profile` query parameter.
+
+    Off unless IMDB_INFO_LOCAL_PROFILE_VIEWS is True.  The view, and rendering its
+    template, are profiled and written to IMDB_INFO_LOCAL_PROFILE_DIR; the file name is
+    returned in the X-Profile-File response header.  `?profile=cprofile` or
+    `?profile=sampling` picks the profiler.
+    """
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        return self.get_response(request)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        if not getattr(settings, 'IMDB_INFO_LOCAL_PROFILE_VIEWS', False) or PROFILE_PARAM not in request.GET:
+            return None
+        url_name = request.resolver_match.url_name if request.resolver_match else None
+        if url_name not in PROFILED_VIEWS:
+            return None
+        profiler = request.GET[PROFILE_PARAM]
+        if profiler not in PROFILERS:
+            profiler = getattr(settings, 'IMDB_INFO_LOCAL_PROFILER', None)
+        profile = Profile(profiler)
+        with profile:
+            response = view_func(request, *view_args, **view_kwargs)
+            if hasattr(response, 'render') and not response.is_rendered:
+                response.render()
+        path = profile.write(profile_dir() / f'{url_name}-{time.strftime("%Y%m%d-%H%M%S")}-{id(request):x}')
+        logger.info(f'profiled {request.get_full_path()} to {path}')
+        response[PROFILE_HEADER] = path.name
+        return response
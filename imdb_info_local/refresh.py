@@ -0,0 +1,188 @@
+"""Refreshing the ratings of titles already scraped, stalest first, within a budget.
+
+Ratings change after a title is scraped, most of all for recent releases.  Rather than
+re-scraping everything, each `refresh_ratings` run re-fetches the title pages of the
+titles most in need of it, until it has made a number of requests to IMDb or run for a
+while, so that run nightly it keeps a large catalog fresh a slice at a time.
+
+Titles are ordered by staleness - days since they were last scraped, weighted up for
+titles whose directories were added recently (file_mtime), as those are most likely new
+releases whose ratings are still moving:
+
+    staleness = age in days * (1 + RECENT_BOOST * 0.5 ** (days since file_mtime / RECENT_HALF_LIFE_DAYS))
+
+Titles scraped before last_scraped was recorded count as UNSCRAPED_AGE_DAYS old.  Titles
+scraped within min_age_days are left alone.
+
+Title pages are revalidated with a conditional GET using the validators stored with the
+title, so an unchanged page costs a 304 response and nothing is parsed or downloaded.
+Every request counts against the budget, including retries - they are counted by the
+run's metrics, see metrics.py.
+"""
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from dataclasses import dataclass
+from datetime import timedelta
+import heapq
+import logging
+import time
+
+from django.db import transaction
+from django.utils import timezone
+
+from . import metrics
+from .cache import CacheMiss
+from .http_policy import RetriesExhausted
+from .imdb import imdb_title_data
+from .models import IMDBTitleSearchData, update_image_file, release_images
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_REQUESTS = 200
+# seconds
+DEFAULT_MAX_TIME = 600
+DEFAULT_MIN_AGE_DAYS = 7
+DEFAULT_WORKERS = 4
+# titles whose directories were just added are this many times more stale, on top of their age
+RECENT_BOOST = 3
+RECENT_HALF_LIFE_DAYS = 90
+UNSCRAPED_AGE_DAYS = 365
+SAVE_BATCH_SIZE = 100
+REFRESHED_FIELDS = ['rating', 'blurb', 'image', 'has_thumbnails', 'etag', 'last_modified', 'last_scraped']
+DAY = 24 * 60 * 60
+
+# reasons a refresh stopped
+DONE = 'done'
+REQUEST_BUDGET = 'request budget'
+TIME_BUDGET = 'time budget'
+
+
+@dataclass
+class RefreshResult:
+    # titles whose pages had changed, and were updated
+    refreshed: int = 0
+    # titles whose pages had not changed
+    not_modified: int = 0
+    # titles skipped after failed requests, or in cache-only mode because their pages weren't cached
+    failed: int = 0
+    requests: int = 0
+    stopped: str = DONE
+
+
+def staleness(last_scraped: float, file_mtime: int, now: float) -> float:
+    """:param last_scraped - timestamp, None if not recorded
+    :param file_mtime, now - timestamps
+    :return how much the title needs refreshing - see the module docstring
+    """
+    age_days = (now - last_scraped) / DAY if last_scraped is not None else UNSCRAPED_AGE_DAYS
+    added_days = max(now - file_mtime, 0) / DAY
+    return age_days * (1 + RECENT_BOOST * 0.5 ** (added_days / RECENT_HALF_LIFE_DAYS))
+
+
+def stalest_titles(limit: int, min_age_days: float = DEFAULT_MIN_AGE_DAYS) -> [int]:
+    """:return pks of the limit stalest titles that have a title url and weren't scraped in the last
+        min_age_days, stalest first"""
+    now = timezone.now()
+    candidates = (IMDBTitleSearchData.objects.exclude(title_url='')
+                  .exclude(last_scraped__gte=now - timedelta(days=min_age_days))
+                  .values_list('pk', 'last_scraped', 'file_mtime'))
+    now = now.timestamp()
+    stalest = heapq.nlargest(limit, candidates.iterator(),
+                             key=lambda row: staleness(row[1].timestamp() if row[1] else None, row[2], now))
+    return [pk for pk, _, _ in stalest]
+
+
+def refresh_title(title_data: IMDBTitleSearchData):
+    """Fetches the title page if it changed - run in a worker.
+
+    :return IMDBTitleData, or None if the page is not modified
+    """
+    return imdb_title_data(title_data.title_url, title_data.validators())
+
+
+def save_refreshed(titles: [IMDBTitleSearchData], old_images: [str]):
+    """:param old_images - names of the images the titles no longer use, deleted once the titles are saved
+        unless other titles use them
+    """
+    with metrics.timed('db_write'), transaction.atomic():
+        IMDBTitleSearchData.objects.bulk_update(titles, REFRESHED_FIELDS)
+    release_images(old_images)
+    titles.clear()
+    old_images.clear()
+
+
+def refresh_ratings(max_requests: int = DEFAULT_MAX_REQUESTS, max_time: float = DEFAULT_MAX_TIME,
+                    min_age_days: float = DEFAULT_MIN_AGE_DAYS, workers: int = DEFAULT_WORKERS) -> RefreshResult:
+    """Refreshes the stalest titles until there are none left or a budget is spent.
+
+    Each title needs at least one request, so at most max_requests titles are refreshed.
+    No title is started once the budget is spent, though the workers finish those in flight,
+    so a run can go over by up to `workers` titles' requests.
+
+    :param max_requests - requests to IMDb, including retries and image downloads
+    :param max_time - seconds
+    :return RefreshResult
+    """
+    started = time.monotonic()
+    own_run = not metrics.running()
+    if own_run:
+        metrics.start_run()
+    requests_before = metrics.counter('requests')
+    result = RefreshResult()
+    pks = stalest_titles(max_requests, min_age_days)
+    titles = IMDBTitleSearchData.objects.in_bulk(pks)
+    queue = deque(titles[pk] for pk in pks if pk in titles)
+    logger.info(f'Refreshing up to {len(queue)} titles, stalest first')
+    refreshed, old_images = [], []
+    executor = ThreadPoolExecutor(max_workers=max(workers, 1))
+    try:
+        in_flight = {}
+        while queue or in_flight:
+            requests_made = metrics.counter('requests') - requests_before
+            while queue and len(in_flight) < max(workers, 1):
+                # each title in flight will make at least one more request
+                if requests_made + len(in_flight) >= max_requests:
+                    result.stopped = REQUEST_BUDGET
+                elif time.monotonic() - started >= max_time:
+                    result.stopped = TIME_BUDGET
+                if result.stopped != DONE:
+                    queue.clear()
+                    break
+                title_data = queue.popleft()
+                in_flight[executor.submit(refresh_title, title_data)] = title_data
+            if not in_flight:
+                break
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                title_data = in_flight.pop(future)
+                try:
+                    new_title_data = future.result()
+                except RetriesExhausted as e:
+                    logger.warning(f'Skipping title, requests to IMDb failed: {title_data.title}: {e.reason}')
+                    result.failed += 1
+                    continue
+                except CacheMiss as e:
+                    logger.warning(f'Skipping title, not in the response cache: {title_data.title}: {e}')
+                    result.failed += 1
+                    continue
+                title_data.last_scraped = timezone.now()
+                if new_title_data:
+                    if new_title_data.rating != title_data.rating:
+                        logger.info(f'{title_data.title}: rating {title_data.rating} -> {new_title_data.rating}')
+                    title_data.rating = new_title_data.rating
+                    title_data.blurb = new_title_data.blurb
+                    title_data.set_validators(new_title_data.validators)
+                    old_images.append(update_image_file(title_data, new_title_data.image_file, save=False))
+                    result.refreshed += 1
+                else:
+                    result.not_modified += 1
+                refreshed.append(title_data)
+                if len(refreshed) >= SAVE_BATCH_SIZE:
+                    save_refreshed(refreshed, old_images)
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
+        save_refreshed(refreshed, old_images)
+        result.requests = metrics.counter('requests') - requests_before
+        if own_run:
+            metrics.finish_run()
+    return result
@@ -0,0 +1,216 @@
+"""Scanning of the video directories.
+
+Each root - a directory of titles of one type - is listed with os.scandir, using the
+stat of each DirEntry, into a RootScan: the root's mtime and a TitleDirectory (name,
+resolved path, mtime and ctime) for each title directory.  The scan is done once per
+run and shared by title removal and addition.
+
+Roots are often on different external drives, so scan_roots() scans the roots on
+each device (st_dev) in its own thread - slow disks are scanned concurrently, while
+the roots on one disk are scanned one after another so its head isn't thrashed.
+
+Incremental scans
+-----------------
+For run_scraper --incremental a manifest is kept for each root, recording the root's
+mtime and the mtime of each of its title directories at the last scan.
+
+Adding, removing or renaming a title directory changes its root's mtime, so a root
+whose mtime is unchanged is skipped without listing it - a run where nothing has
+changed costs one stat() per root.  When a root has changed it is listed, and only
+the title directories that are new, gone or have a new mtime are handled.
+
+Manifests are json files in IMDB_INFO_LOCAL_MANIFEST_DIR, written atomically.
+A root without a manifest is scanned in full.
+"""
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field, asdict
+import hashlib
+import json
+import logging
+import os
+from pathlib import Path
+from stat import S_ISDIR
+from typing import NamedTuple
+
+from django.conf import settings
+
+from .cache import AtomicFile
+
+logger = logging.getLogger(__name__)
+
+
+class TitleDirectory(NamedTuple):
+    name: str
+    # resolved path, as stored in IMDBTitleSearchData.file_path
+    path: str
+    mtime_ns: int
+    ctime_ns: int
+
+    @property
+    def mtime(self) -> int:
+        return self.mtime_ns // 1_000_000_000
+
+    @property
+    def ctime(self) -> int:
+        return self.ctime_ns // 1_000_000_000
+
+
+@dataclass
+class RootScan:
+    root: Path
+    title_type: str
+    # False if root isn't a directory, e.g. its drive isn't mounted
+    available: bool = False
+    mtime_ns: int = None
+    # title directories in listing order, None if root was not listed because it is unchanged
+    entries: [TitleDirectory] = None
+
+    @property
+    def paths(self) -> set:
+        return {entry.path for entry in self.entries}
+
+
+@dataclass
+class RootManifest:
+    root: str
+    title_type: str
+    # None if the root has not been fully scanned
+    mtime_ns: int = None
+    # title directory name -> mtime_ns
+    children: dict = field(default_factory=dict)
+
+
+@dataclass
+class RootDiff:
+    """Changes to a root's title directories since its manifest was saved."""
+    scan: RootScan
+    added: [TitleDirectory] = field(default_factory=list)
+    # names of the title directories removed
+    removed: [str] = field(default_factory=list)
+    # title directories whose contents changed, e.g. episodes added
+    changed: [TitleDirectory] = field(default_factory=list)
+
+
+def manifest_directory() -> Path:
+    return Path(getattr(settings, 'IMDB_INFO_LOCAL_MANIFEST_DIR', Path(settings.BASE_DIR) / 'manifests'))
+
+
+def manifest_path(root: Path, title_type: str) -> Path:
+    key = hashlib.sha1(f'{title_type}:{root.resolve()}'.encode()).hexdigest()
+    return manifest_directory() / f'{key}.json'
+
+
+def load_manifest(root: Path, title_type: str) -> RootManifest:
+    """:return the manifest saved for root, or None if there isn't one"""
+    path = manifest_path(root, title_type)
+    try:
+        return RootManifest(**json.loads(path.read_bytes()))
+    except FileNotFoundError:
+        return None
+    except (ValueError, TypeError) as e:
+        logger.warning(f'ignoring bad scan manifest {path}: {e}')
+        return None
+
+
+def save_manifest(manifest: RootManifest):
+    path = manifest_path(Path(manifest.root), manifest.title_type)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with AtomicFile(path) as f:
+        f.write(json.dumps(asdict(manifest)).encode())
+
+
+def clear_manifests():
+    """Deletes all manifests, so the next incremental scan of each root is a full scan."""
+    for path in manifest_directory().glob('*.json'):
+        path.unlink(missing_ok=True)
+
+
+def title_directories(root: Path) -> [TitleDirectory]:
+    """:return the title directories in root, in listing order"""
+    resolved_root = root.resolve()
+    title_dirs = []
+    with os.scandir(root) as entries:
+        for entry in entries:
+            if not entry.is_dir():
+                continue
+            # is_dir() follows symlinks - resolve those the long way
+            path = os.path.realpath(entry.path) if entry.is_symlink() else str(resolved_root / entry.name)
+            stat = entry.stat()
+            title_dirs.append(TitleDirectory(entry.name, path, stat.st_mtime_ns, stat.st_ctime_ns))
+    return title_dirs
+
+
+def _root_stat(root: Path) -> os.stat_result:
+    try:
+        stat = root.stat()
+    except OSError:
+        return None
+    return stat if S_ISDIR(stat.st_mode) else None
+
+
+def scan_root(root: Path, title_type: str, manifest: RootManifest = None, stat: os.stat_result = None) -> RootScan:
+    """Scans the title directories in root.
+
+    :param manifest - if given, root is not listed if its mtime is the same as in the manifest
+    :param stat - root's stat, if already known
+    """
+    # stat before listing, so a change made during the listing is picked up next time
+    stat = stat or _root_stat(root)
+    if not stat:
+        return RootScan(root, title_type)
+    scan = RootScan(root, title_type, available=True, mtime_ns=stat.st_mtime_ns)
+    if not (manifest and manifest.mtime_ns == stat.st_mtime_ns):
+        scan.entries = title_directories(root)
+    return scan
+
+
+def scan_roots(roots: [(Path, str)], manifests: dict = None) -> [RootScan]:
+    """Scans roots, with one thread per device.
+
+    :param roots - (root, title type) pairs
+    :param manifests - (root, title type) -> RootManifest, for roots that are only listed if they changed
+    :return RootScan for each root, in the order of roots
+    """
+    manifests = manifests or {}
+    if not roots:
+        return []
+    # stat concurrently too - each stat may wait for a drive to spin up
+    with ThreadPoolExecutor(max_workers=len(roots)) as executor:
+        stats = list(executor.map(_root_stat, [root for root, _ in roots]))
+    scans = [None] * len(roots)
+    by_device = defaultdict(list)
+    for i, ((root, title_type), stat) in enumerate(zip(roots, stats)):
+        if stat:
+            by_device[stat.st_dev].append(i)
+        else:
+            scans[i] = RootScan(root, title_type)
+
+    def scan_device(indexes: [int]):
+        for i in indexes:
+            root, title_type = roots[i]
+            scans[i] = scan_root(root, title_type, manifests.get((root, title_type)), stats[i])
+
+    if by_device:
+        with ThreadPoolExecutor(max_workers=len(by_device), thread_name_prefix='scan') as executor:
+            # result() re-raises errors from the workers
+            for future in [executor.submit(scan_device, indexes) for indexes in by_device.values()]:
+                future.result()
+    return scans
+
+
+def diff_scan(scan: RootScan, manifest: RootManifest) -> RootDiff:
+    """Compares a scan with the root's manifest.
+
+    :return RootDiff, or None if the root was not listed because it is unchanged
+    """
+    if scan.entries is None:
+        return None
+    names = {entry.name for entry in scan.entries}
+    return RootDiff(
+        scan=scan,
+        added=[entry for entry in scan.entries if entry.name not in manifest.children],
+        removed=sorted(name for name in manifest.children if name not in names),
+        changed=[entry for entry in scan.entries
+                 if entry.name in manifest.children and manifest.children[entry.name] != entry.mtime_ns],
+    )
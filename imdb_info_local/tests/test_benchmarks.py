@@ -0,0 +1,59 @@
+import json
+from io import StringIO
+from pathlib import Path
+import shutil
+import tempfile
+
+from django.core.management import call_command
+from django.test import SimpleTestCase, TestCase
+
+from imdb_info_local.benchmarks import library, parsing
+from imdb_info_local.benchmarks.results import compare
+from imdb_info_local.models import IMDBTitleSearchData
+
+
+class LibraryBenchmarkTests(TestCase):
+
+    def test_scanning(self):
+        results = library.run_scanning([20], workers=2)
+        self.assertEqual([(row['benchmark'], row['added']) for row in results],
+                         [('scanning.process_directory.new', 20), ('scanning.process_directory.unchanged', 0)])
+        self.assertFalse(IMDBTitleSearchData.objects.exists())
+
+    def test_persistence(self):
+        results = library.run_persistence([20])
+        self.assertEqual((results[0]['benchmark'], results[0]['removed']), ('persistence.reconcile_directories', 2))
+        self.assertFalse(IMDBTitleSearchData.objects.exists())
+
+    def test_rendering(self):
+        results = library.run_rendering([30], repeat=1)
+        self.assertEqual((results[0]['benchmark'], results[0]['titles']), ('rendering.TitleListView', 30))
+        self.assertFalse(IMDBTitleSearchData.objects.exists())
+
+    def test_run_benchmarks_json_out_and_compare(self):
+        temp_dir = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, temp_dir)
+        results_path = temp_dir / 'results.json'
+        call_command('run_benchmarks', '-s', 'parsing', '-s', 'persistence', '-r', '1', '-t', '10',
+                     '--json-out', str(results_path), stdout=StringIO())
+        results = json.loads(results_path.read_text())
+        self.assertEqual(sorted(results['results']), ['parsing', 'persistence'])
+        self.assertEqual(len(results['results']['parsing']),
+                         len(parsing.SEARCH_PAGES) * len(parsing.SEARCH_EXTRACTORS) + 1)
+        self.assertIn('python', results['run'])
+
+        out = StringIO()
+        call_command('run_benchmarks', '-s', 'persistence', '-t', '10', '--compare', str(results_path), stdout=out)
+        self.assertIn('change', out.getvalue())
+
+
+class CompareTests(SimpleTestCase):
+
+    def test_compare(self):
+        baseline = [{'benchmark': 'rendering.TitleListView', 'titles': 10000, 'median_ms': 200.0},
+                    {'benchmark': 'scanning.process_directory.new', 'titles': 1000, 'seconds': 2.0}]
+        rows = [{'benchmark': 'rendering.TitleListView', 'titles': 10000, 'median_ms': 250.0},
+                {'benchmark': 'scanning.process_directory.new', 'titles': 10000, 'seconds': 20.0}]
+        compared = compare(rows, baseline)
+        self.assertEqual((compared[0]['baseline'], compared[0]['change']), (200.0, '+25.0%'))
+        self.assertNotIn('change', compared[1])
@@ -0,0 +1,276 @@
+import asyncio
+import os
+import tempfile
+import time
+from pathlib import Path
+from shutil import rmtree
+from unittest.mock import patch, Mock, MagicMock, AsyncMock
+
+from django.test import SimpleTestCase
+
+from imdb_info_local.cache import (ResponseCache, CacheMiss, get_cache, set_cache_mode,
+                                   NORMAL, CACHE_ONLY, NO_CACHE)
+from imdb_info_local.http_client import (fetch, fetch_content, fetch_streaming, fetch_to_file, Validators,
+                                         STREAM_CHUNK_SIZE)
+from imdb_info_local.extractors import StreamingTitlePageParser
+from imdb_info_local.imdb_async import AsyncHTTPClient
+
+TITLE_URL = 'https://www.imdb.com/title/tt1486217/'
+SEARCH_URL = 'https://www.imdb.com/find?q=Archer'
+
+
+class ResponseCacheTests(SimpleTestCase):
+
+    def setUp(self):
+        self.cache_dir = Path(tempfile.mkdtemp())
+        self.cache = ResponseCache(self.cache_dir, ttl={'search': 60, 'title': 3600}, max_bytes=1000)
+
+    def tearDown(self):
+        rmtree(self.cache_dir)
+
+    def test_get_and_set(self):
+        self.assertIsNone(self.cache.get(TITLE_URL))
+        self.cache.set(TITLE_URL, 'title', b'<html>archer</html>', {'ETag': '"abc"'})
+        entry = self.cache.get(TITLE_URL)
+        self.assertEqual(entry.content, b'<html>archer</html>')
+        self.assertEqual(entry.kind, 'title')
+        self.assertEqual(entry.headers, {'ETag': '"abc"'})
+        self.assertTrue(self.cache.is_fresh(entry))
+
+    def test_ttl_per_kind(self):
+        self.cache.set(SEARCH_URL, 'search', b'search')
+        self.cache.set(TITLE_URL, 'title', b'title')
+        with patch('imdb_info_local.cache.time.time', return_value=time.time() + 120):
+            self.assertFalse(self.cache.is_fresh(self.cache.get(SEARCH_URL)))
+            self.assertTrue(self.cache.is_fresh(self.cache.get(TITLE_URL)))
+
+    def test_least_recently_used_entries_evicted(self):
+        urls = [f'https://www.imdb.com/title/tt{i}/' for i in range(4)]
+        for i, url in enumerate(urls[:3]):
+            self.cache.set(url, 'title', b'x' * 300)
+            body_path, _ = self.cache._paths(url)
+            os.utime(body_path, (i, i))
+        # use the oldest, so the second oldest is evicted instead
+        self.cache.get(urls[0])
+        self.cache.set(urls[3], 'title', b'x' * 300)
+        self.assertIsNotNone(self.cache.get(urls[0]))
+        self.assertIsNone(self.cache.get(urls[1]))
+        self.assertIsNotNone(self.cache.get(urls[3]))
+        self.assertLessEqual(self.cache._total_size(), 1000)
+
+
+class FetchContentCacheTests(SimpleTestCase):
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        set_cache_mode(NORMAL)
+        rmtree(self.cache_dir)
+
+    @patch('imdb_info_local.http_client.http_get')
+    def test_second_fetch_served_from_cache(self, http_get_mock):
+        http_get_mock.return_value = Mock(status_code=200, content=b'<html></html>', headers={})
+        with self.settings(IMDB_INFO_LOCAL_CACHE_DIR=self.cache_dir):
+            self.assertEqual(fetch_content(TITLE_URL, 'title'), b'<html></html>')
+            self.assertEqual(fetch_content(TITLE_URL, 'title'), b'<html></html>')
+        self.assertEqual(http_get_mock.call_count, 1)
+
+    @patch('imdb_info_local.http_client.http_get')
+    def test_error_responses_not_cached(self, http_get_mock):
+        http_get_mock.return_value = Mock(status_code=503, content=b'busy', headers={})
+        with self.settings(IMDB_INFO_LOCAL_CACHE_DIR=self.cache_dir):
+            fetch_content(TITLE_URL, 'title')
+            self.assertIsNone(get_cache().get(TITLE_URL))
+
+    @patch('imdb_info_local.http_client.http_get')
+    def test_no_cache_mode(self, http_get_mock):
+        http_get_mock.return_value = Mock(status_code=200, content=b'<html></html>', headers={})
+        set_cache_mode(NO_CACHE)
+        with self.settings(IMDB_INFO_LOCAL_CACHE_DIR=self.cache_dir):
+            fetch_content(TITLE_URL, 'title')
+            fetch_content(TITLE_URL, 'title')
+        self.assertEqual(http_get_mock.call_count, 2)
+        self.assertSequenceEqual(os.listdir(self.cache_dir), [])
+
+    @patch('imdb_info_local.http_client.http_get')
+    def test_cache_only_mode_serves_stale_and_never_fetches(self, http_get_mock):
+        with self.settings(IMDB_INFO_LOCAL_CACHE_DIR=self.cache_dir, IMDB_INFO_LOCAL_CACHE_TTL={'title': 0}):
+            get_cache().set(TITLE_URL, 'title', b'stale')
+            set_cache_mode(CACHE_ONLY)
+            self.assertEqual(fetch_content(TITLE_URL, 'title'), b'stale')
+            with self.assertRaises(CacheMiss):
+                fetch_content(SEARCH_URL, 'search')
+        self.assertFalse(http_get_mock.called)
+
+
+class ConditionalFetchTests(SimpleTestCase):
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.validators = Validators(etag='"v1"', last_modified='Mon, 17 Oct 2022 10:00:00 GMT')
+
+    def tearDown(self):
+        rmtree(self.cache_dir)
+
+    @patch('imdb_info_local.http_client.http_get')
+    def test_stale_entry_revalidated_with_stored_validators(self, http_get_mock):
+        http_get_mock.return_value = Mock(status_code=304, content=b'', headers={})
+        with self.settings(IMDB_INFO_LOCAL_CACHE_DIR=self.cache_dir, IMDB_INFO_LOCAL_CACHE_TTL={'title': 0}):
+            get_cache().set(TITLE_URL, 'title', b'cached page', {'ETag': '"v1"'})
+            result = fetch(TITLE_URL, 'title')
+        http_get_mock.assert_called_once_with(TITLE_URL, headers={'If-None-Match': '"v1"'})
+        self.assertEqual(result.content, b'cached page')
+        self.assertFalse(result.not_modified)
+
+    @patch('imdb_info_local.http_client.http_get')
+    def test_caller_validators_not_modified(self, http_get_mock):
+        http_get_mock.return_value = Mock(status_code=304, content=b'', headers={})
+        with self.settings(IMDB_INFO_LOCAL_CACHE_DIR=None):
+            result = fetch(TITLE_URL, 'title', validators=self.validators)
+        http_get_mock.assert_called_once_with(TITLE_URL, headers={
+            'If-None-Match': '"v1"', 'If-Modified-Since': 'Mon, 17 Oct 2022 10:00:00 GMT'})
+        self.assertTrue(result.not_modified)
+        self.assertIsNone(result.content)
+
+    @patch('imdb_info_local.http_client.http_get')
+    def test_caller_validators_modified(self, http_get_mock):
+        http_get_mock.return_value = Mock(status_code=200, content=b'new page', headers={'ETag': '"v2"'})
+        with self.settings(IMDB_INFO_LOCAL_CACHE_DIR=None):
+            result = fetch(TITLE_URL, 'title', validators=self.validators)
+        self.assertFalse(result.not_modified)
+        self.assertEqual(result.content, b'new page')
+        self.assertEqual(result.validators, Validators(etag='"v2"'))
+
+    def test_async_caller_validators_not_modified(self):
+        response = MagicMock(status=304, headers={})
+        response.read = AsyncMock(return_value=b'')
+        response.__aenter__.return_value = response
+        client = AsyncHTTPClient()
+        client.semaphore = asyncio.Semaphore(1)
+        with self.settings(IMDB_INFO_LOCAL_CACHE_DIR=None), \
+                patch.object(client, '_get', AsyncMock(return_value=response)) as get_mock:
+            result = asyncio.run(client.fetch(TITLE_URL, 'title', StreamingTitlePageParser(), self.validators))
+        get_mock.assert_called_once_with(TITLE_URL, {
+            'If-None-Match': '"v1"', 'If-Modified-Since': 'Mon, 17 Oct 2022 10:00:00 GMT'})
+        self.assertTrue(result.not_modified)
+        self.assertIsNone(result.content)
+
+    def test_fresh_entry_with_same_validators_not_modified(self):
+        with self.settings(IMDB_INFO_LOCAL_CACHE_DIR=self.cache_dir):
+            get_cache().set(TITLE_URL, 'title', b'cached page',
+                            {'ETag': '"v1"', 'Last-Modified': 'Mon, 17 Oct 2022 10:00:00 GMT'})
+            self.assertTrue(fetch(TITLE_URL, 'title', validators=self.validators).not_modified)
+
+
+class StreamingFetchTests(SimpleTestCase):
+    """Title pages streamed to the incremental parser."""
+
+    archer_page = (Path(__file__).parent / 'data' / 'archer-title-page.html').read_bytes()
+
+    def setUp(self):
+        self.cache_dir = Path(tempfile.mkdtemp())
+
+    def tearDown(self):
+        rmtree(self.cache_dir)
+
+    def streamed_response(self, content: bytes) -> MagicMock:
+        response = MagicMock(status_code=200, headers={'ETag': '"v1"'})
+        response.__enter__.return_value = response
+        self.chunks_read = 0
+
+        def iter_content(chunk_size):
+            for start in range(0, len(content), chunk_size):
+                self.chunks_read += 1
+                yield content[start:start + chunk_size]
+        response.iter_content.side_effect = iter_content
+        return response
+
+    @patch('imdb_info_local.http_client.http_get')
+    def test_stops_reading_when_fields_found(self, http_get_mock):
+        http_get_mock.return_value = self.streamed_response(self.archer_page)
+        parser = StreamingTitlePageParser()
+        with self.settings(IMDB_INFO_LOCAL_CACHE_DIR=self.cache_dir):
+            result = fetch_streaming(TITLE_URL, 'title', parser)
+            self.assertIsNone(get_cache().get(TITLE_URL))
+        self.assertEqual(self.chunks_read, 1)
+        self.assertIsNone(result.content)
+        self.assertEqual(result.validators, Validators(etag='"v1"'))
+        self.assertEqual(parser.close().rating, 8.7)
+        self.assertEqual(http_get_mock.call_args.kwargs['stream'], True)
+
+    @patch('imdb_info_local.http_client.http_get')
+    def test_page_without_fields_read_to_end_and_cached(self, http_get_mock):
+        page = b'<html><body>' + b'<p>no fields</p>' * 2000 + b'</body></html>'
+        http_get_mock.return_value = self.streamed_response(page)
+        parser = StreamingTitlePageParser()
+        with self.settings(IMDB_INFO_LOCAL_CACHE_DIR=self.cache_dir):
+            result = fetch_streaming(TITLE_URL, 'title', parser)
+            self.assertEqual(get_cache().get(TITLE_URL).content, page)
+        self.assertEqual(result.content, page)
+        self.assertFalse(parser.close())
+
+    @patch('imdb_info_local.http_client.http_get')
+    def test_byte_cap(self, http_get_mock):
+        page = b'<html><body>' + b'<p>no fields</p>' * 20000 + b'</body></html>'
+        http_get_mock.return_value = self.streamed_response(page)
+        with self.settings(IMDB_INFO_LOCAL_CACHE_DIR=None, IMDB_INFO_LOCAL_STREAM_MAX_BYTES=STREAM_CHUNK_SIZE * 2):
+            result = fetch_streaming(TITLE_URL, 'title', StreamingTitlePageParser())
+        self.assertEqual(self.chunks_read, 2)
+        self.assertIsNone(result.content)
+
+    def test_cached_page_fed_to_parser(self):
+        parser = StreamingTitlePageParser()
+        with self.settings(IMDB_INFO_LOCAL_CACHE_DIR=self.cache_dir):
+            get_cache().set(TITLE_URL, 'title', self.archer_page)
+            result = fetch_streaming(TITLE_URL, 'title', parser)
+        self.assertEqual(result.content, self.archer_page)
+        self.assertTrue(parser.done)
+
+
+class FetchToFileTests(SimpleTestCase):
+
+    image_url = 'https://m.media-amazon.com/images/M/archer._V1_.jpg'
+
+    def setUp(self):
+        self.cache_dir = Path(tempfile.mkdtemp())
+        self.media_dir = Path(tempfile.mkdtemp())
+        self.image_path = self.media_dir / 'title-images' / 'tt1486217.jpg'
+
+    def tearDown(self):
+        set_cache_mode(NORMAL)
+        rmtree(self.cache_dir)
+        rmtree(self.media_dir)
+
+    def image_response(self, status_code: int = 200) -> MagicMock:
+        response = MagicMock(status_code=status_code, content=b'', headers={'ETag': '"img"'})
+        response.__enter__.return_value = response
+        response.iter_content.return_value = [b'jpeg ', b'bytes']
+        return response
+
+    @patch('imdb_info_local.http_client.http_get')
+    def test_download_streamed_to_file_and_not_cached(self, http_get_mock):
+        """The image store keeps images, so they aren't written to the response cache too."""
+        http_get_mock.return_value = self.image_response()
+        with self.settings(IMDB_INFO_LOCAL_CACHE_DIR=self.cache_dir):
+            self.assertTrue(fetch_to_file(self.image_url, 'image', self.image_path, 0o644))
+            self.assertIsNone(get_cache().get(self.image_url))
+        self.assertEqual(self.image_path.read_bytes(), b'jpeg bytes')
+        self.assertEqual(self.image_path.stat().st_mode & 0o777, 0o644)
+        self.assertEqual(list(self.image_path.parent.iterdir()), [self.image_path])
+        self.assertEqual(http_get_mock.call_args.kwargs['stream'], True)
+
+    @patch('imdb_info_local.http_client.http_get')
+    def test_nothing_downloaded_in_cache_only_mode(self, http_get_mock):
+        set_cache_mode(CACHE_ONLY)
+        with self.settings(IMDB_INFO_LOCAL_CACHE_DIR=self.cache_dir):
+            self.assertFalse(fetch_to_file(self.image_url, 'image', self.image_path))
+        self.assertFalse(self.image_path.exists())
+        self.assertFalse(http_get_mock.called)
+
+    @patch('imdb_info_local.http_client.http_get')
+    def test_error_response_writes_nothing(self, http_get_mock):
+        http_get_mock.return_value = self.image_response(status_code=404)
+        with self.settings(IMDB_INFO_LOCAL_CACHE_DIR=None):
+            self.assertFalse(fetch_to_file(self.image_url, 'image', self.image_path))
+        self.assertEqual(list(self.image_path.parent.iterdir()), [])
@@ -0,0 +1,63 @@
+from io import StringIO
+from pathlib import Path
+import shutil
+import tempfile
+
+from django.core.management import call_command
+from django.test import SimpleTestCase, TestCase
+
+from imdb_info_local.catalog import generate_catalog, synthetic_titles
+from imdb_info_local.management.commands.run_scraper import remove_title_data_for_deleted_files
+from imdb_info_local.models import IMDBTitleSearchData
+from imdb_info_local.thumbnails import has_thumbnails
+
+
+class SyntheticTitlesTests(SimpleTestCase):
+
+    def test_same_seed_same_titles(self):
+        self.assertEqual(synthetic_titles(200, seed=7), synthetic_titles(200, seed=7))
+        self.assertNotEqual(synthetic_titles(200, seed=7), synthetic_titles(200, seed=8))
+
+    def test_directory_names_are_unique_for_each_type(self):
+        titles = synthetic_titles(2000, tv_fraction=0.5)
+        self.assertEqual(len({(title.type, title.dir_name) for title in titles}), 2000)
+        self.assertEqual({title.type for title in titles}, {'MO', 'TV'})
+
+    def test_unrated_titles_are_rated_0_like_scraped_ones(self):
+        ratings = [title.rating for title in synthetic_titles(1000)]
+        self.assertNotIn(None, ratings)
+        self.assertIn(0, ratings)
+
+
+class GenerateCatalogTests(TestCase):
+
+    def setUp(self):
+        self.temp_dir = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, self.temp_dir)
+        self.roots = [self.temp_dir / 'drive-1', self.temp_dir / 'drive-2']
+
+    def test_generate_catalog(self):
+        with self.settings(MEDIA_ROOT=str(self.temp_dir / 'media')):
+            self.assertEqual(generate_catalog(50, self.roots, images=3, batch_size=20), 50)
+            titles = list(IMDBTitleSearchData.objects.all())
+            self.assertEqual(len({title.image.name for title in titles}), 3)
+            self.assertTrue(all(has_thumbnails(Path(title.image.path)) and title.has_thumbnails for title in titles))
+        for title in titles:
+            path = Path(title.file_path)
+            self.assertTrue(path.is_dir())
+            self.assertEqual(int(path.stat().st_mtime), title.file_mtime)
+        self.assertEqual({Path(title.file_path).parents[1].name for title in titles}, {'drive-1', 'drive-2'})
+        # the scraper finds every title directory in the db
+        for root in self.roots:
+            self.assertEqual(remove_title_data_for_deleted_files(root / 'movies', 'MO'), [])
+            self.assertEqual(remove_title_data_for_deleted_files(root / 'tv', 'TV'), [])
+        # and the same catalog again adds nothing
+        self.assertEqual(generate_catalog(50, self.roots, images=0), 0)
+
+    def test_command(self):
+        out = StringIO()
+        call_command('generate_catalog', '20', '--root', str(self.roots[0]), '--images', '0', '--seed', '3',
+                     stdout=out)
+        self.assertIn('added 20 synthetic titles', out.getvalue())
+        self.assertEqual(IMDBTitleSearchData.objects.count(), 20)
+        self.assertFalse(IMDBTitleSearchData.objects.exclude(image='').exists())
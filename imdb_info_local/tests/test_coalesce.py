@@ -0,0 +1,75 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import threading
+import time
+from unittest.mock import patch, Mock
+
+from django.test import SimpleTestCase
+
+from imdb_info_local.coalesce import SingleFlight, SEARCH, TITLE, coalesced, start_run, finish_run
+from imdb_info_local.imdb import IMDBFindTitleResult, IMDBTitleData
+from imdb_info_local.management.commands.run_scraper import get_imdb_title_data
+
+
+class SingleFlightTests(SimpleTestCase):
+
+    def test_concurrent_calls_share_one_call(self):
+        single_flight = SingleFlight()
+        release = threading.Event()
+
+        def slow_search():
+            release.wait(5)
+            return ['result']
+        fn = Mock(side_effect=slow_search)
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            futures = [executor.submit(single_flight.do, SEARCH, 'archer', fn) for _ in range(4)]
+            time.sleep(0.05)
+            release.set()
+            results = [future.result() for future in futures]
+        self.assertEqual(results, [['result']] * 4)
+        fn.assert_called_once()
+        self.assertEqual(single_flight.stats, {'search_calls': 1, 'search_hits': 3})
+
+    def test_failed_call_is_not_kept(self):
+        single_flight = SingleFlight()
+        fn = Mock(side_effect=[ValueError('bad page'), 'result'])
+        with self.assertRaises(ValueError):
+            single_flight.do(TITLE, 'tt1486217', fn)
+        self.assertEqual(single_flight.do(TITLE, 'tt1486217', fn), 'result')
+        self.assertEqual(fn.call_count, 2)
+
+    def test_async_calls_share_one_call(self):
+        single_flight = SingleFlight()
+        calls = []
+
+        async def fetch(url):
+            calls.append(url)
+            await asyncio.sleep(0.01)
+            return url
+
+        async def lookups():
+            return await asyncio.gather(*[single_flight.do_async(TITLE, 'tt1486217', fetch, 'url') for _ in range(3)])
+        self.assertEqual(asyncio.run(lookups()), ['url'] * 3)
+        self.assertEqual(calls, ['url'])
+
+    def test_coalesced_outside_a_run_calls_through(self):
+        fn = Mock(return_value='result')
+        coalesced(SEARCH, 'Archer', fn)
+        coalesced(SEARCH, 'Archer', fn)
+        self.assertEqual(fn.call_count, 2)
+
+    @patch('imdb_info_local.management.commands.run_scraper.imdb_title_data')
+    @patch('imdb_info_local.management.commands.run_scraper.imdb_title_search_results')
+    def test_titles_in_a_run_share_searches_and_title_pages(self, search_mock, title_data_mock):
+        archer_url = 'https://www.imdb.com/title/tt1486217/'
+        search_mock.side_effect = lambda title: [IMDBFindTitleResult('', f'{archer_url}?ref_={title[-1]}', title)]
+        title_data_mock.return_value = IMDBTitleData(8.6, 'blurb', None, title_url=archer_url)
+        start_run()
+        try:
+            for title in ('Archer', 'archer ', 'Archer 2009'):
+                self.assertEqual(get_imdb_title_data(title).title_data.rating, 8.6)
+        finally:
+            stats = finish_run()
+        self.assertEqual(search_mock.call_count, 2)
+        title_data_mock.assert_called_once()
+        self.assertEqual(stats, {'search_calls': 2, 'search_hits': 1, 'title_calls': 1, 'title_hits': 2})
@@ -0,0 +1,97 @@
+from pathlib import Path
+import shutil
+import tempfile
+import threading
+
+import requests
+from django.test import SimpleTestCase, TestCase
+
+from imdb_info_local.benchmarks.fake_imdb import FakeIMDbServer, fake_title_id
+from imdb_info_local.benchmarks.scraper import Scenario, make_title_dirs, run_scenario
+from imdb_info_local.http_client import fetch_to_file, reset_session
+from imdb_info_local.http_policy import RetriesExhausted, reset_policy
+from imdb_info_local.imdb import title_search_url
+from imdb_info_local.management.commands.run_scraper import get_imdb_title_data
+from imdb_info_local.models import IMDBTitleSearchData
+
+
+class FakeIMDbServerTests(SimpleTestCase):
+
+    def test_title_search_url_uses_base_url_setting(self):
+        with self.settings(IMDB_INFO_LOCAL_BASE_URL='http://127.0.0.1:8765/'):
+            self.assertEqual(title_search_url('The Big Lebowski'), 'http://127.0.0.1:8765/find?q=The+Big+Lebowski')
+
+    def test_scrapes_title_from_fake_imdb(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        with FakeIMDbServer() as server, self.settings(
+                IMDB_INFO_LOCAL_BASE_URL=server.base_url, IMDB_INFO_LOCAL_CACHE_DIR=None,
+                IMDB_INFO_LOCAL_REQUESTS_PER_SECOND=0, MEDIA_ROOT=media_root):
+            results = get_imdb_title_data('Star Trek Beyond 2016')
+        title_id = fake_title_id('Star Trek Beyond 2016')
+        self.assertTrue(results.title_data.title_url.startswith(f'{server.base_url}/title/{title_id}/'))
+        self.assertEqual(results.title_data.rating, 8.7)
+        self.assertTrue(Path(results.title_data.image_file).is_file())
+        self.assertEqual(server.stats['requests'], 3)
+
+    def test_injected_errors_throttling_and_not_modified(self):
+        with FakeIMDbServer(error_rate=1, error_status=502) as server:
+            self.assertEqual(requests.get(f'{server.base_url}/title/tt0000001/').status_code, 502)
+        with FakeIMDbServer(requests_per_second=1) as server:
+            statuses = [requests.get(f'{server.base_url}/title/tt0000001/') for _ in range(2)]
+            self.assertEqual([r.status_code for r in statuses], [200, 429])
+            self.assertEqual(statuses[1].headers['Retry-After'], '1')
+        with FakeIMDbServer() as server:
+            r = requests.get(f'{server.base_url}/title/tt0000001/')
+            self.assertIn(b'tt0000001', r.content)
+            r = requests.get(f'{server.base_url}/title/tt0000001/', headers={'If-None-Match': r.headers['ETag']})
+            self.assertEqual(r.status_code, 304)
+
+    def test_exhausted_streamed_fetch_frees_pool_slot(self):
+        temp_dir = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, temp_dir)
+        self.addCleanup(reset_policy)
+        self.addCleanup(reset_session)
+        policy = {'max_retries': 0, 'failure_threshold': 10}
+        with FakeIMDbServer(error_rate=1, error_status=503) as server, self.settings(
+                IMDB_INFO_LOCAL_HTTP_POOL_SIZE=1, IMDB_INFO_LOCAL_HTTP_POLICY=policy,
+                IMDB_INFO_LOCAL_CACHE_DIR=None, IMDB_INFO_LOCAL_REQUESTS_PER_SECOND=0):
+            reset_session()
+            reset_policy()
+            url = f'{server.base_url}/title/tt0000001/'
+            errors = []
+
+            def fetch():
+                try:
+                    fetch_to_file(url, 'image', temp_dir / 'image.jpg')
+                except RetriesExhausted as e:
+                    errors.append(e)
+
+            fetch()
+            # with the only pool slot still held by the first response, this would block forever
+            second = threading.Thread(target=fetch, daemon=True)
+            second.start()
+            second.join(timeout=10)
+            self.assertFalse(second.is_alive())
+        self.assertEqual(len(errors), 2)
+
+
+class ScraperBenchmarkTests(TestCase):
+
+    def tearDown(self):
+        reset_session()
+        reset_policy()
+
+    def test_run_scenario_leaves_db_alone(self):
+        result = run_scenario(Scenario('async-test', 'async', 4, cache='warm'), titles=3, latency=0)
+        self.assertEqual(result['added'], 3)
+        # the timed run gets its pages from the cache filled by the first, and only downloads images
+        self.assertEqual(result['requests'], 3)
+        self.assertFalse(IMDBTitleSearchData.objects.exists())
+
+    def test_make_title_dirs(self):
+        temp_dir = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, temp_dir)
+        make_title_dirs(temp_dir, 3)
+        self.assertEqual(sorted(d.name for d in temp_dir.iterdir()),
+                         ['Synthetic-Title-00000-1950', 'Synthetic-Title-00001-1951', 'Synthetic-Title-00002-1952'])
@@ -0,0 +1,57 @@
+from unittest.mock import patch
+
+from django.test import SimpleTestCase
+
+from imdb_info_local import http_client
+from imdb_info_local.http_client import (get_session, reset_session, http_get, get_rate_limiter,
+                                         TokenBucket, FIREFOX_USER_AGENT)
+
+
+class HTTPClientTests(SimpleTestCase):
+
+    def tearDown(self):
+        reset_session()
+
+    def test_session_is_shared(self):
+        self.assertIs(get_session(), get_session())
+
+    def test_session_pool_size_from_settings(self):
+        reset_session()
+        with self.settings(IMDB_INFO_LOCAL_HTTP_POOL_SIZE=3):
+            adapter = get_session().get_adapter('https://www.imdb.com/')
+            self.assertEqual(adapter._pool_maxsize, 3)
+            self.assertTrue(adapter._pool_block)
+
+    def test_session_headers(self):
+        headers = get_session().headers
+        self.assertEqual(headers['User-Agent'], FIREFOX_USER_AGENT)
+        self.assertIn('gzip', headers['Accept-Encoding'])
+
+    @patch.object(http_client.requests.Session, 'get')
+    def test_http_get_uses_timeout_setting(self, get_mock):
+        with self.settings(IMDB_INFO_LOCAL_HTTP_TIMEOUT=(1, 2)):
+            http_get('https://www.imdb.com/title/tt1486217/')
+        get_mock.assert_called_once_with('https://www.imdb.com/title/tt1486217/', timeout=(1, 2))
+
+
+class TokenBucketTests(SimpleTestCase):
+
+    def test_burst_up_to_capacity_does_not_wait(self):
+        bucket = TokenBucket(rate=1, capacity=3)
+        self.assertEqual([bucket.acquire() for _ in range(3)], [0, 0, 0])
+
+    @patch('imdb_info_local.http_client.time.sleep')
+    def test_waits_when_empty(self, sleep_mock):
+        bucket = TokenBucket(rate=2, capacity=1)
+        bucket.acquire()
+        # freeze refill so the bucket only fills through the mocked sleep
+        with patch('imdb_info_local.http_client.time.monotonic', return_value=bucket.updated):
+            sleep_mock.side_effect = lambda secs: setattr(bucket, 'tokens', bucket.tokens + secs * bucket.rate)
+            waited = bucket.acquire()
+        self.assertAlmostEqual(waited, 0.5)
+
+    def test_no_rate_limiter_when_rate_is_zero(self):
+        with self.settings(IMDB_INFO_LOCAL_REQUESTS_PER_SECOND=0):
+            self.assertIsNone(get_rate_limiter())
+        with self.settings(IMDB_INFO_LOCAL_REQUESTS_PER_SECOND=5):
+            self.assertEqual(get_rate_limiter().rate, 5)
@@ -0,0 +1,133 @@
+from email.utils import formatdate
+import time
+from unittest.mock import patch, Mock
+
+import requests
+from django.test import SimpleTestCase
+
+from imdb_info_local import http_client
+from imdb_info_local.http_client import http_get, reset_session
+from imdb_info_local.http_policy import (parse_retry_after, backoff_delay, CircuitBreaker, AIMDController,
+                                         RetriesExhausted, get_policy, reset_policy)
+
+
+def response(status: int, headers: dict = None) -> Mock:
+    return Mock(status_code=status, headers=headers or {})
+
+
+class BackoffTests(SimpleTestCase):
+
+    def test_parse_retry_after_seconds(self):
+        self.assertEqual(parse_retry_after('120'), 120)
+        self.assertIsNone(parse_retry_after(None))
+        self.assertIsNone(parse_retry_after('soon'))
+
+    def test_parse_retry_after_http_date(self):
+        self.assertAlmostEqual(parse_retry_after(formatdate(time.time() + 30, usegmt=True)), 30, delta=2)
+        self.assertEqual(parse_retry_after(formatdate(time.time() - 30, usegmt=True)), 0)
+
+    def test_backoff_is_capped_and_jittered(self):
+        delays = [backoff_delay(10, base=1, cap=4) for _ in range(100)]
+        self.assertTrue(all(0 <= delay <= 4 for delay in delays))
+        self.assertGreater(len(set(delays)), 1)
+
+    def test_backoff_waits_at_least_retry_after(self):
+        self.assertGreaterEqual(backoff_delay(0, base=1, cap=4, retry_after=10), 10)
+
+
+class CircuitBreakerTests(SimpleTestCase):
+
+    def test_opens_after_threshold_then_probes(self):
+        breaker = CircuitBreaker(failure_threshold=2, reset_timeout=10)
+        breaker.record_failure()
+        self.assertEqual(breaker.wait_time(), 0)
+        breaker.record_failure()
+        self.assertEqual(breaker.state, CircuitBreaker.OPEN)
+        self.assertGreater(breaker.wait_time(), 9)
+        with patch('imdb_info_local.http_policy.time.monotonic', return_value=time.monotonic() + 11):
+            # first caller after the timeout probes, the others wait on it
+            self.assertEqual(breaker.wait_time(), 0)
+            self.assertEqual(breaker.state, CircuitBreaker.HALF_OPEN)
+            self.assertGreater(breaker.wait_time(), 0)
+        breaker.record_success()
+        self.assertEqual(breaker.state, CircuitBreaker.CLOSED)
+        self.assertEqual(breaker.wait_time(), 0)
+
+    def test_failed_probe_opens_again(self):
+        breaker = CircuitBreaker(failure_threshold=1, reset_timeout=10)
+        breaker.record_failure()
+        with patch('imdb_info_local.http_policy.time.monotonic', return_value=time.monotonic() + 11):
+            breaker.wait_time()
+            breaker.record_failure()
+            self.assertEqual(breaker.state, CircuitBreaker.OPEN)
+
+
+class AIMDControllerTests(SimpleTestCase):
+
+    def test_failure_halves_limit_once_per_interval(self):
+        controller = AIMDController(maximum=16, target_latency=5)
+        controller.record(1, ok=False)
+        controller.record(1, ok=False)
+        self.assertEqual(controller.limit, 8)
+
+    def test_slow_response_counts_as_congestion(self):
+        controller = AIMDController(maximum=16, target_latency=5)
+        controller.record(6, ok=True)
+        self.assertEqual(controller.limit, 8)
+
+    def test_healthy_round_adds_one(self):
+        controller = AIMDController(maximum=16, target_latency=5)
+        controller.limit = 4.0
+        for _ in range(4):
+            controller.record(1, ok=True)
+        self.assertAlmostEqual(controller.limit, 5, delta=0.2)
+
+    def test_limit_bounds_slots(self):
+        controller = AIMDController(maximum=2, minimum=1)
+        self.assertTrue(controller.try_acquire())
+        self.assertTrue(controller.try_acquire())
+        self.assertFalse(controller.try_acquire())
+        controller.release()
+        self.assertTrue(controller.try_acquire())
+
+
+@patch('imdb_info_local.http_client.time.sleep')
+@patch.object(http_client.requests.Session, 'get')
+class HTTPGetRetryTests(SimpleTestCase):
+    policy = {'max_retries': 2, 'backoff_base': 0.1, 'backoff_cap': 1, 'failure_threshold': 10}
+
+    def setUp(self):
+        reset_policy()
+
+    def tearDown(self):
+        reset_policy()
+        reset_session()
+
+    def test_retries_503_then_returns_response(self, get_mock, sleep_mock):
+        ok = response(200)
+        get_mock.side_effect = [response(503, {'Retry-After': '3'}), ok]
+        with self.settings(IMDB_INFO_LOCAL_HTTP_POLICY=self.policy, IMDB_INFO_LOCAL_REQUESTS_PER_SECOND=0):
+            self.assertIs(http_get('https://www.imdb.com/find?q=Archer'), ok)
+        self.assertEqual(get_mock.call_count, 2)
+        self.assertGreaterEqual(sleep_mock.call_args.args[0], 3)
+
+    def test_retries_connection_errors(self, get_mock, sleep_mock):
+        ok = response(200)
+        get_mock.side_effect = [requests.ConnectionError('reset'), ok]
+        with self.settings(IMDB_INFO_LOCAL_HTTP_POLICY=self.policy, IMDB_INFO_LOCAL_REQUESTS_PER_SECOND=0):
+            self.assertIs(http_get('https://www.imdb.com/find?q=Archer'), ok)
+
+    def test_raises_when_retries_exhausted(self, get_mock, sleep_mock):
+        get_mock.return_value = response(429)
+        with self.settings(IMDB_INFO_LOCAL_HTTP_POLICY=self.policy, IMDB_INFO_LOCAL_REQUESTS_PER_SECOND=0):
+            with self.assertRaises(RetriesExhausted):
+                http_get('https://www.imdb.com/find?q=Archer')
+        self.assertEqual(get_mock.call_count, 3)
+
+    def test_not_found_is_not_retried(self, get_mock, sleep_mock):
+        get_mock.return_value = response(404)
+        with self.settings(IMDB_INFO_LOCAL_HTTP_POLICY=self.policy, IMDB_INFO_LOCAL_REQUESTS_PER_SECOND=0):
+            self.assertEqual(http_get('https://www.imdb.com/title/tt0000000/').status_code, 404)
+        get_mock.assert_called_once()
+        sleep_mock.assert_not_called()
+        self.assertEqual(get_policy().breaker.state, CircuitBreaker.CLOSED)
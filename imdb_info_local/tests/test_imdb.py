@@ -1,12 +1,20 @@
+import asyncio
 from unittest import TestCase
-from unittest.mock import patch, Mock
+from unittest.mock import patch, Mock, AsyncMock
 from pathlib import Path
+import hashlib
+import shutil
+import tempfile
 
 from bs4 import BeautifulSoup
+from django.test import override_settings
 
 from imdb_info_local.imdb import (imdb_title_data, imdb_title_search_results, imdb_title_image_file,
                                   IMDBFindTitleResult, IMDBTitleData)
-from imdb_info_local.utils import soup_from_local_file
+from imdb_info_local.imdb_async import imdb_title_data_async
+from imdb_info_local.http_client import FetchResult, Validators, STREAM_CHUNK_SIZE
+from imdb_info_local.extractors import (EXTRACTORS, TitlePageFields, StreamingTitlePageParser,
+                                        available_extractors, extract_title_page)
 from .nondb_fixtures import (archer_find_title_result, archer_title_data,
                              archer_find_title_alt_html_format_result)
 
@@ -16,52 +24,181 @@ DATA_DIR = Path(__file__).parent / 'data'
 
 class IMDBScrapingTests(TestCase):
 
-    @patch('imdb_info_local.imdb.parse_html_for_url')
-    def test_imdb_title_search_results(self, mock_soup):
-        mock_soup.return_value = soup_from_local_file(
-            DATA_DIR.joinpath('imdb-search-archer.html')
-        )
+    @patch('imdb_info_local.imdb.fetch_content')
+    def test_imdb_title_search_results(self, mock_fetch_content):
+        mock_fetch_content.return_value = DATA_DIR.joinpath('imdb-search-archer.html').read_bytes()
         title_search_results = imdb_title_search_results('Archer')
         self.assertEqual(len(title_search_results), 2)
         self.assertEqual(title_search_results[0], archer_find_title_result)
 
-    @patch('imdb_info_local.imdb.parse_html_for_url')
-    def test_imdb_title_search_no_results(self, mock_soup):
+    @patch('imdb_info_local.imdb.fetch_content')
+    def test_imdb_title_search_no_results(self, mock_fetch_content):
         """Test when there are no results in the search page."""
-        mock_soup.return_value = soup_from_local_file(
-            DATA_DIR.joinpath('imdb-search-looney-tunes-golden-collection.html')
-        )
+        mock_fetch_content.return_value = DATA_DIR.joinpath('imdb-search-looney-tunes-golden-collection.html').read_bytes()
         title_search_results = imdb_title_search_results('Looney Tunes Golden Collection')
         self.assertEqual(len(title_search_results), 0)
 
-    @patch('imdb_info_local.imdb.parse_html_for_url')
-    def test_imdb_title_search_results_alt_html_format(self, mock_soup):
-        mock_soup.return_value = soup_from_local_file(
-            DATA_DIR.joinpath('imdb-search-archer-alt-html-format.html')
-        )
-        title_search_results = imdb_title_search_results('Archer')
+    @patch('imdb_info_local.imdb.fetch_content')
+    def test_imdb_title_search_results_alt_html_format(self, mock_fetch_content):
+        mock_fetch_content.return_value = DATA_DIR.joinpath('imdb-search-archer-alt-html-format.html').read_bytes()
+        title_search_results = imdb_title_search_results('Archer', extractor='soup')
         self.assertEqual(len(title_search_results), 5)
         self.assertEqual(title_search_results[0], archer_find_title_alt_html_format_result)
 
+    @patch('imdb_info_local.imdb.fetch_content')
+    def test_imdb_title_search_results_json(self, mock_fetch_content):
+        """The json results match the html results, thumbnails included."""
+        mock_fetch_content.return_value = DATA_DIR.joinpath('imdb-search-archer-alt-html-format.html').read_bytes()
+        html_results = imdb_title_search_results('Archer', extractor='soup')
+        json_results = imdb_title_search_results('Archer', extractor='json')
+        self.assertEqual(json_results, html_results)
+        self.assertEqual(json_results[0], archer_find_title_alt_html_format_result)
+        mock_fetch_content.assert_called_with('https://www.imdb.com/find?q=Archer', kind='search')
+
 
     @patch('imdb_info_local.imdb.imdb_title_image_file')
-    @patch('imdb_info_local.imdb.parse_html_for_url')
-    def test_imdb_title_data(self, mock_soup, mock_imdb_title_image_file):
-        mock_soup.return_value = soup_from_local_file(
-            DATA_DIR.joinpath('archer-title-page.html')
+    @patch('imdb_info_local.imdb.fetch')
+    def test_imdb_title_data(self, mock_fetch, mock_imdb_title_image_file):
+        mock_fetch.return_value = FetchResult(
+            content=DATA_DIR.joinpath('archer-title-page.html').read_bytes(),
+            validators=Validators(etag='"archer"')
         )
         mock_imdb_title_image_file.return_value = Path('/tmp/archer.jpg')
         title_data = imdb_title_data('https://www.imdb.com/title/tt1486217/')
         self.assertEqual(title_data, archer_title_data)
+        self.assertEqual(title_data.title_url, 'https://www.imdb.com/title/tt1486217/')
+        self.assertEqual(title_data.validators, Validators(etag='"archer"'))
 
-    @patch('imdb_info_local.imdb.requests.get')
-    def test_imdb_title_image_file(self, mock_get):
-        mock_get.return_value = Mock(ok=True)
-        test_image_path = DATA_DIR / 'archer.jpg'
-        archer_html_soup = soup_from_local_file(
-            DATA_DIR.joinpath('archer-title-page.html')
+    @patch('imdb_info_local.imdb.imdb_title_image_file')
+    @patch('imdb_info_local.imdb.fetch_streaming')
+    def test_imdb_title_data_streamed(self, mock_fetch_streaming, mock_imdb_title_image_file):
+        def fetch_streaming(url, kind, parser, validators):
+            parser.feed(DATA_DIR.joinpath('archer-title-page.html').read_bytes()[:STREAM_CHUNK_SIZE])
+            return FetchResult(content=None, validators=Validators(etag='"archer"'))
+        mock_fetch_streaming.side_effect = fetch_streaming
+        mock_imdb_title_image_file.return_value = Path('/tmp/archer.jpg')
+        with override_settings(IMDB_INFO_LOCAL_STREAM_TITLE_PAGES=True):
+            title_data = imdb_title_data('https://www.imdb.com/title/tt1486217/')
+        self.assertEqual(title_data, archer_title_data)
+        mock_imdb_title_image_file.assert_called_once_with(
+            'https://m.media-amazon.com/images/M/MV5BMTg3NTMwMzY2OF5BMl5BanBnXkFtZTgwMDcxMjQ0NDE@._V1_QL75_UX190_.jpg',
+            'tt1486217'
         )
-        with open(test_image_path, 'rb') as img_fp:
-            mock_get.return_value.content = img_fp.read()
-            saved_image_path = imdb_title_image_file(archer_html_soup, 'archer')
-            self.assertEqual(saved_image_path, Path('/tmp/archer.jpg'))
+
+    @patch('imdb_info_local.imdb.imdb_title_image_file')
+    @patch('imdb_info_local.imdb.fetch')
+    def test_imdb_title_data_not_modified(self, mock_fetch, mock_imdb_title_image_file):
+        """Nothing is parsed or downloaded when the page revalidates."""
+        validators = Validators(etag='"archer"')
+        mock_fetch.return_value = FetchResult(content=None, validators=validators, not_modified=True)
+        title_data = imdb_title_data('https://www.imdb.com/title/tt1486217/', validators)
+        self.assertIsNone(title_data)
+        mock_fetch.assert_called_once_with('https://www.imdb.com/title/tt1486217/', kind='title',
+                                           validators=validators)
+        self.assertFalse(mock_imdb_title_image_file.called)
+
+    def test_imdb_title_data_async_not_modified(self):
+        """The async engine revalidates title pages with stored validators too."""
+        validators = Validators(etag='"archer"')
+        client = Mock(fetch=AsyncMock(return_value=FetchResult(content=None, validators=validators,
+                                                               not_modified=True)),
+                      fetch_to_file=AsyncMock())
+        title_data = asyncio.run(imdb_title_data_async(client, 'https://www.imdb.com/title/tt1486217/', validators))
+        self.assertIsNone(title_data)
+        self.assertEqual(client.fetch.call_args.args[3], validators)
+        self.assertFalse(client.fetch_to_file.called)
+
+    @patch('imdb_info_local.imdb.fetch_to_file')
+    def test_imdb_title_image_file(self, mock_fetch_to_file):
+        """The image is downloaded into the image store, named by the hash of its content."""
+        img_url = 'https://m.media-amazon.com/images/M/MV5BMTg3NTMwMzY2OF5BMl5BanBnXkFtZTgwMDcxMjQ0NDE@._V1_.jpg'
+        archer_bytes = (DATA_DIR / 'archer.jpg').read_bytes()
+
+        def fetch_to_file(url, kind, path, mode):
+            path.parent.mkdir(parents=True, exist_ok=True)
+            path.write_bytes(archer_bytes)
+            return True
+        mock_fetch_to_file.side_effect = fetch_to_file
+        media_root = tempfile.mkdtemp()
+        with override_settings(MEDIA_ROOT=media_root):
+            saved_image_path = imdb_title_image_file(img_url, 'archer')
+            # the same image for another title is not stored again
+            self.assertEqual(imdb_title_image_file(img_url, 'archer-2'), saved_image_path)
+        image_dir = Path(media_root) / 'title-images'
+        self.assertEqual(saved_image_path, image_dir / f'{hashlib.sha256(archer_bytes).hexdigest()}.jpg')
+        self.assertEqual(saved_image_path.read_bytes(), archer_bytes)
+        self.assertEqual(len(list(image_dir.glob('*.jpg'))), 3, 'image and 2 thumbnails, no downloads left')
+        self.assertEqual(mock_fetch_to_file.call_args.args[:2], (img_url, 'image'))
+        shutil.rmtree(media_root)
+
+    @patch('imdb_info_local.imdb.fetch_to_file')
+    def test_imdb_title_image_file_error_response(self, mock_fetch_to_file):
+        mock_fetch_to_file.return_value = False
+        self.assertIsNone(imdb_title_image_file('https://m.media-amazon.com/images/M/a._V1_.jpg', 'archer'))
+
+    @patch('imdb_info_local.imdb.fetch_to_file')
+    def test_imdb_title_image_file_no_image(self, mock_fetch_to_file):
+        self.assertIsNone(imdb_title_image_file(None, 'archer'))
+        self.assertFalse(mock_fetch_to_file.called)
+
+
+class ExtractorTests(TestCase):
+    """Each extractor finds the same fields in the title page fixture."""
+
+    archer_page = DATA_DIR.joinpath('archer-title-page.html').read_bytes()
+    expected = TitlePageFields(
+        rating=8.7,
+        blurb=archer_title_data.blurb,
+        img_url='./archer-title-page-2_files/MV5BMTg3NTMwMzY2OF5BMl5BanBnXkFtZTgwMDcxMjQ0NDE@._V1_QL75_UX190_CR0,2,190,281_.jpg'
+    )
+
+    def test_extractors(self):
+        # the page was saved with its images, so only the html has local image urls
+        for name in set(available_extractors()) - {'json', 'stream'}:
+            with self.subTest(extractor=name):
+                self.assertEqual(EXTRACTORS[name](self.archer_page), self.expected)
+                self.assertEqual(extract_title_page(self.archer_page, name), self.expected)
+
+    def test_json_extractor(self):
+        self.assertEqual(
+            extract_title_page(self.archer_page, 'json'),
+            TitlePageFields(
+                rating=8.7,
+                blurb=archer_title_data.blurb,
+                img_url='https://m.media-amazon.com/images/M/MV5BMTg3NTMwMzY2OF5BMl5BanBnXkFtZTgwMDcxMjQ0NDE@'
+                        '._V1_QL75_UX190_.jpg'
+            )
+        )
+
+    def test_json_extractor_json_ld(self):
+        """Pages without __NEXT_DATA__ are read from their JSON-LD."""
+        page = (b'<html><head><script type="application/ld+json">{"description": "Spies &amp; drones.", '
+                b'"aggregateRating": {"ratingValue": 8.7}, "image": "https://m.media-amazon.com/a._V1_.jpg"}'
+                b'</script></head></html>')
+        self.assertEqual(extract_title_page(page, 'json'),
+                         TitlePageFields(8.7, 'Spies & drones.', 'https://m.media-amazon.com/a._V1_QL75_UX190_.jpg'))
+
+    def test_stream_extractor(self):
+        self.assertEqual(extract_title_page(self.archer_page, 'stream'), extract_title_page(self.archer_page, 'json'))
+
+    def test_streaming_parser_without_json_ld(self):
+        """The fields are read from the html, and the parser is done once all are found."""
+        json_ld_start = self.archer_page.find(b'application/ld+json')
+        page = self.archer_page[:json_ld_start] + b'x' + self.archer_page[json_ld_start + 1:]
+        parser = StreamingTitlePageParser()
+        parser.feed(page[:self.archer_page.find(b'data-testid="plot-l"')])
+        self.assertFalse(parser.done)
+        parser.feed(page[self.archer_page.find(b'data-testid="plot-l"'):][:1000])
+        self.assertTrue(parser.done)
+        self.assertEqual(parser.close(), self.expected)
+
+    def test_fallback_when_no_fields_found(self):
+        with patch.dict(EXTRACTORS, strainer=Mock(return_value=TitlePageFields())):
+            self.assertEqual(extract_title_page(self.archer_page, 'strainer'), self.expected)
+
+    def test_fallback_when_extractor_fails(self):
+        with patch.dict(EXTRACTORS, strainer=Mock(side_effect=ValueError('bad page'))):
+            self.assertEqual(extract_title_page(self.archer_page, 'strainer'), self.expected)
+
+    def test_page_without_fields(self):
+        self.assertEqual(extract_title_page(b'<html><body></body></html>'), TitlePageFields())
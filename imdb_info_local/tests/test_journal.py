@@ -0,0 +1,85 @@
+from pathlib import Path
+import shutil
+import tempfile
+from unittest.mock import patch
+
+from django.core.management import call_command
+from django.test import TestCase
+
+from imdb_info_local.http_policy import RetriesExhausted
+from imdb_info_local.imdb import IMDBFindTitleResult, IMDBTitleData
+from imdb_info_local.journal import ScrapeCheckpoint, prune_journal, resume_scans
+from imdb_info_local.models import IMDBTitleSearchData, ScrapeJournalEntry
+from imdb_info_local.management.commands.run_scraper import process_directory
+
+archer_find_result = IMDBFindTitleResult(img_url='', title_url='https://www.imdb.com/title/tt1486217/',
+                                         text='Archer (2009) (TV Series)')
+archer_title_data = IMDBTitleData(8.6, 'Covert black-ops and espionage take a back seat to zany personalities.', None,
+                                  title_url='https://www.imdb.com/title/tt1486217/')
+
+
+@patch('imdb_info_local.management.commands.run_scraper.imdb_title_data')
+@patch('imdb_info_local.management.commands.run_scraper.imdb_title_search_results')
+class JournalTests(TestCase):
+
+    def setUp(self):
+        self.temp_dir = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, self.temp_dir)
+        self.tv_dir = self.temp_dir / 'tv'
+        for name in ('American-Dad', 'Archer'):
+            (self.tv_dir / name).mkdir(parents=True)
+
+    def test_failed_title_is_resumed_from_its_checkpoint(self, search_mock, title_data_mock):
+        search_mock.return_value = [archer_find_result]
+        title_data_mock.side_effect = RetriesExhausted(archer_find_result.title_url, '503 response')
+        self.assertEqual(process_directory(self.tv_dir, 'TV', workers=1), [])
+        self.assertEqual(sorted(ScrapeJournalEntry.objects.values_list('title', 'stage', 'error')),
+                         [('American Dad', 'searched', '503 response'), ('Archer', 'searched', '503 response')])
+
+        title_data_mock.side_effect = None
+        title_data_mock.return_value = archer_title_data
+        call_command('run_scraper', '--resume', '--workers', '1')
+        # searched once per title - the resumed run went straight to the title pages
+        self.assertEqual(search_mock.call_count, 2)
+        archer = IMDBTitleSearchData.objects.get(title='Archer')
+        self.assertEqual(archer.rating, 8.6)
+        self.assertIsNotNone(archer.last_scraped)
+        self.assertFalse(ScrapeJournalEntry.objects.exists())
+
+    def test_fetched_title_is_saved_without_requests(self, search_mock, title_data_mock):
+        checkpoint = ScrapeCheckpoint()
+        checkpoint.searched([archer_find_result])
+        checkpoint.fetched(archer_title_data)
+        entry = ScrapeJournalEntry(type='TV', title='Archer', file_path=str((self.tv_dir / 'Archer').resolve()),
+                                   file_mtime_ns=1604372147000000000, file_ctime_ns=1604372147000000000)
+        checkpoint.update_entry(entry)
+        entry.save()
+
+        call_command('run_scraper', '--resume')
+        search_mock.assert_not_called()
+        title_data_mock.assert_not_called()
+        archer = IMDBTitleSearchData.objects.get(title='Archer')
+        self.assertEqual((archer.rating, archer.title_url, archer.file_mtime), (8.6, archer_title_data.title_url,
+                                                                               1604372147))
+        self.assertIn('Archer (2009) (TV Series)', archer.find_results)
+
+    def test_titles_before_an_error_are_saved_and_the_failed_title_checkpointed(self, search_mock, title_data_mock):
+        search_mock.return_value = [archer_find_result]
+        title_data_mock.side_effect = [archer_title_data, ValueError('bad page')]
+        with self.assertRaises(ValueError):
+            process_directory(self.tv_dir, 'TV', workers=1)
+        self.assertEqual(list(IMDBTitleSearchData.objects.values_list('title', flat=True)), ['American Dad'])
+        entry = ScrapeJournalEntry.objects.get()
+        self.assertEqual((entry.title, entry.stage, entry.error), ('Archer', 'searched', 'ValueError: bad page'))
+
+    def test_prune_journal(self, search_mock, title_data_mock):
+        for name in ('American-Dad', 'Archer', 'Gone'):
+            ScrapeJournalEntry.objects.create(type='TV', title=name.replace('-', ' '),
+                                              file_path=str(self.tv_dir.resolve() / name), file_mtime_ns=0,
+                                              file_ctime_ns=0)
+        IMDBTitleSearchData.objects.create(title='Archer', type='TV', rating=8.6, blurb='', find_results='',
+                                           file_path='/tv/Archer', file_mtime=0, file_ctime=0)
+        self.assertEqual(prune_journal(), 2)
+        scans = resume_scans()
+        self.assertEqual([(scan.root, [entry.name for entry in scan.entries]) for scan in scans],
+                         [(self.tv_dir.resolve(), ['American-Dad'])])
@@ -0,0 +1,88 @@
+import json
+from pathlib import Path
+import shutil
+import tempfile
+from unittest.mock import patch
+
+from django.core.management import call_command
+from django.test import SimpleTestCase, TestCase
+
+from imdb_info_local import metrics
+from imdb_info_local.http_policy import AIMDController, CircuitBreaker, HTTPPolicy, RetriesExhausted
+from imdb_info_local.imdb import IMDBFindTitleResult, IMDBTitleData
+
+archer_find_result = IMDBFindTitleResult(img_url='', title_url='https://www.imdb.com/title/tt1486217/',
+                                         text='Archer (2009) (TV Series)')
+archer_title_data = IMDBTitleData(8.6, 'Covert black-ops and espionage take a back seat to zany personalities.', None,
+                                  title_url='https://www.imdb.com/title/tt1486217/')
+
+
+class RunMetricsTests(SimpleTestCase):
+
+    def tearDown(self):
+        metrics.finish_run()
+
+    def test_nothing_recorded_outside_a_run(self):
+        metrics.inc('requests')
+        with metrics.timed('parse'):
+            pass
+        self.assertIsNone(metrics.finish_run())
+
+    def test_summary(self):
+        metrics.start_run()
+        metrics.inc('requests', 3)
+        metrics.inc('response_bytes', 2048)
+        metrics.observe('request', 0.2)
+        metrics.observe('request', 1.5)
+        with metrics.timed('parse'):
+            pass
+        summary = metrics.finish_run().summary()
+        self.assertEqual(summary['counters'], {'requests': 3, 'response_bytes': 2048})
+        self.assertEqual(sorted(summary['phases']), ['parse', 'request'])
+        request = summary['phases']['request']
+        self.assertEqual((request['count'], request['seconds']), (2, 1.7))
+        self.assertEqual((request['buckets']['0.1'], request['buckets']['0.25'], request['buckets']['2.5'],
+                          request['buckets']['+Inf']), (0, 1, 2, 2))
+
+    def test_prometheus_text(self):
+        metrics.start_run()
+        metrics.inc('cache_hits', 4)
+        metrics.observe('title_fetch', 0.3)
+        text = metrics.finish_run().prometheus_text()
+        self.assertIn('imdb_info_local_scraper_last_run_cache_hits 4\n', text)
+        self.assertIn('# TYPE imdb_info_local_scraper_last_run_phase_seconds histogram\n', text)
+        self.assertIn('imdb_info_local_scraper_last_run_phase_seconds_bucket{phase="title_fetch",le="0.25"} 0\n', text)
+        self.assertIn('imdb_info_local_scraper_last_run_phase_seconds_bucket{phase="title_fetch",le="+Inf"} 1\n', text)
+        self.assertIn('imdb_info_local_scraper_last_run_phase_seconds_count{phase="title_fetch"} 1\n', text)
+
+    def test_policy_counts_requests_and_retries(self):
+        policy = HTTPPolicy(1, 0.1, 1, CircuitBreaker(10, 60), AIMDController(4))
+        metrics.start_run()
+        self.assertIsNotNone(policy.completed('url', 0, 0.1, 503, {}))
+        with self.assertRaises(RetriesExhausted):
+            policy.failed('url', 1, 0.1, ConnectionError('reset'))
+        self.assertIsNone(policy.completed('url', 0, 0.1, 200, {}))
+        run_metrics = metrics.finish_run()
+        self.assertEqual(run_metrics.counters, {'requests': 3, 'request_errors': 2, 'retries': 1,
+                                                'requests_failed': 1})
+        self.assertEqual(run_metrics.phases['request'].count, 3)
+
+
+@patch('imdb_info_local.management.commands.run_scraper.imdb_title_data', return_value=archer_title_data)
+@patch('imdb_info_local.management.commands.run_scraper.imdb_title_search_results', return_value=[archer_find_result])
+class RunScraperMetricsTests(TestCase):
+
+    def setUp(self):
+        self.temp_dir = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, self.temp_dir)
+        (self.temp_dir / 'tv' / 'Archer').mkdir(parents=True)
+
+    def test_metrics_out(self, search_mock, title_data_mock):
+        metrics_path = self.temp_dir / 'metrics' / 'run.json'
+        with self.settings(IMDB_INFO_LOCAL_VIDEO_DIRS={'TV': [str(self.temp_dir / 'tv')], 'Movies': []}):
+            call_command('run_scraper', '--workers', '1', '--metrics-out', str(metrics_path))
+        summary = json.loads(metrics_path.read_text())
+        self.assertEqual(summary['phases']['scan']['count'], 1)
+        self.assertGreaterEqual(summary['phases']['db_write']['count'], 1)
+        self.assertIn('imdb_info_local_scraper_last_run_duration_seconds',
+                      metrics_path.with_suffix('.prom').read_text())
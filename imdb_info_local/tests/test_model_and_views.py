@@ -1,16 +1,24 @@
+from io import StringIO
 import os
+import shutil
+import tempfile
 from unittest.mock import patch
 from pathlib import Path
 import re
 
 from django.test import TestCase
+from django.core.management import call_command
 from django.urls import reverse
 from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import DatabaseError
 from django.db.models import Field
 
-from imdb_info_local.models import (IMDBTitleSearchData, add_image_file,
-                                    update_image_file, NONEXISTENT_PATH)
+from imdb_info_local.models import (IMDBTitleSearchData, add_image_file, update_image_file, release_images,
+                                    hash_file, NONEXISTENT_PATH, IMAGE_SUBDIRECTORY)
+from imdb_info_local.management.commands.gc_images import orphaned_image_files, remove_image_files
 from imdb_info_local.imdb import IMDBTitleData
+from imdb_info_local.http_client import Validators
+from imdb_info_local.thumbnails import remove_thumbnails, thumbnail_paths
 
 
 DATA_DIR = Path(__file__).parent.joinpath('data')
@@ -109,13 +117,15 @@ class IMDBTitleSearchDataTests(TestCase):
         response = self.client.post(reverse('title_update'),
                                     data=post_data,
                                     content_type='application/json')
-        partial_expected = b'{"rating": 6.5, "blurb": "Blurb for some alternate tv series or episode with a name like Archer.", "image-url": "/media/title-images/archer'
+        partial_expected = b'{"rating": 6.5, "blurb": "Blurb for some alternate tv series or episode with a name like Archer.", "image-url": "/media/title-images/'
         self.assert_(partial_expected in response.content)
 
         self.tv.refresh_from_db()
         self.assertEqual(self.tv.title, 'Archer')
         self.assertEqual(self.tv.rating, 6.5)
         self.assertEqual(self.tv.blurb, 'Blurb for some alternate tv series or episode with a name like Archer.')
+        # the chosen search result, so refresh_ratings refreshes the title from it
+        self.assertEqual(self.tv.title_url, 'http://example.com')
         self.assertEqual(self.tv.type, IMDBTitleSearchData.TV)
         self.assertEqual(self.tv.find_results, '<ul><li><a href="https://www.imdb.com//title/tt1486217/">Archer (2009) (TV Series)</a></li>\n<li><a href="https://www.imdb.com//title/tt0060490/">Harper (1966) aka "Archer"</a></li>\n</ul>')
         self.assertEqual(self.tv.file_path, '/Volumes/dr-wd-2/tv/Archer')
@@ -126,8 +136,32 @@ class IMDBTitleSearchDataTests(TestCase):
         # less performance hit
         # note that this needs to be set here so the tv image path is the updated path
         os.remove(self.tv.image.path)
+        remove_thumbnails(Path(self.tv.image.path))
         os.remove(self.movie.image.path)
 
+    @patch('imdb_info_local.views.imdb_title_data')
+    def test_update_title_data_not_modified(self, imdb_title_data_mock):
+        """Stored validators are sent for the same title url, and nothing changes on a 304."""
+        imdb_title_data_mock.return_value = None
+        self.tv.title_url = 'https://www.imdb.com/title/tt1486217/'
+        self.tv.etag = '"archer"'
+        self.tv.save()
+        post_data = {
+            'post_data': {
+                'title': 'Archer',
+                'url': 'https://www.imdb.com/title/tt1486217/',
+                'video_type': 'TV'
+            }
+        }
+        response = self.client.post(reverse('title_update'),
+                                    data=post_data,
+                                    content_type='application/json')
+        imdb_title_data_mock.assert_called_once_with('https://www.imdb.com/title/tt1486217/',
+                                                     Validators(etag='"archer"'))
+        self.assertEqual(response.json()['rating'], 8.6)
+        self.tv.refresh_from_db()
+        self.assertEqual(self.tv.blurb, 'Covert black ops and espionage take a back seat to zany personalities and relationships between secret agents and drones.')
+
     def test_update_title_data_nonexistent(self):
         post_data = {
             'post_data': {
@@ -175,4 +209,124 @@ class IMDBTitleSearchDataTests(TestCase):
             update_image_file(self.title_no_info, DATA_DIR / 'archer.jpg')
         except Exception as e:
             print(f'exception: {e}')
-            self.fail('update_image_file did not handle image value of None with valid local image')
\ No newline at end of file
+            self.fail('update_image_file did not handle image value of None with valid local image')
+
+class StoredImageFileTests(TestCase):
+    """Images downloaded straight into media storage are used in place."""
+
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.settings_override = self.settings(MEDIA_ROOT=self.media_root)
+        self.settings_override.enable()
+        self.image_dir = Path(self.media_root) / IMAGE_SUBDIRECTORY
+        self.image_dir.mkdir()
+        self.archer_path = self.image_dir / 'tt1486217.jpg'
+        shutil.copyfile(DATA_DIR / 'archer.jpg', self.archer_path)
+        self.title_kwargs = dict(rating=8.6, blurb='', type=IMDBTitleSearchData.TV, find_results='<ul></ul>',
+                                 file_mtime=1604372147, file_ctime=1604372147)
+        self.archer = IMDBTitleSearchData.objects.create(title='Archer', file_path='/tv/Archer', **self.title_kwargs)
+
+    def tearDown(self):
+        self.settings_override.disable()
+        shutil.rmtree(self.media_root)
+
+    def test_add_stored_image_file(self):
+        add_image_file(self.archer, self.archer_path)
+        self.archer.refresh_from_db()
+        self.assertEqual(self.archer.image.name, 'title-images/tt1486217.jpg')
+        self.assertEqual(sorted(self.image_dir.iterdir()), sorted([self.archer_path, *thumbnail_paths(self.archer_path)]))
+
+    def test_update_to_same_stored_image_keeps_file(self):
+        add_image_file(self.archer, self.archer_path)
+        update_image_file(self.archer, self.archer_path)
+        self.assertTrue(self.archer_path.exists())
+        self.assertEqual(self.archer.image.name, 'title-images/tt1486217.jpg')
+
+    def test_update_keeps_image_used_by_another_title(self):
+        archer_2 = IMDBTitleSearchData.objects.create(title='Archer 2009', file_path='/tv2/Archer 2009',
+                                                      **self.title_kwargs)
+        add_image_file(self.archer, self.archer_path)
+        add_image_file(archer_2, self.archer_path)
+        corporation_path = self.image_dir / 'tt0379225.jpg'
+        shutil.copyfile(DATA_DIR / 'the-corporation.jpg', corporation_path)
+        with self.captureOnCommitCallbacks(execute=True):
+            update_image_file(archer_2, corporation_path)
+        self.assertTrue(self.archer_path.exists())
+        with self.captureOnCommitCallbacks(execute=True):
+            update_image_file(self.archer, corporation_path)
+        self.assertFalse(self.archer_path.exists())
+
+    def test_update_keeps_old_image_until_saved(self):
+        add_image_file(self.archer, self.archer_path)
+        corporation_path = self.image_dir / 'tt0379225.jpg'
+        shutil.copyfile(DATA_DIR / 'the-corporation.jpg', corporation_path)
+        with self.captureOnCommitCallbacks(execute=True), self.assertRaises(DatabaseError), \
+                patch.object(IMDBTitleSearchData, 'save', side_effect=DatabaseError):
+            update_image_file(self.archer, corporation_path)
+        self.assertTrue(self.archer_path.exists())
+        self.archer.refresh_from_db()
+        old_image = update_image_file(self.archer, corporation_path, save=False)
+        self.assertEqual(old_image, 'title-images/tt1486217.jpg')
+        self.assertTrue(self.archer_path.exists())
+        self.archer.save()
+        release_images([old_image])
+        self.assertFalse(self.archer_path.exists())
+
+    def test_local_images_stored_once_by_content(self):
+        archer_2 = IMDBTitleSearchData.objects.create(title='Archer 2009', file_path='/tv2/Archer 2009',
+                                                      **self.title_kwargs)
+        add_image_file(self.archer, DATA_DIR / 'archer.jpg')
+        add_image_file(archer_2, DATA_DIR / 'archer.jpg')
+        stored_path = self.image_dir / f'{hash_file(DATA_DIR / "archer.jpg")}.jpg'
+        self.assertEqual(self.archer.image.name, f'title-images/{stored_path.name}')
+        self.assertEqual(archer_2.image.name, self.archer.image.name)
+        self.assertEqual(stored_path.read_bytes(), (DATA_DIR / 'archer.jpg').read_bytes())
+
+    def test_update_to_same_image_content_is_noop(self):
+        add_image_file(self.archer, DATA_DIR / 'archer.jpg')
+        stored_path = Path(self.archer.image.path)
+        mtime = stored_path.stat().st_mtime_ns
+        with patch.object(IMDBTitleSearchData, 'save') as save_mock:
+            update_image_file(self.archer, DATA_DIR / 'archer.jpg')
+        self.assertFalse(save_mock.called)
+        self.assertEqual(stored_path.stat().st_mtime_ns, mtime)
+
+    def test_release_images_keeps_images_in_use(self):
+        archer_2 = IMDBTitleSearchData.objects.create(title='Archer 2009', file_path='/tv2/Archer 2009',
+                                                      **self.title_kwargs)
+        add_image_file(self.archer, self.archer_path)
+        add_image_file(archer_2, self.archer_path)
+        self.archer.delete()
+        release_images([self.archer.image.name])
+        self.assertTrue(self.archer_path.exists())
+        archer_2.delete()
+        release_images([archer_2.image.name])
+        self.assertEqual(list(self.image_dir.iterdir()), [])
+
+    def test_gc_images_deletes_orphaned_images_and_thumbnails(self):
+        add_image_file(self.archer, self.archer_path)
+        orphan_path = self.image_dir / 'tt0379225.jpg'
+        add_image_file(IMDBTitleSearchData.objects.create(title='Corporation', file_path='/movies/Corporation',
+                                                          **self.title_kwargs),
+                       DATA_DIR / 'the-corporation.jpg')
+        IMDBTitleSearchData.objects.filter(title='Corporation').update(image='')
+        shutil.copyfile(DATA_DIR / 'the-corporation.jpg', orphan_path)
+        (self.image_dir / '.download-tt0379225-1.jpg').touch()
+        in_use = {self.archer_path, *thumbnail_paths(self.archer_path)}
+        self.assertEqual(set(orphaned_image_files(min_age=0)) & in_use, set())
+        self.assertEqual(len(orphaned_image_files(min_age=0)), 6)
+        self.assertEqual(orphaned_image_files(min_age=3600), [])
+
+        call_command('gc_images', '--min-age', '0', '--batch-size', '2', stdout=StringIO())
+        self.assertEqual(set(self.image_dir.iterdir()), in_use | {self.image_dir / '.download-tt0379225-1.jpg'})
+
+    def test_gc_images_keeps_thumbnails_of_images_used_again(self):
+        add_image_file(self.archer, self.archer_path)
+        IMDBTitleSearchData.objects.filter(pk=self.archer.pk).update(image='')
+        orphans = orphaned_image_files(min_age=0)
+        self.assertEqual(set(orphans), {self.archer_path, *thumbnail_paths(self.archer_path)})
+        # a title uses the image again before the orphans are deleted
+        IMDBTitleSearchData.objects.filter(pk=self.archer.pk).update(image=self.archer.image.name)
+        # thumbnails alone in a batch are still matched to their image
+        self.assertEqual(remove_image_files([path for path in orphans if path != self.archer_path], 2), 0)
+        self.assertEqual(set(self.image_dir.iterdir()), set(orphans))
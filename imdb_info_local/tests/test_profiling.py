@@ -0,0 +1,95 @@
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+import pstats
+import shutil
+import tempfile
+from unittest.mock import patch
+
+from django.core.management import call_command
+from django.test import SimpleTestCase, TestCase
+from django.urls import reverse
+
+from imdb_info_local.imdb_async import AsyncScrapeExecutor
+from imdb_info_local.profiling import CPROFILE, PROFILE_HEADER, Profile, profile_path
+
+
+def busy_worker():
+    return sum(i * i for i in range(1000))
+
+
+async def busy_coroutine(client):
+    return busy_worker()
+
+
+class ProfileTests(SimpleTestCase):
+
+    def setUp(self):
+        self.temp_dir = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, self.temp_dir)
+
+    def test_profile_path(self):
+        self.assertEqual(profile_path(Path('run'), 'cprofile'), Path('run.prof'))
+        self.assertEqual(profile_path(Path('run'), 'sampling'), Path('run.speedscope.json'))
+        self.assertEqual(profile_path(Path('run.out'), 'cprofile'), Path('run.out'))
+
+    def test_cprofile_includes_worker_threads(self):
+        with Profile(CPROFILE, threads=True) as profile:
+            with ThreadPoolExecutor(max_workers=2) as executor:
+                list(executor.map(lambda _: busy_worker(), range(4)))
+        path = profile.write(self.temp_dir / 'run')
+        self.assertEqual(path, self.temp_dir / 'run.prof')
+        functions = [function for _, _, function in pstats.Stats(str(path)).stats]
+        self.assertIn('busy_worker', functions)
+
+    def test_cprofile_includes_async_engine_loop_thread(self):
+        with Profile(CPROFILE, threads=True) as profile:
+            executor = AsyncScrapeExecutor(max_in_flight=1)
+            try:
+                executor.submit(busy_coroutine).result()
+            finally:
+                executor.shutdown()
+        functions = [function for _, _, function in pstats.Stats(str(profile.write(self.temp_dir / 'run'))).stats]
+        self.assertIn('busy_worker', functions)
+
+    def test_unknown_profiler(self):
+        with self.assertRaises(ValueError):
+            Profile('gprof')
+
+
+class ProfilingMiddlewareTests(TestCase):
+
+    def setUp(self):
+        self.temp_dir = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, self.temp_dir)
+
+    def test_profiles_title_list_with_param(self):
+        with self.settings(IMDB_INFO_LOCAL_PROFILE_VIEWS=True, IMDB_INFO_LOCAL_PROFILE_DIR=str(self.temp_dir)):
+            response = self.client.get(reverse('movie_list'), {'profile': 'cprofile'})
+        self.assertEqual(response.status_code, 200)
+        profile_file = self.temp_dir / response[PROFILE_HEADER]
+        self.assertTrue(profile_file.name.startswith('movie_list-'))
+        functions = [function for _, _, function in pstats.Stats(str(profile_file)).stats]
+        self.assertIn('get_queryset', functions)
+
+    def test_off_by_default_and_without_param(self):
+        with self.settings(IMDB_INFO_LOCAL_PROFILE_DIR=str(self.temp_dir)):
+            response = self.client.get(reverse('tv_list'), {'profile': 'cprofile'})
+            self.assertNotIn(PROFILE_HEADER, response)
+            with self.settings(IMDB_INFO_LOCAL_PROFILE_VIEWS=True):
+                response = self.client.get(reverse('tv_list'))
+                self.assertNotIn(PROFILE_HEADER, response)
+                response = self.client.get(reverse('home'), {'profile': 'cprofile'})
+                self.assertNotIn(PROFILE_HEADER, response)
+        self.assertEqual(list(self.temp_dir.iterdir()), [])
+
+
+class RunScraperProfileTests(TestCase):
+
+    @patch('imdb_info_local.management.commands.run_scraper.process_directory', return_value=[])
+    def test_profile(self, process_directory_mock):
+        temp_dir = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, temp_dir)
+        call_command('run_scraper', '-d', str(temp_dir), '-t', 'TV', '--profile', str(temp_dir / 'run'),
+                     '--profiler', 'cprofile')
+        functions = [function for _, _, function in pstats.Stats(str(temp_dir / 'run.prof')).stats]
+        self.assertIn('scrape', functions)
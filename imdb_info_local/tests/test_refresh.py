@@ -0,0 +1,116 @@
+from datetime import timedelta
+from importlib import import_module
+from io import StringIO
+from unittest.mock import patch
+
+from django.apps import apps
+from django.core.management import call_command
+from django.test import SimpleTestCase, TestCase
+from django.utils import timezone
+
+from imdb_info_local import metrics
+from imdb_info_local.cache import CacheMiss
+from imdb_info_local.http_client import Validators
+from imdb_info_local.http_policy import RetriesExhausted
+from imdb_info_local.imdb import IMDBTitleData
+from imdb_info_local.models import IMDBTitleSearchData
+from imdb_info_local.refresh import DAY, REQUEST_BUDGET, TIME_BUDGET, refresh_ratings, stalest_titles, staleness
+
+
+class StalenessTests(SimpleTestCase):
+
+    def test_staleness(self):
+        now = 1700000000
+        long_added = now - 1000 * DAY
+        self.assertGreater(staleness(now - 60 * DAY, long_added, now), staleness(now - 30 * DAY, long_added, now))
+        # the same age, but one added recently
+        self.assertGreater(staleness(now - 30 * DAY, now - DAY, now), staleness(now - 30 * DAY, long_added, now))
+        self.assertGreater(staleness(None, long_added, now), staleness(now - 300 * DAY, long_added, now))
+
+
+def fetched(title_url, validators):
+    # the title page and its image
+    metrics.inc('requests', 2)
+    return IMDBTitleData(9.1, 'New blurb.', None, title_url=title_url, validators=Validators(etag='"new"'))
+
+
+class RefreshRatingsTests(TestCase):
+
+    def setUp(self):
+        now = timezone.now()
+        self.titles = {}
+        for title, days_ago in (('Archer', 100), ('American Dad', 20), ('Avenue 5', None), ('Fresh', 1)):
+            self.titles[title] = IMDBTitleSearchData.objects.create(
+                title=title, type='TV', rating=7.0, blurb='Old blurb.', find_results='', file_path=f'/tv/{title}',
+                file_mtime=int((now - timedelta(days=1000)).timestamp()), file_ctime=0,
+                title_url=f'https://www.imdb.com/title/tt{len(self.titles)}/', etag='"old"',
+                last_scraped=now - timedelta(days=days_ago) if days_ago else None)
+        IMDBTitleSearchData.objects.create(title='No Url', type='TV', rating=7.0, blurb='', find_results='',
+                                           file_path='/tv/No-Url', file_mtime=0, file_ctime=0)
+
+    def test_stalest_titles(self):
+        self.assertEqual(stalest_titles(10), [self.titles[title].pk for title in ('Avenue 5', 'Archer', 'American Dad')])
+
+    def test_title_url_backfilled_for_titles_scraped_before_it_was_stored(self):
+        find_results = ('<ul><li><a href="https://www.imdb.com/title/tt0000009/">Old (2001)</a></li>\n'
+                        '<li><a href="https://www.imdb.com/title/tt0000010/">Older (1999)</a></li>\n</ul>')
+        kwargs = dict(type='TV', rating=7.0, blurb='', find_results=find_results, file_mtime=0, file_ctime=0)
+        old_title = IMDBTitleSearchData.objects.create(title='Old', file_path='/tv/Old',
+                                                       image='title-images/tt0000009.jpg', **kwargs)
+        no_blurb = IMDBTitleSearchData.objects.create(
+            title='No Blurb', file_path='/tv/No-Blurb', **{**kwargs, 'blurb': (
+                'No blurb for title_url: <a href="https://www.imdb.com/title/tt0000009/">'
+                'https://www.imdb.com/title/tt0000009/</a>')})
+        # updated from the second search result in the title list
+        corrected = IMDBTitleSearchData.objects.create(title='Corrected', file_path='/tv/Corrected',
+                                                       image='title-images/tt0000010.jpg', **kwargs)
+        unknown = IMDBTitleSearchData.objects.create(title='Unknown', file_path='/tv/Unknown', **kwargs)
+        self.assertNotIn(old_title.pk, stalest_titles(10))
+        migration = import_module('imdb_info_local.migrations.0010_backfill_title_url')
+        migration.backfill_title_url(apps, None)
+        title_urls = dict(IMDBTitleSearchData.objects.filter(
+            pk__in=[old_title.pk, no_blurb.pk, corrected.pk, unknown.pk]).values_list('title', 'title_url'))
+        self.assertEqual(title_urls, {'Old': 'https://www.imdb.com/title/tt0000009/',
+                                      'No Blurb': 'https://www.imdb.com/title/tt0000009/',
+                                      'Corrected': '', 'Unknown': ''})
+        self.assertEqual(IMDBTitleSearchData.objects.get(title='No Url').title_url, '')
+        self.assertIn(old_title.pk, stalest_titles(10))
+        self.assertNotIn(corrected.pk, stalest_titles(10))
+
+    @patch('imdb_info_local.refresh.imdb_title_data', side_effect=fetched)
+    def test_refresh_within_request_budget(self, title_data_mock):
+        result = refresh_ratings(max_requests=3, workers=1)
+        self.assertEqual((result.refreshed, result.requests, result.stopped), (2, 4, REQUEST_BUDGET))
+        self.assertEqual([call.args[0] for call in title_data_mock.call_args_list],
+                         [self.titles['Avenue 5'].title_url, self.titles['Archer'].title_url])
+        title_data_mock.assert_any_call(self.titles['Archer'].title_url, Validators(etag='"old"'))
+        archer = IMDBTitleSearchData.objects.get(title='Archer')
+        self.assertEqual((archer.rating, archer.blurb, archer.etag), (9.1, 'New blurb.', '"new"'))
+        self.assertGreater(archer.last_scraped, timezone.now() - timedelta(minutes=1))
+        self.assertEqual(IMDBTitleSearchData.objects.get(title='American Dad').rating, 7.0)
+
+    @patch('imdb_info_local.refresh.imdb_title_data')
+    def test_not_modified_and_failed(self, title_data_mock):
+        title_data_mock.side_effect = [None, RetriesExhausted('url', '503 response'), None]
+        result = refresh_ratings(workers=1)
+        self.assertEqual((result.refreshed, result.not_modified, result.failed), (0, 2, 1))
+        american_dad = IMDBTitleSearchData.objects.get(title='American Dad')
+        self.assertEqual(american_dad.rating, 7.0)
+        self.assertGreater(american_dad.last_scraped, timezone.now() - timedelta(minutes=1))
+        # failed, so still stale
+        self.assertLess(IMDBTitleSearchData.objects.get(title='Archer').last_scraped,
+                        timezone.now() - timedelta(days=99))
+
+    @patch('imdb_info_local.refresh.imdb_title_data')
+    def test_not_cached(self, title_data_mock):
+        title_data_mock.side_effect = [CacheMiss('url'), None, None]
+        result = refresh_ratings(workers=1)
+        self.assertEqual((result.not_modified, result.failed), (2, 1))
+        self.assertIsNone(IMDBTitleSearchData.objects.get(title='Avenue 5').last_scraped)
+
+    @patch('imdb_info_local.refresh.imdb_title_data', side_effect=fetched)
+    def test_time_budget(self, title_data_mock):
+        out = StringIO()
+        call_command('refresh_ratings', '--max-time', '0', stdout=out)
+        title_data_mock.assert_not_called()
+        self.assertIn(f'stopped: {TIME_BUDGET}', out.getvalue())
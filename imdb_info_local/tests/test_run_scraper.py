@@ -1,8 +1,10 @@
+import asyncio
 import shutil
 from pathlib import Path
 from shutil import rmtree
-from unittest.mock import patch, call, Mock
+from unittest.mock import patch, call, Mock, MagicMock, AsyncMock
 import os
+import tempfile
 
 from django.test import TestCase, SimpleTestCase
 from django.core.management import call_command
@@ -12,8 +14,13 @@ from imdb_info_local.imdb import IMDBTitleData, IMDBFindTitleResult
 from imdb_info_local.models import IMDBTitleSearchData, NONEXISTENT_PATH
 from imdb_info_local.management.commands.run_scraper import (
     IMDBTitleSearchResults, get_imdb_title_data, find_results_html,
-    remove_title_data_for_deleted_files, process_directory
+    remove_title_data_for_deleted_files, process_directory, get_imdb_title_data_async,
+    DEFAULT_WORKERS, DEFAULT_ENGINE
 )
+from imdb_info_local.imdb_async import AsyncHTTPClient
+from imdb_info_local.http_client import FetchResult
+from imdb_info_local.cache import CacheMiss
+from imdb_info_local.http_policy import RetriesExhausted
 from .nondb_fixtures import (
     archer_title_data, archer_find_title_result,
 )
@@ -54,13 +61,54 @@ class RunScraperNoDBTests(SimpleTestCase):
         self.assertEqual(expected.title_data, actual.title_data)
         self.assert_(not title_data_mock.called)
 
+    @patch('imdb_info_local.http_client.http_get')
+    def test_sync_and_async_engines_produce_same_results(self, http_get_mock):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        settings_override = self.settings(IMDB_INFO_LOCAL_CACHE_DIR=None, MEDIA_ROOT=media_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        fixture_for_url = {
+            'https://www.imdb.com/find?q=Archer': 'imdb-search-archer.html',
+            'https://www.imdb.com/title/tt1486217/': 'archer-title-page.html',
+        }
+
+        def fixture_bytes(url, kind=None):
+            filename = fixture_for_url.get(url, 'archer.jpg')
+            return DATA_DIR.joinpath(filename).read_bytes()
+
+        def response(url, **kwargs):
+            content = fixture_bytes(url)
+            r = MagicMock(status_code=200, content=content, headers={})
+            r.__enter__.return_value = r
+            r.iter_content.return_value = [content]
+            return r
+
+        def fetch_to_file(url, kind, path, mode=None):
+            path.write_bytes(fixture_bytes(url))
+            return True
+
+        http_get_mock.side_effect = response
+        sync_results = get_imdb_title_data('Archer')
+
+        client = AsyncHTTPClient()
+        with patch.object(client, 'fetch', AsyncMock(side_effect=lambda url, kind, parser=None, validators=None: FetchResult(fixture_bytes(url)))), \
+                patch.object(client, 'fetch_to_file', AsyncMock(side_effect=fetch_to_file)):
+            async_results = asyncio.run(get_imdb_title_data_async(client, 'Archer'))
+
+        self.assertEqual(sync_results.title, async_results.title)
+        self.assertEqual(sync_results.find_results, async_results.find_results)
+        self.assertEqual(sync_results.title_data, async_results.title_data)
+        self.assertEqual(async_results.find_results[0], archer_find_title_result)
+        self.assertEqual(async_results.title_data.rating, archer_title_data.rating)
+
     def test_find_results_html(self):
         expected = '<ul><li><a href="https://www.imdb.com/title/tt1486217/">Archer (2009) (TV Series)</a></li>\n</ul>'
         self.assertEqual(find_results_html([archer_find_title_result]), expected)
 
-    @patch('imdb_info_local.management.commands.run_scraper.remove_title_data_for_deleted_files')
-    @patch('imdb_info_local.management.commands.run_scraper.process_directory')
-    def test_command_call(self, process_directory_mock, remove_deleted_files_mock):
+    @patch('imdb_info_local.management.commands.run_scraper.prune_journal', return_value=0)
+    @patch('imdb_info_local.management.commands.run_scraper.reconcile_directories')
+    def test_command_call(self, reconcile_directories_mock, prune_journal_mock):
         """Ensure the commmand works"""
         video_dirs_settings = {
             'TV': ['/path/to/tv'],
@@ -68,12 +116,10 @@ class RunScraperNoDBTests(SimpleTestCase):
         }
         with self.settings(IMDB_INFO_LOCAL_VIDEO_DIRS=video_dirs_settings):
             call_command('run_scraper')
-            self.assertSequenceEqual(remove_deleted_files_mock.call_args_list,
-                             [call(Path(settings.IMDB_INFO_LOCAL_VIDEO_DIRS['Movies'][0]), 'MO'),
-                              call(Path(settings.IMDB_INFO_LOCAL_VIDEO_DIRS['TV'][0]), 'TV')])
-            self.assertSequenceEqual(process_directory_mock.call_args_list,
-                                     [call(Path(settings.IMDB_INFO_LOCAL_VIDEO_DIRS['Movies'][0]), 'MO'),
-                                      call(Path(settings.IMDB_INFO_LOCAL_VIDEO_DIRS['TV'][0]), 'TV')])
+            reconcile_directories_mock.assert_called_once_with(
+                [(Path(settings.IMDB_INFO_LOCAL_VIDEO_DIRS['Movies'][0]), 'MO'),
+                 (Path(settings.IMDB_INFO_LOCAL_VIDEO_DIRS['TV'][0]), 'TV')],
+                DEFAULT_WORKERS, DEFAULT_ENGINE)
 
 
 fleabag_search_results = [IMDBFindTitleResult(img_url='https://m.media-amazon.com/images/M/MV5BMjA4MzU5NzQxNV5BMl5BanBnXkFtZTgwOTg3MDA5NzM@._V1_UX32_CR0,0,32,44_AL_.jpg', title_url='https://www.imdb.com/title/tt5687612/', text='Fleabag (2016) (TV Series)'),
@@ -108,8 +154,7 @@ class RunScraperTests(TestCase):
         if movie_dir.is_dir():
             rmtree(movie_dir)
 
-    @patch('imdb_info_local.management.commands.run_scraper.time.sleep')
-    def test_process_dir_tv_title_already_exists(self, time_sleep_mock):
+    def test_process_dir_tv_title_already_exists(self):
         """Ensure title is not inserted if we have same title and type."""
         # This system expects unique titles for each type - movies and tv
         # ie there can't be two movies with the same title
@@ -123,9 +168,8 @@ class RunScraperTests(TestCase):
         self.assertEqual(IMDBTitleSearchData.objects.filter(title='Archer')[0], self.archer)
         self.assertSequenceEqual(added, [])
 
-    @patch('imdb_info_local.management.commands.run_scraper.time.sleep')
     @patch('imdb_info_local.management.commands.run_scraper.get_imdb_title_data')
-    def test_process_dir_tv_new_title(self, get_imdb_title_data_mock, time_sleep_mock):
+    def test_process_dir_tv_new_title(self, get_imdb_title_data_mock):
         get_imdb_title_data_mock.return_value = IMDBTitleSearchResults(
             title='Fleabag',
             find_results=fleabag_search_results,
@@ -146,9 +190,8 @@ class RunScraperTests(TestCase):
         self.assertEqual(fleabag.blurb, 'A comedy series adapted from the award-winning play about a young woman trying to cope with life in London whilst coming to terms with a recent tragedy.')
         self.assertSequenceEqual(added, ['Fleabag'])
 
-    @patch('imdb_info_local.management.commands.run_scraper.time.sleep')
     @patch('imdb_info_local.management.commands.run_scraper.get_imdb_title_data')
-    def test_process_dir_movie_where_title_exists_for_tv(self, get_imdb_title_data_mock, time_sleep_mock):
+    def test_process_dir_movie_where_title_exists_for_tv(self, get_imdb_title_data_mock):
         """Ensure we insert a movie if there is the same title tv show,
         but we do not insert a tv show if there is one with the same name
         """
@@ -229,6 +272,13 @@ class MultipleDirectoriesTestNoDB(SimpleTestCase):
     ]
 
     def setUp(self) -> None:
+        # title data and the journal are saved in a transaction, which needs the db
+        save_patcher = patch('imdb_info_local.management.commands.run_scraper.save_title_data')
+        self.save_title_data_mock = save_patcher.start()
+        self.addCleanup(save_patcher.stop)
+        journal_patcher = patch('imdb_info_local.management.commands.run_scraper.journal_titles', return_value={})
+        journal_patcher.start()
+        self.addCleanup(journal_patcher.stop)
         for dirpath in (self.tv_dir_1, self.tv_dir_2, self.movie_dir_1):
             dirpath.mkdir(parents=True)
         for name in self.tv_dir_names[:2]:
@@ -241,24 +291,78 @@ class MultipleDirectoriesTestNoDB(SimpleTestCase):
     def tearDown(self) -> None:
         shutil.rmtree(self.tempdir)
 
-    @patch('imdb_info_local.management.commands.run_scraper.time.sleep')
     @patch('imdb_info_local.management.commands.run_scraper.get_imdb_title_data')
     @patch('imdb_info_local.management.commands.run_scraper.add_image_file')
     @patch('imdb_info_local.management.commands.run_scraper.IMDBTitleSearchData')
-    def test_process_directory_w_multiple_titles(self, TitleSearchDataMock, add_image_file_mock, get_imdb_title_data_mock,
-               time_sleep_mock):
+    def test_process_directory_w_multiple_titles(self, TitleSearchDataMock, add_image_file_mock, get_imdb_title_data_mock):
         # os.system(f'find {self.tempdir} -print')
         # os.system(f'tree {self.tempdir}')
         with self.settings(IMDB_INFO_LOCAL_VIDEO_DIRS=self.video_dirs_settings):
             # print(f'IMDB_INFO_LOCAL_VIDEO_DIRS:\n{settings.IMDB_INFO_LOCAL_VIDEO_DIRS}')
             TitleSearchDataMock.mock_add_spec(IMDBTitleSearchData)
-            TitleSearchDataMock.objects.filter.return_value = False
+            TitleSearchDataMock.objects.filter.return_value.values_list.return_value = []
             added_titles = process_directory(self.movie_dir_1)
             self.assertSequenceEqual(added_titles,
                                      ['A Girl Walks Home Alone At Night 2014', 'Absolutely Fabulous the Movie 2016'])
             # call_args will only contain the args from the last call of the mock
             self.assert_(TitleSearchDataMock.call_args.kwargs['title'] == 'Absolutely Fabulous the Movie 2016')
 
+    @patch('imdb_info_local.management.commands.run_scraper.get_imdb_title_data')
+    @patch('imdb_info_local.management.commands.run_scraper.add_image_file')
+    @patch('imdb_info_local.management.commands.run_scraper.IMDBTitleSearchData')
+    def test_process_directory_w_multiple_workers(self, TitleSearchDataMock, add_image_file_mock,
+                                                  get_imdb_title_data_mock):
+        """Titles are scraped concurrently but still added in directory order."""
+        TitleSearchDataMock.objects.filter.return_value.values_list.return_value = []
+        added_titles = process_directory(self.tv_dir_2, 'TV', workers=2)
+        self.assertSequenceEqual(added_titles, [d.name.replace('-', ' ') for d in self.tv_dir_2.iterdir()])
+        self.assertEqual(get_imdb_title_data_mock.call_count, 2)
+        # one query for the titles in the db, and both titles saved in one batch
+        TitleSearchDataMock.objects.filter.assert_called_once_with(type='TV')
+        self.assertEqual(TitleSearchDataMock.call_count, 2)
+        self.save_title_data_mock.assert_called_once()
+
+    @patch('imdb_info_local.management.commands.run_scraper.get_imdb_title_data')
+    @patch('imdb_info_local.management.commands.run_scraper.add_image_file')
+    @patch('imdb_info_local.management.commands.run_scraper.IMDBTitleSearchData')
+    def test_process_directory_skips_titles_when_retries_exhausted(self, TitleSearchDataMock, add_image_file_mock,
+                                                                   get_imdb_title_data_mock):
+        def title_data(title, checkpoint):
+            if title.startswith('A Girl'):
+                raise RetriesExhausted('https://www.imdb.com/find?q=A+Girl', '503 response')
+            return MagicMock()
+        get_imdb_title_data_mock.side_effect = title_data
+        TitleSearchDataMock.objects.filter.return_value.values_list.return_value = []
+        added_titles = process_directory(self.movie_dir_1, workers=2)
+        self.assertSequenceEqual(added_titles, ['Absolutely Fabulous the Movie 2016'])
+        self.assertEqual(TitleSearchDataMock.call_count, 1)
+
+    @patch('imdb_info_local.management.commands.run_scraper.get_imdb_title_data')
+    @patch('imdb_info_local.management.commands.run_scraper.add_image_file')
+    @patch('imdb_info_local.management.commands.run_scraper.IMDBTitleSearchData')
+    def test_process_directory_skips_titles_not_cached(self, TitleSearchDataMock, add_image_file_mock,
+                                                       get_imdb_title_data_mock):
+        def title_data(title, checkpoint):
+            if title.startswith('Absolutely'):
+                raise CacheMiss('https://www.imdb.com/find?q=Absolutely+Fabulous')
+            return MagicMock()
+        get_imdb_title_data_mock.side_effect = title_data
+        TitleSearchDataMock.objects.filter.return_value.values_list.return_value = []
+        added_titles = process_directory(self.movie_dir_1, workers=2)
+        self.assertSequenceEqual(added_titles, ['A Girl Walks Home Alone At Night 2014'])
+        self.assertEqual(TitleSearchDataMock.call_count, 1)
+
+    @patch('imdb_info_local.management.commands.run_scraper.get_imdb_title_data_async', new_callable=AsyncMock)
+    @patch('imdb_info_local.management.commands.run_scraper.add_image_file')
+    @patch('imdb_info_local.management.commands.run_scraper.IMDBTitleSearchData')
+    def test_process_directory_async_engine(self, TitleSearchDataMock, add_image_file_mock,
+                                            get_imdb_title_data_async_mock):
+        TitleSearchDataMock.objects.filter.return_value.values_list.return_value = []
+        added_titles = process_directory(self.movie_dir_1, 'MO', workers=8, engine='async')
+        self.assertSequenceEqual(added_titles,
+                                 ['A Girl Walks Home Alone At Night 2014', 'Absolutely Fabulous the Movie 2016'])
+        self.assertEqual([c.args[1] for c in get_imdb_title_data_async_mock.call_args_list], added_titles)
+
 
 class MultipleDirectoriesTest(TestCase):
     """Integration test - scrapes IMDB for 2 titles - so could fail due to network issues, etc.
@@ -0,0 +1,229 @@
+from pathlib import Path
+import os
+import shutil
+import tempfile
+import threading
+from unittest.mock import patch, ANY
+
+from django.test import TestCase, SimpleTestCase, override_settings
+
+from imdb_info_local.imdb import IMDBTitleData
+from imdb_info_local.models import IMDBTitleSearchData, NONEXISTENT_PATH
+from imdb_info_local.scan import (RootManifest, TitleDirectory, scan_root, scan_roots, diff_scan, load_manifest,
+                                  save_manifest, clear_manifests)
+from imdb_info_local.management.commands.run_scraper import (process_directories_incrementally, reconcile,
+                                                             reconcile_directories, IMDBTitleSearchResults)
+
+
+def touch_dir(path: Path, mtime: int):
+    os.utime(path, (mtime, mtime))
+
+
+class ManifestTests(SimpleTestCase):
+
+    def setUp(self):
+        self.temp_dir = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, self.temp_dir)
+        self.root = self.temp_dir / 'tv'
+        for name in ('Archer', 'American-Dad'):
+            (self.root / name).mkdir(parents=True)
+        touch_dir(self.root, 1000)
+        settings_override = override_settings(IMDB_INFO_LOCAL_MANIFEST_DIR=str(self.temp_dir / 'manifests'))
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def test_save_and_load(self):
+        self.assertIsNone(load_manifest(self.root, 'TV'))
+        manifest = RootManifest(str(self.root), 'TV', 1, {'Archer': 2})
+        save_manifest(manifest)
+        self.assertEqual(load_manifest(self.root, 'TV'), manifest)
+        self.assertIsNone(load_manifest(self.root, 'MO'))
+        clear_manifests()
+        self.assertIsNone(load_manifest(self.root, 'TV'))
+
+    def manifest_for(self, scan) -> RootManifest:
+        return RootManifest(str(self.root), 'TV', scan.mtime_ns, {entry.name: entry.mtime_ns for entry in scan.entries})
+
+    def test_unchanged_root_is_not_listed(self):
+        scan = scan_root(self.root, 'TV')
+        self.assertEqual(sorted(entry.name for entry in diff_scan(scan, RootManifest(str(self.root), 'TV')).added),
+                         ['American-Dad', 'Archer'])
+        with patch('imdb_info_local.scan.os.scandir') as scandir_mock:
+            scan = scan_root(self.root, 'TV', self.manifest_for(scan))
+        scandir_mock.assert_not_called()
+        self.assertIsNone(scan.entries)
+        self.assertIsNone(diff_scan(scan, self.manifest_for(scan_root(self.root, 'TV'))))
+
+    def test_diff_of_changed_root(self):
+        manifest = self.manifest_for(scan_root(self.root, 'TV'))
+        (self.root / 'Archer').rmdir()
+        (self.root / 'Avenue-5-2020').mkdir()
+        touch_dir(self.root / 'American-Dad', 2000)
+        touch_dir(self.root, 2000)
+        diff = diff_scan(scan_root(self.root, 'TV', manifest), manifest)
+        self.assertEqual(([entry.name for entry in diff.added], diff.removed, [entry.name for entry in diff.changed]),
+                         (['Avenue-5-2020'], ['Archer'], ['American-Dad']))
+
+
+class ScanTests(SimpleTestCase):
+
+    def setUp(self):
+        self.temp_dir = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, self.temp_dir)
+        self.root = self.temp_dir / 'movies'
+        (self.root / 'Tenet-2020').mkdir(parents=True)
+        (self.root / 'notes.txt').write_text('not a title')
+        touch_dir(self.root / 'Tenet-2020', 1600000000)
+
+    def test_scan_root(self):
+        scan = scan_root(self.root, 'MO')
+        self.assertTrue(scan.available)
+        self.assertEqual(scan.entries, [TitleDirectory('Tenet-2020', str((self.root / 'Tenet-2020').resolve()),
+                                                       1600000000 * 10 ** 9, scan.entries[0].ctime_ns)])
+        self.assertEqual(scan.entries[0].mtime, 1600000000)
+
+    def test_symlinked_title_directory_is_resolved(self):
+        (self.temp_dir / 'elsewhere' / 'Dune-2021').mkdir(parents=True)
+        (self.root / 'Dune-2021').symlink_to(self.temp_dir / 'elsewhere' / 'Dune-2021')
+        self.assertIn(str((self.temp_dir / 'elsewhere' / 'Dune-2021').resolve()), scan_root(self.root, 'MO').paths)
+
+    def test_scan_roots_keeps_order_and_reports_missing_roots(self):
+        tv_root = self.temp_dir / 'tv'
+        (tv_root / 'Archer').mkdir(parents=True)
+        scans = scan_roots([(self.root, 'MO'), (self.temp_dir / 'unmounted', 'TV'), (tv_root, 'TV')])
+        self.assertEqual([(scan.root, scan.available) for scan in scans],
+                         [(self.root, True), (self.temp_dir / 'unmounted', False), (tv_root, True)])
+        self.assertEqual([entry.name for entry in scans[2].entries], ['Archer'])
+
+    def test_scan_roots_scans_one_device_per_thread(self):
+        roots = [(self.root, 'MO'), (self.root, 'TV')]
+        threads = []
+        with patch('imdb_info_local.scan.title_directories',
+                   side_effect=lambda root: threads.append(threading.current_thread()) or []):
+            scan_roots(roots)
+        # both roots are on the same device, so they are scanned one after another by one worker
+        self.assertEqual(len(threads), 2)
+        self.assertIs(threads[0], threads[1])
+
+
+@patch('imdb_info_local.management.commands.run_scraper.add_image_file')
+@patch('imdb_info_local.management.commands.run_scraper.get_imdb_title_data')
+class IncrementalScanTests(TestCase):
+
+    def setUp(self):
+        self.temp_dir = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, self.temp_dir)
+        self.tv_dir, self.movie_dir = self.temp_dir / 'tv', self.temp_dir / 'movies'
+        for path in (self.tv_dir / 'Archer', self.tv_dir / 'American-Dad', self.movie_dir / 'Tenet-2020'):
+            path.mkdir(parents=True)
+        touch_dir(self.tv_dir, 1000)
+        self.directories = [(self.movie_dir, 'MO'), (self.tv_dir, 'TV')]
+        settings_override = override_settings(IMDB_INFO_LOCAL_MANIFEST_DIR=str(self.temp_dir / 'manifests'))
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def scrape(self, get_imdb_title_data_mock):
+        get_imdb_title_data_mock.side_effect = lambda title, checkpoint: IMDBTitleSearchResults(
+            title, [], IMDBTitleData(8.0, 'blurb', NONEXISTENT_PATH))
+        return process_directories_incrementally(self.directories, workers=1)
+
+    def test_first_run_adds_everything_then_nothing_changes(self, get_imdb_title_data_mock, add_image_file_mock):
+        result = self.scrape(get_imdb_title_data_mock)
+        self.assertEqual((result.removed, sorted(result.added)), ([], ['American Dad', 'Archer', 'Tenet 2020']))
+        get_imdb_title_data_mock.reset_mock()
+        with self.assertNumQueries(0):
+            self.assertFalse(self.scrape(get_imdb_title_data_mock))
+        get_imdb_title_data_mock.assert_not_called()
+
+    def test_only_changes_are_handled(self, get_imdb_title_data_mock, add_image_file_mock):
+        self.scrape(get_imdb_title_data_mock)
+        shutil.rmtree(self.tv_dir / 'Archer')
+        (self.tv_dir / 'Avenue-5-2020').mkdir()
+        touch_dir(self.tv_dir / 'American-Dad', 5000)
+        touch_dir(self.tv_dir, 5000)
+        get_imdb_title_data_mock.reset_mock()
+        result = self.scrape(get_imdb_title_data_mock)
+        self.assertEqual((result.removed, result.added), (['Archer'], ['Avenue 5 2020']))
+        get_imdb_title_data_mock.assert_called_once_with('Avenue 5 2020', ANY)
+        self.assertEqual(IMDBTitleSearchData.objects.get(title='American Dad').file_mtime, 5000)
+
+    def test_skipped_titles_are_retried(self, get_imdb_title_data_mock, add_image_file_mock):
+        with patch('imdb_info_local.management.commands.run_scraper.process_directory', return_value=[]):
+            self.scrape(get_imdb_title_data_mock)
+        result = self.scrape(get_imdb_title_data_mock)
+        self.assertEqual(sorted(result.added), ['American Dad', 'Archer', 'Tenet 2020'])
+
+
+@patch('imdb_info_local.management.commands.run_scraper.update_image_file', return_value=None)
+@patch('imdb_info_local.management.commands.run_scraper.add_image_file')
+@patch('imdb_info_local.management.commands.run_scraper.get_imdb_title_data')
+class ReconcileTests(TestCase):
+
+    def setUp(self):
+        self.temp_dir = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, self.temp_dir)
+        self.drive1, self.drive2 = self.temp_dir / 'drive1', self.temp_dir / 'drive2'
+        for path in (self.drive1 / 'Archer', self.drive1 / 'Tenet-2020', self.drive2):
+            path.mkdir(parents=True)
+        self.directories = [(self.drive1, 'TV'), (self.drive2, 'TV')]
+
+    def scrape(self, get_imdb_title_data_mock):
+        # every Archer directory's top search result is Archer
+        get_imdb_title_data_mock.side_effect = lambda title, checkpoint: IMDBTitleSearchResults(
+            title, [], IMDBTitleData(8.0, 'blurb', NONEXISTENT_PATH, title_url=(
+                'https://www.imdb.com/title/tt1486217/' if title.startswith('Archer')
+                else f'https://www.imdb.com/title/tt{len(title):07d}/')))
+        return reconcile_directories(self.directories, workers=1)
+
+    def test_moved_title_is_updated_without_scraping(self, get_imdb_title_data_mock, *mocks):
+        self.scrape(get_imdb_title_data_mock)
+        archer = IMDBTitleSearchData.objects.get(title='Archer')
+        (self.drive1 / 'Archer').rename(self.drive2 / 'Archer')
+        get_imdb_title_data_mock.reset_mock()
+        result = self.scrape(get_imdb_title_data_mock)
+        self.assertEqual((result.removed, result.moved, result.added), ([], ['Archer'], []))
+        get_imdb_title_data_mock.assert_not_called()
+        archer.refresh_from_db()
+        self.assertEqual(archer.file_path, str((self.drive2 / 'Archer').resolve()))
+
+    def test_renamed_title_keeps_its_title_data(self, get_imdb_title_data_mock, *mocks):
+        self.scrape(get_imdb_title_data_mock)
+        archer = IMDBTitleSearchData.objects.get(title='Archer')
+        shutil.rmtree(self.drive1 / 'Tenet-2020')
+        (self.drive1 / 'Archer').rename(self.drive1 / 'Archer-2009')
+        result = self.scrape(get_imdb_title_data_mock)
+        self.assertEqual((result.removed, result.moved, result.added), (['Tenet 2020'], ['Archer 2009'], []))
+        renamed = IMDBTitleSearchData.objects.get(title='Archer 2009')
+        self.assertEqual(renamed.pk, archer.pk)
+        self.assertEqual(IMDBTitleSearchData.objects.count(), 1)
+
+    def test_deleted_title_is_removed(self, get_imdb_title_data_mock, *mocks):
+        self.scrape(get_imdb_title_data_mock)
+        shutil.rmtree(self.drive1 / 'Tenet-2020')
+        result = self.scrape(get_imdb_title_data_mock)
+        self.assertEqual((result.removed, result.moved, result.added), (['Tenet 2020'], [], []))
+        self.assertFalse(IMDBTitleSearchData.objects.filter(title='Tenet 2020').exists())
+
+    def test_titles_on_unavailable_drive_are_kept(self, get_imdb_title_data_mock, *mocks):
+        self.scrape(get_imdb_title_data_mock)
+        self.drive1.rename(self.temp_dir / 'unmounted')
+        result = self.scrape(get_imdb_title_data_mock)
+        self.assertFalse(result)
+        self.assertEqual(IMDBTitleSearchData.objects.count(), 2)
+
+    def test_reconcile_reads_only_title_data_under_listed_directories(self, *mocks):
+        kwargs = dict(type='TV', rating=8.0, blurb='', find_results='', file_mtime=0, file_ctime=0)
+        # on a drive that isn't listed - its title still keeps a new Archer directory from being added
+        IMDBTitleSearchData.objects.create(title='Archer', file_path='/unmounted/Archer', **kwargs)
+        IMDBTitleSearchData.objects.create(title='Avenue 5', file_path='/unmounted/Avenue-5', **kwargs)
+        # under a listed drive, but a movie
+        IMDBTitleSearchData.objects.create(title='Gone', file_path=str(self.drive1.resolve() / 'Gone'),
+                                           **{**kwargs, 'type': 'MO'})
+        gone = IMDBTitleSearchData.objects.create(title='Gone', file_path=str(self.drive2.resolve() / 'Gone'),
+                                                  **kwargs)
+        scans = scan_roots(self.directories)
+        with self.assertNumQueries(2):
+            reconciliation = reconcile(scans)
+        self.assertEqual([[entry.name for entry in entries] for _, entries in reconciliation.added],
+                         [['Tenet-2020']])
+        self.assertEqual(reconciliation.removed, [gone])
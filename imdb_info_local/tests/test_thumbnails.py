@@ -0,0 +1,104 @@
+from pathlib import Path
+import shutil
+import tempfile
+
+from PIL import Image
+from django.core.management import call_command
+from django.test import TestCase
+from django.urls import reverse
+
+from imdb_info_local.models import IMDBTitleSearchData, IMAGE_SUBDIRECTORY, add_image_file
+from imdb_info_local.thumbnails import (create_thumbnails, ensure_thumbnails, has_thumbnails, image_stem,
+                                        thumbnail_path, thumbnail_paths, THUMBNAIL_HEIGHT)
+
+DATA_DIR = Path(__file__).parent / 'data'
+
+
+class ThumbnailTests(TestCase):
+
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.settings_override = self.settings(MEDIA_ROOT=self.media_root)
+        self.settings_override.enable()
+        self.image_dir = Path(self.media_root) / IMAGE_SUBDIRECTORY
+        self.image_dir.mkdir()
+        self.image_path = self.image_dir / 'tt1486217.jpg'
+        shutil.copyfile(DATA_DIR / 'archer.jpg', self.image_path)
+
+    def tearDown(self):
+        self.settings_override.disable()
+        shutil.rmtree(self.media_root)
+
+    def create_title(self, **kwargs) -> IMDBTitleSearchData:
+        return IMDBTitleSearchData.objects.create(
+            title='Archer', type=IMDBTitleSearchData.TV, rating=8.6, blurb='', find_results='<ul></ul>',
+            file_path='/tv/Archer', file_mtime=1604372147, file_ctime=1604372147, **kwargs)
+
+    def test_image_stem(self):
+        self.assertEqual({image_stem(path.name) for path in thumbnail_paths(self.image_path)}, {'tt1486217'})
+        self.assertIsNone(image_stem('tt1486217.jpg'))
+        self.assertIsNone(image_stem('tt1486217-100h.jpg'))
+
+    def test_create_thumbnails(self):
+        paths = create_thumbnails(self.image_path)
+        self.assertEqual(sorted(path.name for path in paths),
+                         ['tt1486217-154h.jpg', 'tt1486217-154h.webp', 'tt1486217-77h.jpg', 'tt1486217-77h.webp'])
+        with Image.open(self.image_path) as original:
+            for scale in (1, 2):
+                for image_format in ('jpeg', 'webp'):
+                    with Image.open(thumbnail_path(self.image_path, scale, image_format)) as thumbnail:
+                        self.assertEqual(thumbnail.format.lower(), image_format)
+                        self.assertEqual(thumbnail.height, min(THUMBNAIL_HEIGHT * scale, original.height))
+                        self.assertAlmostEqual(thumbnail.width / thumbnail.height,
+                                               original.width / original.height, delta=0.05)
+
+    def test_ensure_thumbnails_bad_image(self):
+        bad_image_path = self.image_dir / 'bad.jpg'
+        bad_image_path.write_bytes(b'not an image')
+        self.assertFalse(ensure_thumbnails(bad_image_path))
+        self.assertFalse(any(path.exists() for path in thumbnail_paths(bad_image_path)))
+
+    def test_add_image_file_creates_thumbnails(self):
+        title = self.create_title()
+        add_image_file(title, self.image_path)
+        self.assertTrue(has_thumbnails(self.image_path))
+        title.refresh_from_db()
+        self.assertTrue(title.has_thumbnails)
+
+    def test_add_bad_image_file_has_no_thumbnails(self):
+        bad_image_path = self.image_path.with_name('tt0000001.jpg')
+        bad_image_path.write_bytes(b'not an image')
+        title = self.create_title()
+        add_image_file(title, bad_image_path)
+        self.assertFalse(title.has_thumbnails)
+        self.assertIsNone(title.thumbnails)
+
+    def test_thumbnails_property(self):
+        self.assertIsNone(self.create_title().thumbnails)
+        title = self.create_title(image=f'{IMAGE_SUBDIRECTORY}tt1486217.jpg')
+        self.assertIsNone(title.thumbnails)
+        # by name, without checking the files
+        title.has_thumbnails = True
+        self.assertEqual(title.thumbnails, {
+            'src': '/media/title-images/tt1486217-77h.jpg',
+            'jpeg': '/media/title-images/tt1486217-77h.jpg 1x, /media/title-images/tt1486217-154h.jpg 2x',
+            'webp': '/media/title-images/tt1486217-77h.webp 1x, /media/title-images/tt1486217-154h.webp 2x',
+        })
+
+    def test_titles_list_uses_thumbnails(self):
+        self.create_title(image=f'{IMAGE_SUBDIRECTORY}tt1486217.jpg')
+        response = self.client.get(reverse('tv_list'))
+        self.assertContains(response, '<img src="/media/title-images/tt1486217.jpg" height="76.8px" loading="lazy">')
+        create_thumbnails(self.image_path)
+        IMDBTitleSearchData.objects.update(has_thumbnails=True)
+        response = self.client.get(reverse('tv_list'))
+        self.assertContains(response, 'srcset="/media/title-images/tt1486217-77h.webp 1x, '
+                                      '/media/title-images/tt1486217-154h.webp 2x"')
+        self.assertContains(response, 'loading="lazy"')
+
+    def test_make_thumbnails_command(self):
+        self.create_title(image=f'{IMAGE_SUBDIRECTORY}tt1486217.jpg')
+        self.create_title(image=f'{IMAGE_SUBDIRECTORY}tt1486217.jpg')
+        call_command('make_thumbnails', workers=1)
+        self.assertTrue(has_thumbnails(self.image_path))
+        self.assertEqual(list(IMDBTitleSearchData.objects.values_list('has_thumbnails', flat=True)), [True, True])
@@ -0,0 +1,100 @@
+"""Fixed height thumbnails of title images.
+
+The title lists show each poster 76.8px high, so serving the full size image
+wastes bandwidth.  Each image gets JPEG and WebP thumbnails at 1x and 2x that
+height, stored next to the original and named after it:
+
+title-images/<sha256>.jpg - the original, named by its content - see models.store_image
+title-images/<sha256>-77h.jpg, <sha256>-77h.webp - 1x
+title-images/<sha256>-154h.jpg, <sha256>-154h.webp - 2x
+
+Title data records whether its image has thumbnails (has_thumbnails), so the title lists
+link to them without checking the files, and show the original where they weren't made.
+"""
+import logging
+import re
+from pathlib import Path, PurePath
+
+from PIL import Image
+
+from .cache import AtomicFile
+
+logger = logging.getLogger(__name__)
+
+THUMBNAIL_HEIGHT = 77
+SCALES = (1, 2)
+# format -> (file extension, Pillow save options)
+FORMATS = {
+    'jpeg': ('.jpg', {'format': 'JPEG', 'quality': 80, 'optimize': True, 'progressive': True}),
+    'webp': ('.webp', {'format': 'WEBP', 'quality': 80, 'method': 4}),
+}
+THUMBNAIL_NAME = re.compile(r'(?P<stem>.+)-(?:{heights})h(?:{extensions})'.format(
+    heights='|'.join(str(THUMBNAIL_HEIGHT * scale) for scale in SCALES),
+    extensions='|'.join(re.escape(extension) for extension, _ in FORMATS.values())))
+
+
+def thumbnail_path(image_path: PurePath, scale: int, image_format: str) -> PurePath:
+    """:return path, or image field name, of the thumbnail of image_path at scale in image_format"""
+    extension = FORMATS[image_format][0]
+    return image_path.with_name(f'{image_path.stem}-{THUMBNAIL_HEIGHT * scale}h{extension}')
+
+
+def image_stem(thumbnail_name: str) -> str:
+    """:return stem of the image a thumbnail was made from, None if thumbnail_name isn't a thumbnail's"""
+    match = THUMBNAIL_NAME.fullmatch(thumbnail_name)
+    return match.group('stem') if match else None
+
+
+def thumbnail_paths(image_path: Path) -> [Path]:
+    return [thumbnail_path(image_path, scale, image_format) for scale in SCALES for image_format in FORMATS]
+
+
+def has_thumbnails(image_path: Path) -> bool:
+    return all(path.exists() for path in thumbnail_paths(image_path))
+
+
+def create_thumbnails(image_path: Path, mode: int = None) -> [Path]:
+    """Creates the thumbnails for the image at image_path, replacing any that exist.
+
+    Images shorter than a thumbnail height are not scaled up.
+
+    :param mode - permissions for the thumbnail files
+    :return paths of the thumbnails
+    """
+    created = []
+    with Image.open(image_path) as image:
+        image = image.convert('RGB')
+        for scale in SCALES:
+            height = min(THUMBNAIL_HEIGHT * scale, image.height)
+            width = max(1, round(image.width * height / image.height))
+            thumbnail = image.resize((width, height), Image.LANCZOS)
+            for image_format, (_, options) in FORMATS.items():
+                path = thumbnail_path(image_path, scale, image_format)
+                with AtomicFile(path, mode) as f:
+                    thumbnail.save(f, **options)
+                created.append(path)
+    logger.debug(f'created thumbnails for {image_path}')
+    return created
+
+
+def ensure_thumbnails(image_path: Path, mode: int = None, replace: bool = False) -> bool:
+    """Creates the thumbnails for image_path if any are missing.
+
+    Thumbnails are an optimisation, so a bad image is logged rather than raised.
+
+    :param replace - recreate existing thumbnails, e.g. after the image is downloaded again
+    :return True if image_path has thumbnails
+    """
+    if not replace and has_thumbnails(image_path):
+        return True
+    try:
+        create_thumbnails(image_path, mode)
+        return True
+    except (OSError, ValueError) as e:
+        logger.warning(f'could not create thumbnails for {image_path}: {e}')
+        return False
+
+
+def remove_thumbnails(image_path: Path):
+    for path in thumbnail_paths(image_path):
+        path.unlink(missing_ok=True)
@@ -1,22 +1,19 @@
-import requests
 from bs4 import BeautifulSoup
 from pathlib import Path
 import os
 
+from .http_client import fetch_content, FIREFOX_USER_AGENT
+
 __all__ = ('parse_html_for_url', 'save_to_local_file', 'create_subdirs_from_title_list',
            'soup_from_local_file')
 
-# Oct 26, 2022 - may need to update
-# Use this user agent to ensure the page we scrape is roughly as expected
-FIREFOX_USER_AGENT = 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10.15; rv:106.0) Gecko/20100101 Firefox/106.0'
 
+def parse_html_for_url(url, kind='title'):
+    """Fetches url (through the response cache) and parses the html.
 
-def parse_html_for_url(url):
-    r = requests.get(
-        url,
-        headers={'User-Agent': FIREFOX_USER_AGENT}
-    )
-    soup = BeautifulSoup(r.content, 'html.parser')
+    :param kind - 'search' or 'title' - see http_client.fetch_content
+    """
+    soup = BeautifulSoup(fetch_content(url, kind), 'html.parser')
     return soup
 
 
@@ -5,8 +5,9 @@ from django.shortcuts import render
 from django.views import generic
 from django.http import JsonResponse
 from django.db.models import Q
+from django.utils import timezone
 
-from .models import IMDBTitleSearchData, update_image_file
+from .models import IMDBTitleSearchData, update_image_file, release_images
 from .imdb import imdb_title_data
 
 logger = logging.getLogger(__name__)
@@ -55,15 +56,24 @@ def update_title_data(request):
     result = IMDBTitleSearchData.objects.filter(title=title, type=type_)
     if result and len(result) == 1:
         target = result[0]
-        new_title_data = imdb_title_data(title_url)
-        target.rating = new_title_data.rating
-        target.blurb = new_title_data.blurb
-        print(f'image_file (url): {new_title_data.image_file}')
-        update_image_file(target, new_title_data.image_file)
+        # revalidate rather than re-scrape if this is the page the title data came from
+        validators = target.validators() if target.title_url == title_url else None
+        new_title_data = imdb_title_data(title_url, validators)
+        # not modified counts as scraped too
+        target.last_scraped = timezone.now()
+        old_image = None
+        if new_title_data:
+            target.rating = new_title_data.rating
+            target.blurb = new_title_data.blurb
+            target.title_url = title_url
+            target.set_validators(new_title_data.validators)
+            print(f'image_file (url): {new_title_data.image_file}')
+            old_image = update_image_file(target, new_title_data.image_file, save=False)
         target.save()
+        release_images([old_image])
         return_data = {
-            'rating': new_title_data.rating,
-            'blurb': new_title_data.blurb,
+            'rating': target.rating,
+            'blurb': target.blurb,
             'image-url': target.image.url
         }
     else: